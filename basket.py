@@ -0,0 +1,67 @@
+"""Multi-line shopping baskets.
+
+A basket lives in ``context.user_data["basket"]`` as ``{product_id: quantity}``
+in the order lines were added, each quantity being one of the product's
+price tiers (``product["prices"]``).  Prices are never stored in the basket:
+:func:`price_lines` prices it from the current catalog whenever it is shown
+or checked out, and spreads a basket-wide discount over the lines so they
+add up to exactly the invoice total.
+
+Checking out a basket creates one provider invoice and, once paid, writes
+all its lines as orders in one transaction.  The priced lines travel with
+the invoice in ``pending_invoices.lines`` until then.
+"""
+MAX_LINES = 20
+
+
+def get(user_data):
+    basket = user_data.get("basket")
+    if basket is None:
+        basket = user_data["basket"] = {}
+        # A single-product cart saved before baskets existed becomes the first line.
+        product, quantity = user_data.get("cart_product"), user_data.get("cart_quantity")
+        if product and quantity:
+            basket[product["id"]] = quantity
+    return basket
+
+
+def add(basket, product, quantity):
+    """Set the line for ``product`` to ``quantity``; False if the basket is already full."""
+    if product["id"] not in basket and len(basket) >= MAX_LINES:
+        return False
+    basket[product["id"]] = quantity
+    return True
+
+
+def discounted(price, percent):
+    return round(price * (1 - percent / 100), 2) if percent else price
+
+
+def price_lines(basket, catalog, discount_percent=0):
+    """``(lines, subtotal, total)``, lines being ``(product_id, name, quantity, price)``.
+
+    Lines whose product or price tier has left the catalog are dropped from the basket.
+    """
+    lines = []
+    for product_id, quantity in list(basket.items()):
+        product = catalog.get(product_id)
+        if not product or quantity not in product["prices"]:
+            del basket[product_id]
+            continue
+        lines.append([product_id, product["name"], quantity, product["prices"][quantity]])
+    subtotal = round(sum(line[3] for line in lines), 2)
+    total = discounted(subtotal, discount_percent)
+    if lines and discount_percent:
+        for line in lines:
+            line[3] = discounted(line[3], discount_percent)
+        # Rounding each line can drift from the discounted subtotal by a penny or two; the last line absorbs it.
+        lines[-1][3] = round(lines[-1][3] + total - sum(line[3] for line in lines), 2)
+    return [tuple(line) for line in lines], subtotal, total
+
+
+def item_count(lines):
+    return sum(quantity for _, _, quantity, _ in lines)
+
+
+def describe(lines):
+    return ", ".join(f"{name} x{quantity}" for _, name, quantity, _ in lines)
@@ -0,0 +1,82 @@
+"""Announcement-burst benchmark for enter_giveaway.
+
+Several processes, each with a pool of threads, fire entries at one
+giveaway at the same time (every user taps twice, as double-taps do).
+Afterwards the benchmark verifies the cap was enforced exactly, nobody got
+two entries and giveaways.entry_count matches the rows, then reports
+entries/sec.
+
+    python benchmarks/bench_giveaway_entries.py --users 5000 --max-entries 2000
+"""
+import argparse
+import multiprocessing
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from harness import load_bot  # noqa: E402
+
+
+def worker(db_path, giveaway_id, user_ids, threads, start_at, results):
+    bot = load_bot(db_path)
+    while time.time() < start_at:
+        time.sleep(0.001)
+    attempts = [uid for uid in user_ids for _ in range(2)]
+    with ThreadPoolExecutor(threads) as pool:
+        outcomes = list(pool.map(lambda uid: bot.enter_giveaway(giveaway_id, uid, f"user{uid}")[0], attempts))
+    results.put(sum(outcomes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--max-entries", type=int, default=2000)
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=16)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bench.db")
+        bot = load_bot(db_path)
+        end_date = (date.today() + timedelta(days=7)).isoformat()
+        giveaway_id = bot.create_giveaway("Burst", "Benchmark giveaway", end_date, args.max_entries)
+        bot.storage.close()
+
+        user_ids = list(range(1, args.users + 1))
+        shards = [user_ids[i::args.processes] for i in range(args.processes)]
+        results = multiprocessing.Queue()
+        start_at = time.time() + 2.0
+        procs = [multiprocessing.Process(target=worker, args=(db_path, giveaway_id, shard, args.threads, start_at, results))
+                 for shard in shards]
+        for p in procs:
+            p.start()
+        accepted = sum(results.get() for _ in procs)
+        for p in procs:
+            p.join()
+        elapsed = time.time() - start_at
+
+        conn = sqlite3.connect(db_path)
+        rows = conn.execute("SELECT COUNT(*), COUNT(DISTINCT user_id) FROM giveaway_entries WHERE giveaway_id = ?",
+                            (giveaway_id,)).fetchone()
+        entry_count = conn.execute("SELECT entry_count FROM giveaways WHERE id = ?", (giveaway_id,)).fetchone()[0]
+        conn.close()
+
+    expected = min(args.users, args.max_entries)
+    attempts = args.users * 2
+    print(f"attempts:      {attempts} ({args.processes} processes x {args.threads} threads)")
+    print(f"accepted:      {accepted} (expected {expected})")
+    print(f"rows/distinct: {rows[0]}/{rows[1]}, entry_count column: {entry_count}")
+    print(f"throughput:    {attempts / elapsed:8.0f} attempts/sec in {elapsed:.2f}s")
+    ok = accepted == rows[0] == rows[1] == entry_count == expected
+    print("cap enforced exactly" if ok else "MISMATCH")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,314 @@
+"""Updates/sec and per-step latency through the real handler stack.
+
+Builds the Application with ``bot.build_application`` (every handler,
+the callback router and SQLite persistence) but swaps the Bot API transport
+for :class:`FakeTelegram`, which answers every method with canned JSON, and
+points payments at ``stub_provider.py``.  Synthetic updates for the real
+flows are fed to ``Application.process_update``:
+
+* shop:     /start, menu_shop, select_, qty_, enter_address, address text,
+            apply_discount, code text, checkout, check_ (every other user
+            puts a second product in the cart and uses a referral code)
+* giveaway: menu_giveaways, giveaway_, enter_giveaway_
+* admin:    admin_panel, admin_stats, /bot_status (one admin, repeated)
+
+Every simulated user runs the shop and giveaway flows concurrently with the
+others.  Each user count gets a fresh database, and the report shows
+throughput, p50/p95/p99 per step and time spent waiting on the database,
+and checks that admin stats, the daily order cap and the referral totals
+each counted every paid checkout once.  Handler exceptions are counted by
+an error handler and listed; the run exits non-zero if there were any.
+
+    python benchmarks/bench_handlers.py --users 10 100 500 --api-latency 0.03
+"""
+import argparse
+import asyncio
+import collections
+import itertools
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from harness import BENCH_ADMIN_ID, load_bot  # noqa: E402
+from stub_provider import StubProvider  # noqa: E402
+
+from telegram import Update  # noqa: E402
+from telegram.request import BaseRequest  # noqa: E402
+
+import metrics  # noqa: E402
+import ratelimit  # noqa: E402
+
+BOT_USER = {"id": 999999, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+DISCOUNT_CODE = "BENCH10"
+FIRST_USER_ID = 1000
+
+
+class FakeTelegram(BaseRequest):
+    """Bot API transport that never leaves the process.
+
+    Every call sleeps ``latency`` seconds (a stand-in for the round trip to
+    Telegram) and returns a minimal valid result for the method.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = collections.Counter()
+        self._message_ids = itertools.count(1)
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        name = url.rsplit("/", 1)[-1]
+        self.calls[name] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        params = request_data.parameters if request_data else {}
+        if name == "getMe":
+            result = BOT_USER
+        elif name.startswith(("send", "edit")):
+            result = {"message_id": next(self._message_ids), "date": int(time.time()),
+                      "chat": {"id": int(params.get("chat_id", 0)), "type": "private"},
+                      "from": BOT_USER, "text": params.get("text", "")}
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+class UpdateFactory:
+    def __init__(self, bot):
+        self.bot = bot
+        self._ids = itertools.count(1)
+
+    def _user(self, user_id):
+        return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"user{user_id}"}
+
+    def _message(self, user_id, text, from_bot=False):
+        message = {"message_id": next(self._ids), "date": int(time.time()),
+                   "chat": {"id": user_id, "type": "private"},
+                   "from": BOT_USER if from_bot else self._user(user_id), "text": text}
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return message
+
+    def text(self, user_id, text):
+        return Update.de_json({"update_id": next(self._ids), "message": self._message(user_id, text)}, self.bot)
+
+    def callback(self, user_id, data):
+        return Update.de_json({"update_id": next(self._ids), "callback_query": {
+            "id": str(next(self._ids)), "from": self._user(user_id), "chat_instance": str(user_id),
+            "data": data, "message": self._message(user_id, "menu", from_bot=True),
+        }}, self.bot)
+
+
+class Recorder:
+    def __init__(self):
+        self.steps = collections.defaultdict(metrics.Histogram)
+        self.updates = 0
+        self.failures = 0
+        self.rate_limited = 0
+        self.errors = collections.Counter()
+
+    async def send(self, app, step, update):
+        started = time.perf_counter()
+        await app.process_update(update)
+        self.steps[step].observe(time.perf_counter() - started)
+        self.updates += 1
+
+    async def on_error(self, update, context):
+        # process_update never raises for a failing handler; the Application hands the exception here instead.
+        self.failures += 1
+        self.errors[repr(context.error)] += 1
+
+
+async def shop_flow(app, factory, recorder, user_id, lines, code=DISCOUNT_CODE):
+    steps = [
+        ("/start", factory.text(user_id, "/start")),
+        ("menu_shop", factory.callback(user_id, "menu_shop")),
+    ]
+    for product_id, qty in lines:
+        steps += [
+            ("select_", factory.callback(user_id, f"select_{product_id}")),
+            ("qty_", factory.callback(user_id, f"qty_{qty}")),
+        ]
+    steps += [
+        ("enter_address", factory.callback(user_id, "enter_address")),
+        ("address text", factory.text(user_id, f"User {user_id}\n1 Bench Street\nLondon")),
+        ("apply_discount", factory.callback(user_id, "apply_discount")),
+        ("code text", factory.text(user_id, code)),
+        ("checkout", factory.callback(user_id, "checkout")),
+    ]
+    product_id = lines[0][0]
+    for step, update in steps:
+        await recorder.send(app, step, update)
+    invoice_id = app.user_data[user_id].get("pending_invoice_id")
+    if invoice_id:
+        await recorder.send(app, "check_", factory.callback(user_id, f"check_{invoice_id}_{product_id}"))
+
+
+async def giveaway_flow(app, factory, recorder, user_id, giveaway_id):
+    await recorder.send(app, "menu_giveaways", factory.callback(user_id, "menu_giveaways"))
+    await recorder.send(app, "giveaway_", factory.callback(user_id, f"giveaway_{giveaway_id}"))
+    await recorder.send(app, "enter_giveaway_", factory.callback(user_id, f"enter_giveaway_{giveaway_id}"))
+
+
+async def user_session(app, factory, recorder, user_id, giveaway_id, products):
+    lines = []
+    for n in range(1 + user_id % 2):
+        product = products[(user_id + n) % len(products)]
+        lines.append((product["id"], sorted(product["prices"])[user_id % len(product["prices"])]))
+    code = f"REF{BENCH_ADMIN_ID}" if user_id % 2 else DISCOUNT_CODE
+    await shop_flow(app, factory, recorder, user_id, lines, code)
+    await giveaway_flow(app, factory, recorder, user_id, giveaway_id)
+
+
+async def admin_session(app, factory, recorder, rounds):
+    for _ in range(rounds):
+        await recorder.send(app, "admin_panel", factory.callback(BENCH_ADMIN_ID, "admin_panel"))
+        await recorder.send(app, "admin_stats", factory.callback(BENCH_ADMIN_ID, "admin_stats"))
+        await recorder.send(app, "/bot_status", factory.text(BENCH_ADMIN_ID, "/bot_status"))
+
+
+def snapshot(name):
+    return {tuple(sorted(labels.items())): h.snapshot() for labels, h in metrics.REGISTRY.histograms(name)}
+
+
+def delta(before, after):
+    """Histograms of what was recorded between two snapshots."""
+    result = {}
+    for key, (count, total, buckets) in after.items():
+        old_count, old_total, old_buckets = before.get(key, (0, 0.0, [0] * len(buckets)))
+        hist = metrics.Histogram()
+        hist.count = count - old_count
+        hist.sum = total - old_total
+        hist.buckets = [b - o for b, o in zip(buckets, old_buckets)]
+        result[dict(key).get("conn") or dict(key).get("op") or "all"] = hist
+    return result
+
+
+def order_counters(bot):
+    """Paid checkouts per the orders table, and as counted by admin stats, the daily cap and referral totals."""
+    fetch = lambda sql: bot.storage.fetchone(sql)[0]  # noqa: E731
+    return {
+        "orders": fetch("SELECT COUNT(DISTINCT invoice_id) FROM orders"),
+        "referred": fetch("SELECT COUNT(DISTINCT invoice_id) FROM orders WHERE referred_by IS NOT NULL"),
+        "admin stats": bot.stats.get_counters()["orders"],
+        "daily cap": fetch("SELECT COALESCE(SUM(orders), 0) FROM daily_orders"),
+        "referral totals": fetch("SELECT COALESCE(SUM(orders), 0) FROM referral_stats"),
+    }
+
+
+def rate_limited():
+    return sum(metrics.REGISTRY.counter("rate_limited_total", action=action) for action in ratelimit.LIMITS)
+
+
+def ms(seconds):
+    return "   inf" if seconds == float("inf") else f"{seconds * 1000:6.1f}"
+
+
+async def run_level(bot, db_path, users, admin_rounds, api_latency):
+    bot.storage.configure(db_path)
+    bot.init_db()
+    # Levels reuse the same user ids; start every level with empty token buckets.
+    bot.rate_limiter = ratelimit.RateLimiter(bot.rate_limiter.limits, bot.rate_limiter.admin_commands)
+    bot.add_discount_code(DISCOUNT_CODE, 10, (date.today() + timedelta(days=30)).isoformat())
+    giveaway_id = bot.create_giveaway("Bench", "Benchmark giveaway", (date.today() + timedelta(days=7)).isoformat(),
+                                      max_entries=users)
+
+    transport = FakeTelegram(api_latency)
+    app = bot.build_application(request=transport)
+    factory = UpdateFactory(app.bot)
+    recorder = Recorder()
+    app.add_error_handler(recorder.on_error)
+    products = bot.product_catalog.catalog.products
+    names = ("storage_lock_wait_seconds", "storage_transaction_seconds", "storage_query_seconds")
+
+    await app.initialize()
+    await app.start()
+    before = {name: snapshot(name) for name in names}
+    limited_before = rate_limited()
+    started = time.perf_counter()
+    await asyncio.gather(
+        admin_session(app, factory, recorder, admin_rounds),
+        *(user_session(app, factory, recorder, FIRST_USER_ID + i, giveaway_id, products) for i in range(users)),
+    )
+    elapsed = time.perf_counter() - started
+    # The gate answers a rejected update without raising, so count it here.
+    recorder.rate_limited = rate_limited() - limited_before
+    recorder.failures += recorder.rate_limited
+    contention = {name: delta(before[name], snapshot(name)) for name in names}
+    await app.stop()
+    await app.shutdown()
+
+    orders = order_counters(bot)
+    entries = bot.storage.fetchone("SELECT entry_count FROM giveaways WHERE id = ?", (giveaway_id,))[0]
+    return recorder, transport, contention, elapsed, orders, entries
+
+
+def report(users, recorder, transport, contention, elapsed, orders, entries):
+    print(f"\n=== {users} users: {recorder.updates} updates in {elapsed:.2f}s "
+          f"= {recorder.updates / elapsed:,.0f} updates/sec ({recorder.failures} failed, "
+          f"{recorder.rate_limited} of them rate-limited) ===")
+    print(f"orders saved: {orders['orders']}/{users}   giveaway entries: {entries}/{users}   "
+          f"Bot API calls: {sum(transport.calls.values())}")
+    expected = {"admin stats": orders["orders"], "daily cap": orders["orders"], "referral totals": orders["referred"]}
+    wrong = {name: f"{orders[name]} (expected {count})" for name, count in expected.items() if orders[name] != count}
+    print(f"order counters: {wrong or 'ok'}")
+    for error, count in recorder.errors.most_common(5):
+        print(f"handler error x{count}: {error}")
+    print(f"{'step':<16}{'count':>7}{'avg ms':>8}{'p50 ≤':>8}{'p95 ≤':>8}{'p99 ≤':>8}")
+    for step, hist in recorder.steps.items():
+        print(f"{step:<16}{hist.count:>7}{ms(hist.average):>8}{ms(hist.percentile(0.5)):>8}"
+              f"{ms(hist.percentile(0.95)):>8}{ms(hist.percentile(0.99)):>8}")
+    print("database:")
+    for label, hist in contention["storage_lock_wait_seconds"].items():
+        print(f"  wait for {label:<7} {hist.count:>7} waits, avg {ms(hist.average)} ms, p99 ≤ {ms(hist.percentile(0.99))} ms")
+    for label, hist in contention["storage_transaction_seconds"].items():
+        print(f"  write lock held {hist.count:>7} txns,  avg {ms(hist.average)} ms, p99 ≤ {ms(hist.percentile(0.99))} ms")
+    busy = sum(h.sum for h in contention["storage_query_seconds"].values())
+    print(f"  time in storage calls: {busy:.2f}s ({busy / elapsed:.0%} of wall clock)")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, nargs="+", default=[10, 100, 500])
+    parser.add_argument("--admin-rounds", type=int, default=20)
+    parser.add_argument("--api-latency", type=float, default=0.0, help="seconds per fake Bot API call")
+    parser.add_argument("--provider-latency", type=float, default=0.02, help="seconds per payment provider call")
+    args = parser.parse_args()
+
+    provider = StubProvider(latency=args.provider_latency).start()
+    with tempfile.TemporaryDirectory() as tmp:
+        # The single benchmark admin replays the panel far faster than the per-user admin limit allows.
+        bot = load_bot(os.path.join(tmp, "bench.db"), OXAPAY_API_KEY="bench-key", PAYMENT_API_URL=provider.url,
+                       RATE_LIMITS={"admin": (10000, 60)})
+        logging.getLogger().setLevel(logging.WARNING)
+        errors = 0
+        for n, users in enumerate(args.users):
+            results = await run_level(bot, os.path.join(tmp, f"bench{n}.db"), users, args.admin_rounds,
+                                      args.api_latency)
+            report(users, *results)
+            errors += sum(results[0].errors.values())
+        await bot.payments.close()
+        bot.storage.close()
+    provider.shutdown()
+    if errors:
+        sys.exit(f"{errors} updates raised in a handler")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
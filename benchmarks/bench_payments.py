@@ -0,0 +1,78 @@
+"""Checkout throughput against the local stub provider.
+
+Each simulated checkout creates an invoice and then checks its status, the
+same two provider calls checkout_handler and the "I've paid" button make.
+Checkouts run concurrently through the shared PaymentClient; with
+``--blocking`` the old synchronous ``requests`` calls are timed as well for
+comparison.
+
+    python benchmarks/bench_payments.py --checkouts 500 --latency 0.05
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import payments  # noqa: E402
+from stub_provider import StubProvider  # noqa: E402
+
+
+async def checkout(client, i):
+    invoice = await client.create_invoice(10.0, "GBP", f"{i}_1_{int(time.time())}", "Sample Product A")
+    if not invoice:
+        return False
+    status = await client.check_invoice(invoice["invoice_id"])
+    return bool(status) and status.get("status") == "paid"
+
+
+async def run_async(url, checkouts, concurrency, connections):
+    client = payments.PaymentClient("bench-key", base_url=url, max_concurrency=concurrency,
+                                    max_connections=connections)
+    start = time.perf_counter()
+    results = await asyncio.gather(*(checkout(client, i) for i in range(checkouts)))
+    elapsed = time.perf_counter() - start
+    await client.aclose()
+    return sum(results), elapsed
+
+
+def run_blocking(url, checkouts):
+    import requests
+
+    start = time.perf_counter()
+    ok = 0
+    for i in range(checkouts):
+        r = requests.post(f"{url}/merchant/invoice", json={"out": "10.0", "order_id": str(i)},
+                          headers={"Authorization": "bench-key"})
+        invoice_id = r.json()["result"]["invoice_id"]
+        r = requests.get(f"{url}/merchant/invoice/{invoice_id}", headers={"Authorization": "bench-key"})
+        ok += r.json()["result"]["status"] == "paid"
+    return ok, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--checkouts", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=payments.DEFAULT_MAX_CONCURRENCY)
+    parser.add_argument("--connections", type=int, default=payments.DEFAULT_MAX_CONNECTIONS)
+    parser.add_argument("--latency", type=float, default=0.05, help="stub provider latency in seconds")
+    parser.add_argument("--blocking", action="store_true", help="also time sequential blocking requests")
+    args = parser.parse_args()
+
+    server = StubProvider(latency=args.latency).start()
+    try:
+        ok, elapsed = asyncio.run(run_async(server.url, args.checkouts, args.concurrency, args.connections))
+        print(f"async client:  {ok}/{args.checkouts} paid in {elapsed:6.2f}s  "
+              f"({args.checkouts / elapsed:8.1f} checkouts/sec)")
+        if args.blocking:
+            ok, elapsed = run_blocking(server.url, args.checkouts)
+            print(f"blocking:      {ok}/{args.checkouts} paid in {elapsed:6.2f}s  "
+                  f"({args.checkouts / elapsed:8.1f} checkouts/sec)")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
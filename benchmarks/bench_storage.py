@@ -0,0 +1,106 @@
+"""Micro-benchmark: connect-per-call sqlite3 vs the pooled storage layer.
+
+Runs the same mix of queries bot.py issues on a button tap (recent orders,
+discount lookup, order insert) both ways against a scratch database and
+prints queries/sec for each.
+
+    python benchmarks/bench_storage.py [--seconds 3] [--orders 5000]
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import storage  # noqa: E402
+
+SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS orders (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp TEXT, user_id INTEGER,
+        product_id INTEGER, product_name TEXT, quantity INTEGER, price REAL,
+        invoice_id TEXT, discount_code TEXT, discount_percent INTEGER,
+        referred_by TEXT, address TEXT)""",
+    "CREATE TABLE IF NOT EXISTS discount_codes (code TEXT PRIMARY KEY, percent INTEGER, expires TEXT)",
+)
+RECENT = "SELECT timestamp, user_id, product_id, product_name, quantity, price, invoice_id, discount_code, discount_percent, referred_by, address FROM orders ORDER BY id DESC LIMIT ?"
+CODE = "SELECT code, percent, expires FROM discount_codes WHERE code = ?"
+INSERT = "INSERT INTO orders (timestamp, user_id, product_id, product_name, quantity, price, invoice_id, discount_code, discount_percent, referred_by, address) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+
+
+def order_row(i):
+    return (datetime.now().isoformat(), 1000 + i % 500, 1, "Sample Product A", 1, 10.0, str(i), None, 0, None, "addr")
+
+
+def seed(path, orders):
+    conn = sqlite3.connect(path)
+    for ddl in SCHEMA:
+        conn.execute(ddl)
+    conn.executemany(INSERT, (order_row(i) for i in range(orders)))
+    conn.executemany("INSERT OR REPLACE INTO discount_codes VALUES (?, ?, ?)",
+                     [(f"CODE{i}", 10, "2099-01-01") for i in range(100)])
+    conn.commit()
+    conn.close()
+
+
+def legacy_step(path, i):
+    # Mirrors the original bot.py functions: connect, query, close.
+    conn = sqlite3.connect(path)
+    conn.execute(RECENT, (10,)).fetchall()
+    conn.close()
+    conn = sqlite3.connect(path)
+    conn.execute(CODE, (f"CODE{i % 100}",)).fetchone()
+    conn.close()
+    if i % 10 == 0:
+        conn = sqlite3.connect(path)
+        conn.execute(INSERT, order_row(i))
+        conn.commit()
+        conn.close()
+
+
+def pooled_step(path, i):
+    storage.fetchall(RECENT, (10,))
+    storage.fetchone(CODE, (f"CODE{i % 100}",))
+    if i % 10 == 0:
+        storage.execute(INSERT, order_row(i))
+
+
+def run(step, path, seconds):
+    queries = 0
+    i = 0
+    deadline = time.perf_counter() + seconds
+    start = time.perf_counter()
+    while time.perf_counter() < deadline:
+        step(path, i)
+        queries += 3 if i % 10 == 0 else 2
+        i += 1
+    return queries / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=3.0)
+    parser.add_argument("--orders", type=int, default=5000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_path = os.path.join(tmp, "legacy.db")
+        pooled_path = os.path.join(tmp, "pooled.db")
+        seed(legacy_path, args.orders)
+        seed(pooled_path, args.orders)
+
+        legacy_qps = run(legacy_step, legacy_path, args.seconds)
+        storage.configure(pooled_path)
+        pooled_qps = run(pooled_step, pooled_path, args.seconds)
+        storage.close()
+
+    print(f"connect-per-call: {legacy_qps:10.0f} queries/sec")
+    print(f"pooled + WAL:     {pooled_qps:10.0f} queries/sec")
+    print(f"speedup:          {pooled_qps / legacy_qps:10.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""End-to-end throughput of updates POSTed to the webhook server.
+
+Starts the real Application in webhook mode on a local port (Bot API calls
+still go to :class:`bench_handlers.FakeTelegram`) and POSTs synthetic
+updates at it from many concurrent HTTP clients, the way Telegram delivers
+them in production.  Reports how fast updates are accepted (HTTP 200) and
+how fast the handlers finish them, with ``CONCURRENT_UPDATES`` handlers in
+flight.  A few requests with a wrong secret token check they get a 403.
+
+    python benchmarks/bench_webhook.py --updates 2000 --clients 100 --concurrent-updates 1 64
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_handlers import FIRST_USER_ID, FakeTelegram, UpdateFactory, ms  # noqa: E402
+from harness import load_bot  # noqa: E402
+
+import httpx  # noqa: E402
+from telegram import Update  # noqa: E402
+from telegram.ext import TypeHandler  # noqa: E402
+
+import metrics  # noqa: E402
+
+SECRET_TOKEN = "bench-secret"
+URL_PATH = "telegram"
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def payloads(factory, count, users, giveaway_id):
+    """Browse-only updates (no payments), cycling through ``users`` chats."""
+    for n in range(count):
+        user_id = FIRST_USER_ID + n % users
+        step = n // users % 4
+        if step == 0:
+            update = factory.text(user_id, "/start")
+        elif step == 1:
+            update = factory.callback(user_id, "menu_shop")
+        elif step == 2:
+            update = factory.callback(user_id, "menu_giveaways")
+        else:
+            update = factory.callback(user_id, f"giveaway_{giveaway_id}")
+        yield update.to_json()
+
+
+async def run_level(bot, db_path, args, concurrent_updates, port):
+    bot.storage.configure(db_path)
+    bot.init_db()
+    giveaway_id = bot.create_giveaway("Bench", "Webhook benchmark", (date.today() + timedelta(days=7)).isoformat())
+    bot.config.CONCURRENT_UPDATES = concurrent_updates
+
+    app = bot.build_application(request=FakeTelegram(args.api_latency))
+    done = asyncio.Event()
+    processed = 0
+
+    async def count(update, context):
+        nonlocal processed
+        processed += 1
+        if processed == args.updates:
+            done.set()
+
+    # Last group, so it runs once every other handler has finished with the update.
+    app.add_handler(TypeHandler(Update, count), group=99)
+    factory = UpdateFactory(app.bot)
+    bodies = list(payloads(factory, args.updates, args.users, giveaway_id))
+
+    await app.initialize()
+    await app.updater.start_webhook(listen="127.0.0.1", port=port, url_path=URL_PATH, secret_token=SECRET_TOKEN,
+                                    webhook_url=f"https://bench.invalid/{URL_PATH}")
+    await app.start()
+
+    url = f"http://127.0.0.1:{port}/{URL_PATH}"
+    headers = {SECRET_HEADER: SECRET_TOKEN, "Content-Type": "application/json"}
+    post_latency = metrics.Histogram()
+    failed = 0
+    limits = httpx.Limits(max_connections=args.clients, max_keepalive_connections=args.clients)
+    async with httpx.AsyncClient(limits=limits, timeout=30) as client:
+        rejected = [(await client.post(url, content=bodies[0], headers={**headers, SECRET_HEADER: "wrong"})).status_code
+                    for _ in range(3)]
+        queue = iter(bodies)
+
+        async def sender():
+            nonlocal failed
+            for body in queue:
+                started = time.perf_counter()
+                response = await client.post(url, content=body, headers=headers)
+                post_latency.observe(time.perf_counter() - started)
+                if response.status_code != 200:
+                    failed += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(sender() for _ in range(args.clients)))
+        accepted = time.perf_counter() - started
+        try:
+            await asyncio.wait_for(done.wait(), timeout=120)
+        except asyncio.TimeoutError:
+            pass
+        finished = time.perf_counter() - started
+
+    await app.updater.stop()
+    await app.stop()
+    await app.shutdown()
+    return post_latency, failed, rejected, accepted, finished, processed
+
+
+def report(args, concurrent_updates, post_latency, failed, rejected, accepted, finished, processed):
+    print(f"\n=== CONCURRENT_UPDATES={concurrent_updates}: {args.updates} updates from {args.clients} clients ===")
+    print(f"accepted in {accepted:.2f}s = {args.updates / accepted:,.0f} updates/sec ({failed} non-200)")
+    print(f"processed {processed}/{args.updates} in {finished:.2f}s = {processed / finished:,.0f} updates/sec")
+    print(f"POST latency ms: avg {ms(post_latency.average)}  p50 ≤ {ms(post_latency.percentile(0.5))}  "
+          f"p95 ≤ {ms(post_latency.percentile(0.95))}  p99 ≤ {ms(post_latency.percentile(0.99))}")
+    print(f"wrong secret token answered with: {sorted(set(rejected))}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=500, help="distinct chats the updates come from")
+    parser.add_argument("--clients", type=int, default=100, help="concurrent HTTP connections posting updates")
+    parser.add_argument("--concurrent-updates", type=int, nargs="+", default=[1, 64])
+    parser.add_argument("--api-latency", type=float, default=0.03, help="seconds per fake Bot API call")
+    parser.add_argument("--port", type=int, default=8787)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        bot = load_bot(os.path.join(tmp, "bench.db"))
+        logging.getLogger().setLevel(logging.WARNING)
+        for n, concurrent_updates in enumerate(args.concurrent_updates):
+            results = await run_level(bot, os.path.join(tmp, f"bench{n}.db"), args, concurrent_updates, args.port)
+            report(args, concurrent_updates, *results)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
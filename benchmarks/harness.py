@@ -0,0 +1,49 @@
+"""Shared setup for benchmarks that exercise bot.py itself.
+
+``load_bot`` installs a synthetic ``config`` module pointing at a scratch
+database before importing bot.py, so benchmarks never touch a real
+config.py, token or orders.db.
+"""
+import os
+import sys
+import types
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+BENCH_ADMIN_ID = 1
+
+BENCH_PRODUCTS = [
+    {"id": 1, "name": "Sample Product A", "description": "Benchmark product A.",
+     "prices": {1: 10.0, 5: 45.0, 10: 80.0}, "image": "product_a.jpg"},
+    {"id": 2, "name": "Sample Product B", "description": "Benchmark product B.",
+     "prices": {1: 20.0, 5: 90.0, 10: 160.0}, "image": "product_b.jpg"},
+]
+
+
+def make_config(db_path, **overrides):
+    config = types.ModuleType("config")
+    config.TELEGRAM_BOT_TOKEN = "123456:bench"
+    config.OXAPAY_API_KEY = ""
+    config.ADMIN_USER_ID = BENCH_ADMIN_ID
+    config.SUPPORT_HANDLE = "@bench"
+    config.SHOP_IMAGE = "shop_banner.jpg"
+    config.CURRENCY = "GBP"
+    config.PRODUCTS = BENCH_PRODUCTS
+    config.DATABASE_FILE = db_path
+    config.MAX_ORDERS_PER_USER = 10
+    config.RATE_LIMIT_SECONDS = 60
+    for name, value in overrides.items():
+        setattr(config, name, value)
+    return config
+
+
+def load_bot(db_path, **overrides):
+    """Import bot.py against a scratch database and create its tables."""
+    sys.modules["config"] = make_config(db_path, **overrides)
+    import bot
+
+    bot.storage.configure(db_path)
+    bot.init_db()
+    return bot
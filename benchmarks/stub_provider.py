@@ -0,0 +1,93 @@
+"""Local stand-in for the crypto payment provider API.
+
+Serves the two endpoints the bot uses with keep-alive HTTP/1.1 and an
+optional artificial latency, so payment throughput can be measured without
+touching the real provider:
+
+    POST /merchant/invoice            -> {"result": {"invoice_id", "pay_url"}}
+    GET  /merchant/invoice/<id>       -> {"result": {"status": "paid" | "pending"}}
+
+Run standalone with ``python benchmarks/stub_provider.py --port 8081`` and set
+``PAYMENT_API_URL = "http://127.0.0.1:8081"`` in config.py.
+"""
+import argparse
+import itertools
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubProviderHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        if self.path != "/merchant/invoice":
+            self._reply(404, {"error": "not found"})
+            return
+        time.sleep(self.server.latency)
+        invoice_id = str(next(self.server.invoice_ids))
+        self._reply(200, {"result": {
+            "invoice_id": invoice_id,
+            "pay_url": f"http://{self.server.server_address[0]}/pay/{invoice_id}",
+        }})
+
+    def do_GET(self):
+        prefix = "/merchant/invoice/"
+        if not self.path.startswith(prefix):
+            self._reply(404, {"error": "not found"})
+            return
+        time.sleep(self.server.latency)
+        invoice_id = self.path[len(prefix):]
+        status = "paid" if invoice_id in self.server.paid else self.server.default_status
+        self._reply(200, {"result": {"invoice_id": invoice_id, "status": status}})
+
+
+class StubProvider(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, default_status="paid"):
+        super().__init__((host, port), StubProviderHandler)
+        self.latency = latency
+        self.default_status = default_status
+        self.paid = set()
+        self.invoice_ids = itertools.count(10000000)
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub crypto payment provider")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--status", default="paid", choices=["paid", "pending"])
+    args = parser.parse_args()
+    server = StubProvider(args.host, args.port, args.latency, args.status)
+    print(f"Stub provider listening on {server.url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
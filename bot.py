@@ -1,15 +1,48 @@
 import logging
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import ApplicationBuilder, CommandHandler, CallbackQueryHandler, ContextTypes, MessageHandler, filters
-import requests
+from telegram.ext import (ApplicationBuilder, ApplicationHandlerStop, CommandHandler, CallbackQueryHandler, ContextTypes,
+                          MessageHandler, TypeHandler, filters)
+from telegram.request import HTTPXRequest
 import config
 import time
-import random
-import sqlite3
+import secrets
 from datetime import datetime, date
+import asyncio
 import os
+import tempfile
+from urllib.parse import urlsplit
+import basket
+import broadcast
+import catalog
+import discounts
+import draws
+import export
+import metrics
+import migrations
+import order_browser
+import payments
+import persistence
+import ratelimit
+import referrals
+import render
+import router
+import settlement
+import stats
+import storage
+import workers
 
 ADMIN_USER_ID = config.ADMIN_USER_ID  # Get from config file
+MAX_ORDERS_PER_USER = getattr(config, "MAX_ORDERS_PER_USER", None)  # Paid orders per user per day; None for no cap
+MAX_DOCUMENT_SIZE = 50 * 1024 * 1024  # Telegram bot upload limit
+
+storage.configure(getattr(config, "DATABASE_FILE", "orders.db"))
+payments.configure(
+    config.OXAPAY_API_KEY,
+    base_url=getattr(config, "PAYMENT_API_URL", payments.DEFAULT_API_URL),
+    timeout=getattr(config, "PAYMENT_TIMEOUT_SECONDS", payments.DEFAULT_TIMEOUT),
+    max_concurrency=getattr(config, "PAYMENT_MAX_CONCURRENCY", payments.DEFAULT_MAX_CONCURRENCY),
+)
+discounts.cache.ttl = getattr(config, "DISCOUNT_CACHE_SECONDS", discounts.CACHE_TTL)
 
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -17,65 +50,31 @@ logging.basicConfig(
 )
 
 def init_db():
-    conn = sqlite3.connect("orders.db")
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS orders (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        timestamp TEXT,
-        user_id INTEGER,
-        product_id INTEGER,
-        product_name TEXT,
-        quantity INTEGER,
-        price REAL,
-        invoice_id TEXT,
-        discount_code TEXT,
-        discount_percent INTEGER,
-        referred_by TEXT,
-        address TEXT
-    )''')
-    c.execute('''CREATE TABLE IF NOT EXISTS discount_codes (
-        code TEXT PRIMARY KEY,
-        percent INTEGER,
-        expires TEXT
-    )''')
-    conn.commit()
-    conn.close()
-
-def save_order(user_id, product, quantity, price, invoice_id, discount_code=None, discount_percent=0, referred_by=None, address=None):
-    conn = sqlite3.connect("orders.db")
-    c = conn.cursor()
-    c.execute("INSERT INTO orders (timestamp, user_id, product_id, product_name, quantity, price, invoice_id, discount_code, discount_percent, referred_by, address) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
-              (datetime.now().isoformat(), user_id, product["id"], product["name"], quantity, price, invoice_id, discount_code, discount_percent, referred_by, address))
-    conn.commit()
-    conn.close()
-
-def get_recent_orders(limit=10):
-    conn = sqlite3.connect("orders.db")
-    c = conn.cursor()
-    c.execute("SELECT timestamp, user_id, product_id, product_name, quantity, price, invoice_id, discount_code, discount_percent, referred_by, address FROM orders ORDER BY id DESC LIMIT ?", (limit,))
-    rows = c.fetchall()
-    conn.close()
-    return rows
-
-def add_discount_code(code, percent, expires):
-    conn = sqlite3.connect("orders.db")
-    c = conn.cursor()
-    c.execute("REPLACE INTO discount_codes (code, percent, expires) VALUES (?, ?, ?)", (code.upper(), percent, expires))
-    conn.commit()
-    conn.close()
+    migrations.migrate()
+    if getattr(config, "CATALOG_SOURCE", "config") == "db" and not storage.fetchone("SELECT 1 FROM products LIMIT 1"):
+        # First run with a database catalog: seed it from config.PRODUCTS
+        catalog.upsert_products(config.PRODUCTS)
+
+def save_order(user_id, lines, invoice_id, discount_code=None, discount_percent=0, referred_by=None, address=None):
+    # One transaction per checkout: a row per basket line, (product_id, name, quantity, price).
+    timestamp = datetime.now().isoformat()
+    with storage.transaction() as c:
+        order_ids = []
+        for line, (product_id, product_name, quantity, price) in enumerate(lines):
+            cur = c.execute("INSERT INTO orders (timestamp, user_id, product_id, product_name, quantity, price, invoice_id, line, discount_code, discount_percent, referred_by, address) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                            (timestamp, user_id, product_id, product_name, quantity, price, invoice_id, line, discount_code, discount_percent, referred_by, address))
+            order_ids.append(cur.lastrowid)
+        # One order per checkout in every counter; quantity and revenue are kept per line.
+        stats.record_order(c, lines)
+        ratelimit.record_order(c, user_id)
+        if referred_by:
+            referrals.record(c, order_ids[0], referred_by, user_id, sum(line[3] for line in lines))
+
+def add_discount_code(code, percent, expires, max_uses=None):
+    discounts.save(code, percent, expires, max_uses)
 
 def get_discount_code(code):
-    conn = sqlite3.connect("orders.db")
-    c = conn.cursor()
-    c.execute("SELECT code, percent, expires FROM discount_codes WHERE code = ?", (code.upper(),))
-    row = c.fetchone()
-    conn.close()
-    if row:
-        expires = row[2]
-        if expires and date.fromisoformat(expires) < date.today():
-            return None
-        return {"code": row[0], "percent": row[1], "expires": row[2]}
-    return None
+    return discounts.get(code)
 
 def generate_referral_code(user_id):
     return f"REF{user_id}"
@@ -85,143 +84,180 @@ def get_referrer_from_code(code):
         return int(code[3:])
     return None
 
-def init_giveaway_db():
-    conn = sqlite3.connect("orders.db")
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS giveaways (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        title TEXT,
-        description TEXT,
-        prize TEXT,
-        start_date TEXT,
-        end_date TEXT,
-        max_entries INTEGER,
-        is_active INTEGER DEFAULT 1
-    )''')
-    c.execute('''CREATE TABLE IF NOT EXISTS giveaway_entries (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        giveaway_id INTEGER,
-        user_id INTEGER,
-        username TEXT,
-        entry_date TEXT,
-        FOREIGN KEY (giveaway_id) REFERENCES giveaways (id)
-    )''')
-    conn.commit()
-    conn.close()
-
 def create_giveaway(title, description, end_date, max_entries=100):
-    conn = sqlite3.connect("orders.db")
-    c = conn.cursor()
     start_date = date.today().isoformat()
-    c.execute("INSERT INTO giveaways (title, description, prize, start_date, end_date, max_entries) VALUES (?, ?, ?, ?, ?, ?)",
-              (title, description, f"Prize from {title}", start_date, end_date, max_entries))
-    giveaway_id = c.lastrowid
-    conn.commit()
-    conn.close()
-    return giveaway_id
+    cur = storage.execute("INSERT INTO giveaways (title, description, prize, start_date, end_date, max_entries) VALUES (?, ?, ?, ?, ?, ?)",
+                          (title, description, f"Prize from {title}", start_date, end_date, max_entries))
+    return cur.lastrowid
 
 def get_active_giveaways():
-    conn = sqlite3.connect("orders.db")
-    c = conn.cursor()
-    c.execute("SELECT id, title, description, prize, start_date, end_date, max_entries FROM giveaways WHERE is_active = 1 AND end_date > ? ORDER BY end_date ASC", (date.today().isoformat(),))
-    rows = c.fetchall()
-    conn.close()
-    return rows
+    # entry_count (last column) is maintained by enter_giveaway, so callers never need to count entries
+    return storage.fetchall("SELECT id, title, description, prize, start_date, end_date, max_entries, entry_count FROM giveaways WHERE is_active = 1 AND end_date > ? ORDER BY end_date ASC", (date.today().isoformat(),))
 
 def enter_giveaway(giveaway_id, user_id, username):
-    conn = sqlite3.connect("orders.db")
-    c = conn.cursor()
-    # Check if user already entered
-    c.execute("SELECT id FROM giveaway_entries WHERE giveaway_id = ? AND user_id = ?", (giveaway_id, user_id))
-    if c.fetchone():
-        conn.close()
-        return False, "You have already entered this giveaway!"
-    
-    # Check if giveaway is still active
-    c.execute("SELECT end_date, max_entries FROM giveaways WHERE id = ? AND is_active = 1", (giveaway_id,))
-    giveaway = c.fetchone()
+    # Single transaction: the UNIQUE (giveaway_id, user_id) index rejects repeat entries and the
+    # conditional entry_count update reserves a slot only while the giveaway is open and under max_entries.
+    with storage.transaction() as c:
+        entry = c.execute("INSERT OR IGNORE INTO giveaway_entries (giveaway_id, user_id, username, entry_date) VALUES (?, ?, ?, ?)",
+                          (giveaway_id, user_id, username, datetime.now().isoformat()))
+        if entry.rowcount == 0:
+            return False, "You have already entered this giveaway!"
+
+        reserved = c.execute("UPDATE giveaways SET entry_count = entry_count + 1 WHERE id = ? AND is_active = 1 AND end_date >= ? AND entry_count < max_entries",
+                             (giveaway_id, date.today().isoformat()))
+        if reserved.rowcount == 1:
+            stats.record_entry(c)
+            return True, "Successfully entered the giveaway! Good luck!"
+
+        c.execute("DELETE FROM giveaway_entries WHERE id = ?", (entry.lastrowid,))
+        giveaway = c.execute("SELECT end_date FROM giveaways WHERE id = ? AND is_active = 1", (giveaway_id,)).fetchone()
     if not giveaway:
-        conn.close()
         return False, "Giveaway not found or inactive!"
-    
-    end_date = date.fromisoformat(giveaway[0])
-    if end_date < date.today():
-        conn.close()
+    if date.fromisoformat(giveaway[0]) < date.today():
         return False, "This giveaway has ended!"
-    
-    # Check if max entries reached
-    c.execute("SELECT COUNT(*) FROM giveaway_entries WHERE giveaway_id = ?", (giveaway_id,))
-    current_entries = c.fetchone()[0]
-    if current_entries >= giveaway[1]:
-        conn.close()
-        return False, "This giveaway has reached maximum entries!"
-    
-    # Add entry
-    c.execute("INSERT INTO giveaway_entries (giveaway_id, user_id, username, entry_date) VALUES (?, ?, ?, ?)",
-              (giveaway_id, user_id, username, datetime.now().isoformat()))
-    conn.commit()
-    conn.close()
-    return True, "Successfully entered the giveaway! Good luck!"
-
-def get_giveaway_entries(giveaway_id):
-    conn = sqlite3.connect("orders.db")
-    c = conn.cursor()
-    c.execute("SELECT user_id, username, entry_date FROM giveaway_entries WHERE giveaway_id = ? ORDER BY entry_date ASC", (giveaway_id,))
-    rows = c.fetchall()
-    conn.close()
-    return rows
+    return False, "This giveaway has reached maximum entries!"
+
+ENTRY_PAGE_SIZE = 50
+ENTRY_COLUMNS = "SELECT id, user_id, username FROM giveaway_entries WHERE giveaway_id = ?"
+# Pages are keyed on (entry_date, id), the order of the (giveaway_id, entry_date) index, so no page sorts or skips rows.
+ENTRY_CURSOR = "(SELECT entry_date, id FROM giveaway_entries WHERE id = ?)"
+
+def get_giveaway_entries_page(giveaway_id, after=None, before=None, limit=ENTRY_PAGE_SIZE):
+    """Return ``(rows, has_prev, has_next)`` for the page after entry id ``after`` or before ``before``."""
+    if before is not None:
+        rows = storage.fetchall(f"{ENTRY_COLUMNS} AND (entry_date, id) < {ENTRY_CURSOR} ORDER BY entry_date DESC, id DESC LIMIT ?",
+                                (giveaway_id, before, limit + 1))
+        more = len(rows) > limit
+        rows = rows[:limit]
+        rows.reverse()
+        return rows, more, True
+    if after is not None:
+        rows = storage.fetchall(f"{ENTRY_COLUMNS} AND (entry_date, id) > {ENTRY_CURSOR} ORDER BY entry_date, id LIMIT ?",
+                                (giveaway_id, after, limit + 1))
+    else:
+        rows = storage.fetchall(f"{ENTRY_COLUMNS} ORDER BY entry_date, id LIMIT ?", (giveaway_id, limit + 1))
+    return rows[:limit], after is not None, len(rows) > limit
+
+def iter_giveaway_entry_lines(giveaway_id):
+    rows = storage.iter_rows("SELECT user_id, username FROM giveaway_entries WHERE giveaway_id = ? ORDER BY entry_date, id",
+                             (giveaway_id,))
+    for i, (entry_user_id, username) in enumerate(rows, 1):
+        yield f"{i}. @{username}" if username else f"{i}. User{entry_user_id}"
+
+def get_giveaway(giveaway_id):
+    return storage.fetchone("SELECT id, title, description, prize, start_date, end_date, max_entries, entry_count FROM giveaways WHERE id = ?", (giveaway_id,))
 
 def get_all_users():
-    conn = sqlite3.connect("orders.db")
-    c = conn.cursor()
-    c.execute("SELECT DISTINCT user_id FROM orders")
-    rows = c.fetchall()
-    conn.close()
-    return [row[0] for row in rows]
-
-def save_broadcast_message(message_text, sent_by):
-    conn = sqlite3.connect("orders.db")
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS broadcast_messages (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        message_text TEXT,
-        sent_by INTEGER,
-        sent_date TEXT,
-        recipients_count INTEGER
-    )''')
-    c.execute("INSERT INTO broadcast_messages (message_text, sent_by, sent_date, recipients_count) VALUES (?, ?, ?, ?)",
-              (message_text, sent_by, datetime.now().isoformat(), 0))
-    conn.commit()
-    conn.close()
-
-def create_crypto_payment_invoice(product, user_id, price):
+    return [row[0] for row in storage.fetchall("SELECT DISTINCT user_id FROM orders")]
+
+async def create_crypto_payment_invoice(lines, user_id, price):
     if not config.OXAPAY_API_KEY:
-        fake_invoice_id = str(random.randint(10000000, 99999999))
+        # Unique like real invoice ids: orders.invoice_id is UNIQUE
+        fake_invoice_id = secrets.token_hex(8)
         fake_pay_url = f"https://pay.crypto-provider.com/test/{fake_invoice_id}"
         return {"invoice_id": fake_invoice_id, "pay_url": fake_pay_url}
-    url = "https://api.crypto-provider.com/merchant/invoice"
-    headers = {"Content-Type": "application/json", "Authorization": config.OXAPAY_API_KEY}
-    data = {
-        "out": str(price),
-        "out_currency": config.CURRENCY,
-        "callback_url": "",
-        "order_id": f"{user_id}_{product['id']}_{int(time.time())}",
-        "description": product["name"]
-    }
-    response = requests.post(url, json=data, headers=headers)
-    if response.status_code == 200:
-        return response.json().get("result", {})
-    return None
+    return await payments.get_client().create_invoice(
+        price,
+        config.CURRENCY,
+        f"{user_id}_{lines[0][0]}_{int(time.time())}",
+        basket.describe(lines),
+        callback_url=getattr(config, "PAYMENT_CALLBACK_URL", ""),
+    )
 
-def check_crypto_payment_invoice(invoice_id):
+async def check_crypto_payment_invoice(invoice_id):
     if not config.OXAPAY_API_KEY:
         return {"status": "paid"}
-    url = f"https://api.crypto-provider.com/merchant/invoice/{invoice_id}"
-    headers = {"Authorization": config.OXAPAY_API_KEY}
-    response = requests.get(url, headers=headers)
-    if response.status_code == 200:
-        return response.json().get("result", {})
-    return None
+    return await payments.get_client().check_invoice(invoice_id)
+
+def build_catalog_source():
+    source = getattr(config, "CATALOG_SOURCE", "config")
+    if source == "file":
+        return catalog.FileSource(getattr(config, "CATALOG_FILE", "catalog.json"))
+    if source == "db":
+        return catalog.DatabaseSource()
+    return catalog.ConfigSource(config.PRODUCTS)
+
+product_catalog = catalog.CatalogManager(
+    build_catalog_source(),
+    config.CURRENCY,
+    page_size=getattr(config, "CATALOG_PAGE_SIZE", catalog.PAGE_SIZE),
+    check_interval=getattr(config, "CATALOG_RELOAD_SECONDS", catalog.CHECK_INTERVAL),
+)
+
+def get_product(product_id):
+    return product_catalog.catalog.get(product_id)
+
+def invoice_lines(invoice):
+    if invoice["lines"]:
+        return invoice["lines"]
+    # Invoice from before baskets: a single product.
+    product = get_product(invoice["product_id"])
+    name = product["name"] if product else f"Product {invoice['product_id']}"
+    return [(invoice["product_id"], name, invoice["quantity"], invoice["price"])]
+
+def fulfil_invoice(invoice):
+    save_order(invoice["user_id"], invoice_lines(invoice), invoice["invoice_id"],
+               invoice["discount_code"], invoice["discount_percent"], invoice["referred_by"], invoice["address"])
+
+def release_invoice_discount(invoice):
+    # Referral codes are not rows in discount_codes, so only real codes hold a reservation.
+    if invoice["discount_code"] and not invoice["referred_by"]:
+        discounts.release(invoice["discount_code"])
+
+def reclaim_invoice_discount(invoice):
+    if invoice["discount_code"] and not invoice["referred_by"]:
+        discounts.reclaim(invoice["discount_code"])
+
+CART_KEYS = ("basket", "cart_product", "cart_quantity", "cart_price", "cart_discount_code", "cart_discount_percent",
+             "cart_referred_by", "cart_address", "pending_invoice_id", "pending_pay_url", "pending_product_id",
+             "pending_quantity", "pending_price")
+
+def clear_paid_cart(user_data, invoice):
+    """Take what ``invoice`` paid for out of the cart.
+
+    Leaves the cart alone if the user has checked out a newer invoice since;
+    products added after checking out stay in it.
+    """
+    if user_data is None or str(user_data.get("pending_invoice_id")) != str(invoice["invoice_id"]):
+        return False
+    cart = basket.get(user_data)
+    for product_id, _, qty, _ in invoice_lines(invoice):
+        if cart.get(product_id) == qty:
+            del cart[product_id]
+    address = user_data.get("cart_address")
+    for key in CART_KEYS:
+        user_data.pop(key, None)
+    if cart:
+        user_data["basket"] = cart
+        user_data["cart_address"] = address
+    return True
+
+def same_lines(a, b):
+    return [(product_id, qty) for product_id, _, qty, _ in a] == [(product_id, qty) for product_id, _, qty, _ in b]
+
+async def notify_paid_invoice(bot, invoice):
+    # Paid through the webhook or the sweep: the buyer never tapped "I've paid", so empty their cart here.
+    if application is not None and clear_paid_cart(application.user_data.get(invoice["user_id"]), invoice):
+        application.mark_data_for_update_persistence(user_ids=invoice["user_id"])
+    await bot.send_message(
+        chat_id=invoice["chat_id"] or invoice["user_id"],
+        text=f"Payment received for invoice {invoice['invoice_id']}! Your order for {basket.describe(invoice_lines(invoice))} is confirmed.\n\nYour order will be shipped to:\n{invoice['address']}"
+    )
+
+broadcast_engine = broadcast.BroadcastEngine(
+    concurrency=getattr(config, "BROADCAST_CONCURRENCY", broadcast.CONCURRENCY),
+    global_rate=getattr(config, "BROADCAST_RATE_PER_SECOND", broadcast.GLOBAL_RATE),
+)
+
+settlement_engine = settlement.SettlementEngine(
+    check_crypto_payment_invoice,
+    fulfil_invoice,
+    notify_paid_invoice,
+    webhook_secret=config.OXAPAY_API_KEY,
+    release=release_invoice_discount,
+    reclaim=reclaim_invoice_discount,
+    poll_interval=getattr(config, "SETTLEMENT_POLL_SECONDS", settlement.POLL_INTERVAL),
+)
 
 # --- Bot Handlers ---
 
@@ -264,15 +300,9 @@ async def menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     data = query.data
     user_id = query.from_user.id
     if data == "menu_shop":
-        keyboard = [
-            [InlineKeyboardButton(f"{p['name']}", callback_data=f"select_{p['id']}")]
-            for p in config.PRODUCTS
-        ]
-        keyboard.append([InlineKeyboardButton("Main Menu", callback_data="main_menu")])
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text('Select a product:', reply_markup=reply_markup)
+        await query.edit_message_text('Select a product:', reply_markup=product_catalog.catalog.shop_keyboard(0))
     elif data == "menu_giveaways":
-        giveaways = get_active_giveaways()
+        giveaways = await storage.run_read(get_active_giveaways)
         if not giveaways:
             await query.edit_message_text("No active giveaways at the moment. Check back later!", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Main Menu", callback_data="main_menu")]]))
             return
@@ -287,73 +317,81 @@ async def menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.edit_message_text(f"For support, contact: {config.SUPPORT_HANDLE}", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Main Menu", callback_data="main_menu")]]))
     elif data == "menu_refer":
         code = generate_referral_code(user_id)
-        await query.edit_message_text(f"Share this referral code with friends for a discount: {code}", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Main Menu", callback_data="main_menu")]]))
-    elif data == "main_menu":
-        await start(update, context)
-    else:
-        await button(update, context)
+        referred_orders, customers, _ = await storage.run_read(referrals.get_stats, user_id)
+        await query.edit_message_text(f"Share this referral code with friends for a discount: {code}\n\n"
+                                      f"Orders placed with your code: {referred_orders} (from {customers} customers)", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Main Menu", callback_data="main_menu")]]))
 
 async def select_product_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    data = query.data
-    user_id = query.from_user.id
-    if data.startswith("select_"):
-        product_id = int(data.split("_")[1])
-        product = next((p for p in config.PRODUCTS if p["id"] == product_id), None)
-        if not product:
-            await query.edit_message_text("Product not found.")
-            return
-        context.user_data["cart_product"] = product
-        keyboard = [
-            [InlineKeyboardButton(f"{qty} for £{product['prices'][qty]} {config.CURRENCY}", callback_data=f"qty_{qty}") for qty in product["prices"]],
-            [InlineKeyboardButton("Back", callback_data="menu_shop"), InlineKeyboardButton("Main Menu", callback_data="main_menu")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text(f"Select quantity for {product['name']}:\n{product['description']}", reply_markup=reply_markup)
+    product_id = context.args[0]
+    products = product_catalog.catalog
+    product = products.get(product_id)
+    if not product:
+        await query.edit_message_text("Product not found.")
+        return
+    context.user_data["cart_product"] = product
+    reply_markup = products.quantity_keyboard(product_id)
+    await query.edit_message_text(f"Select quantity for {product['name']}:\n{product['description']}", reply_markup=reply_markup)
+
+async def shop_page_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    products = product_catalog.catalog
+    page = max(0, min(context.args[0], products.page_count - 1))
+    await query.edit_message_text(f"Select a product (page {page + 1}/{products.page_count}):",
+                                  reply_markup=products.shop_keyboard(page))
 
 async def quantity_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    data = query.data
-    user_id = query.from_user.id
-    if data.startswith("qty_"):
-        qty = int(data.split("_")[1])
-        product = context.user_data.get("cart_product")
-        if not product:
-            await query.edit_message_text("No product selected.")
-            return
-        price = product["prices"][qty]
-        context.user_data["cart_quantity"] = qty
-        context.user_data["cart_price"] = price
-        context.user_data["cart_discount_code"] = None
-        context.user_data["cart_discount_percent"] = 0
-        context.user_data["cart_referred_by"] = None
-        context.user_data["cart_address"] = None
-        await show_cart(update, context)
+    qty = context.args[0]
+    product = context.user_data.get("cart_product")
+    if not product or qty not in product["prices"]:
+        await query.edit_message_text("No product selected.")
+        return
+    if not basket.add(basket.get(context.user_data), product, qty):
+        await query.edit_message_text(
+            f"Your cart is full ({basket.MAX_LINES} products). Check out or remove a product first.",
+            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Back to Cart", callback_data="back_to_cart")]])
+        )
+        return
+    await show_cart(update, context)
+
+async def basket_remove_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    basket.get(context.user_data).pop(context.args[0], None)
+    await show_cart(update, context)
 
 async def show_cart(update_or_query, context):
     user_data = context.user_data
-    product = user_data.get("cart_product")
-    qty = user_data.get("cart_quantity")
-    price = user_data.get("cart_price")
     discount_code = user_data.get("cart_discount_code")
     discount_percent = user_data.get("cart_discount_percent", 0)
-    referred_by = user_data.get("cart_referred_by")
     address = user_data.get("cart_address")
-    subtotal = price
-    msg = f"Cart:\nProduct: {product['name']}\nQuantity: {qty}\nSubtotal: £{subtotal} {config.CURRENCY}"
-    if discount_percent:
-        msg += f"\nDiscount: {discount_percent}% ({discount_code})"
-    # Do not echo the address, just show checkmark on button
-    address_entered = bool(address)
-    address_btn_text = "Enter Address ✅" if address_entered else "Enter Address"
-    keyboard = [
-        [InlineKeyboardButton(address_btn_text, callback_data="enter_address")],
-        [InlineKeyboardButton("Apply Discount Code", callback_data="apply_discount")],
-        [InlineKeyboardButton("Checkout", callback_data="checkout")],
-        [InlineKeyboardButton("Back", callback_data="menu_shop"), InlineKeyboardButton("Main Menu", callback_data="main_menu")]
-    ]
+    lines, subtotal, _ = basket.price_lines(basket.get(user_data), product_catalog.catalog)
+    if lines:
+        msg_lines = ["Cart:"]
+        msg_lines += [f"{i}. {name} x{qty}: £{price} {config.CURRENCY}" for i, (_, name, qty, price) in enumerate(lines, 1)]
+        msg_lines.append(f"Subtotal: £{subtotal} {config.CURRENCY}")
+        if discount_percent:
+            msg_lines.append(f"Discount: {discount_percent}% ({discount_code})")
+            msg_lines.append(f"Total: £{basket.discounted(subtotal, discount_percent)} {config.CURRENCY}")
+        msg = "\n".join(msg_lines)
+        # Do not echo the address, just show checkmark on button
+        address_entered = bool(address)
+        address_btn_text = "Enter Address ✅" if address_entered else "Enter Address"
+        keyboard = [[InlineKeyboardButton(f"Remove {name}", callback_data=f"basket_remove_{product_id}")]
+                    for product_id, name, _, _ in lines]
+        keyboard += [
+            [InlineKeyboardButton(address_btn_text, callback_data="enter_address")],
+            [InlineKeyboardButton("Apply Discount Code", callback_data="apply_discount")],
+            [InlineKeyboardButton("Checkout", callback_data="checkout")],
+            [InlineKeyboardButton("Add Another Product", callback_data="menu_shop"), InlineKeyboardButton("Main Menu", callback_data="main_menu")]
+        ]
+    else:
+        msg = "Your cart is empty."
+        keyboard = [[InlineKeyboardButton("Shop", callback_data="menu_shop"), InlineKeyboardButton("Main Menu", callback_data="main_menu")]]
     reply_markup = InlineKeyboardMarkup(keyboard)
 
     # Robust handling for both messages and callback queries
@@ -380,10 +418,6 @@ async def cart_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     elif data == "checkout":
         # Proceed to payment
         await checkout_handler(update, context)
-    elif data == "menu_shop":
-        await menu_handler(update, context)
-    elif data == "main_menu":
-        await start(update, context)
 
 async def address_message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_data = context.user_data
@@ -398,9 +432,6 @@ async def discount_message_handler(update: Update, context: ContextTypes.DEFAULT
     user_data = context.user_data
     if user_data.get("awaiting_discount"):
         text = update.message.text.strip()
-        product = user_data.get("cart_product")
-        qty = user_data.get("cart_quantity")
-        price = product["prices"][qty]
         discount_percent = 0
         discount_code = None
         referred_by = None
@@ -412,13 +443,10 @@ async def discount_message_handler(update: Update, context: ContextTypes.DEFAULT
                 discount_code = code
                 referred_by = referrer
             else:
-                d = get_discount_code(code)
+                d = await storage.run_read(get_discount_code, code)
                 if d:
                     discount_percent = d["percent"]
                     discount_code = code
-        if discount_percent:
-            price = round(price * (1 - discount_percent / 100), 2)
-        user_data["cart_price"] = price
         user_data["cart_discount_code"] = discount_code
         user_data["cart_discount_percent"] = discount_percent
         user_data["cart_referred_by"] = referred_by
@@ -428,151 +456,239 @@ async def discount_message_handler(update: Update, context: ContextTypes.DEFAULT
 async def checkout_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     user_data = context.user_data
-    product = user_data.get("cart_product")
-    qty = user_data.get("cart_quantity")
-    price = user_data.get("cart_price")
     discount_code = user_data.get("cart_discount_code")
     discount_percent = user_data.get("cart_discount_percent", 0)
     referred_by = user_data.get("cart_referred_by")
     address = user_data.get("cart_address")
+    lines, _, price = basket.price_lines(basket.get(user_data), product_catalog.catalog, discount_percent)
+    if not lines:
+        await update.callback_query.edit_message_text(
+            "Your cart is empty.",
+            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Shop", callback_data="menu_shop")]])
+        )
+        return
+    previous = None
+    if user_data.get("pending_invoice_id"):
+        previous = await storage.run_read(settlement.get_pending_invoice, user_data["pending_invoice_id"])
+    if previous and previous["status"] == "paid" and same_lines(invoice_lines(previous), lines):
+        # Settled by another worker, whose notification could not reach this process's copy of the cart.
+        clear_paid_cart(user_data, previous)
+        await update.callback_query.edit_message_text(
+            f"This cart has already been paid for (invoice {previous['invoice_id']}). Thank you for your order!",
+            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Main Menu", callback_data="main_menu")]])
+        )
+        return
+    if (previous and previous["status"] == "pending" and user_data.get("pending_pay_url")
+            and same_lines(invoice_lines(previous), lines) and previous["price"] == price
+            and previous["discount_code"] == discount_code and previous["address"] == address):
+        # Checkout tapped again with nothing changed: show the invoice already waiting for payment.
+        msg, reply_markup = invoice_message(user_id, previous["invoice_id"], price, user_data["pending_pay_url"], lines[0][0])
+        await update.callback_query.edit_message_text(msg, reply_markup=reply_markup)
+        return
     if not address:
         await update.callback_query.edit_message_text(
             "Please enter your address before checking out.",
             reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Back to Cart", callback_data="back_to_cart")]])
         )
         return
-            invoice = create_crypto_payment_invoice(product, user_id, price)
+    if MAX_ORDERS_PER_USER and await storage.run_read(ratelimit.orders_today, user_id) >= MAX_ORDERS_PER_USER:
+        await update.callback_query.edit_message_text(
+            f"You have reached the limit of {MAX_ORDERS_PER_USER} orders per day. Please try again tomorrow.",
+            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Main Menu", callback_data="main_menu")]])
+        )
+        return
+    if previous and previous["status"] == "pending":
+        # The cart changed since that invoice was made: retire it, giving back its discount use, before reserving again.
+        previous = await settlement_engine.supersede(previous["invoice_id"])
+        if previous and previous["status"] == "paid":
+            # It was paid in the meantime, so its order stands; let the buyer see what is left before paying again.
+            clear_paid_cart(user_data, previous)
+            await update.callback_query.edit_message_text(
+                f"Your previous invoice {previous['invoice_id']} has been paid and that order is confirmed. "
+                "Please review your cart before checking out again.",
+                reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Back to Cart", callback_data="back_to_cart")]])
+            )
+            return
+    reserved = bool(discount_code and not referred_by)
+    if reserved and not await storage.run_write(discounts.redeem, discount_code):
+        user_data["cart_discount_code"] = None
+        user_data["cart_discount_percent"] = 0
+        await update.callback_query.edit_message_text(
+            f"Sorry, discount code {discount_code} has expired or reached its usage limit and was removed from your cart.",
+            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Back to Cart", callback_data="back_to_cart")]])
+        )
+        return
+    # One invoice for the whole basket.
+    invoice = await create_crypto_payment_invoice(lines, user_id, price)
     if not invoice:
+        if reserved:
+            await storage.run_write(discounts.release, discount_code)
         await update.callback_query.edit_message_text("Failed to create payment invoice. Please try again later.")
         return
     pay_url = invoice.get("pay_url")
     invoice_id = invoice.get("invoice_id")
+    user_data["pending_invoice_id"] = invoice_id
+    user_data["pending_pay_url"] = pay_url
+    await storage.run_write(settlement.add_pending_invoice, invoice_id, user_id, update.effective_chat.id, lines[0][0],
+                            basket.item_count(lines), price, discount_code, discount_percent, referred_by, address, lines)
+    msg, reply_markup = invoice_message(user_id, invoice_id, price, pay_url, lines[0][0])
+    await update.callback_query.edit_message_text(msg, reply_markup=reply_markup)
+
+def invoice_message(user_id, invoice_id, price, pay_url, product_id):
     message = (
         f"Your Telegram User ID: {user_id}\n"
         f"Your Crypto Payment Transaction ID: {invoice_id}\n"
         f"Please pay £{price} {config.CURRENCY} using the link below:\n{pay_url}\n\n"
         "After payment, click the button below."
     )
-    user_data["pending_invoice_id"] = invoice_id
-    user_data["pending_product_id"] = product["id"]
-    user_data["pending_quantity"] = qty
-    user_data["pending_price"] = price
-    await update.callback_query.edit_message_text(
-        message,
-        reply_markup=InlineKeyboardMarkup([
-            [InlineKeyboardButton("I've paid", callback_data=f"check_{invoice_id}_{product['id']}"), InlineKeyboardButton("Main Menu", callback_data="main_menu")]
-        ])
-    )
+    return message, InlineKeyboardMarkup([
+        [InlineKeyboardButton("I've paid", callback_data=f"check_{invoice_id}_{product_id}"), InlineKeyboardButton("Main Menu", callback_data="main_menu")]
+    ])
 
-async def button(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def giveaway_detail_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    data = query.data
-    if data.startswith("select_"):
-        await select_product_handler(update, context)
-    elif data.startswith("qty_"):
-        await quantity_handler(update, context)
-    elif data.startswith("giveaway_"):
-        giveaway_id = int(data.split("_")[1])
-        giveaways = get_active_giveaways()
-        giveaway = next((g for g in giveaways if g[0] == giveaway_id), None)
-        if not giveaway:
-            await query.edit_message_text("Giveaway not found!", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Main Menu", callback_data="main_menu")]]))
+    giveaway_id = context.args[0]
+    giveaways = await storage.run_read(get_active_giveaways)
+    giveaway = next((g for g in giveaways if g[0] == giveaway_id), None)
+    if not giveaway:
+        await query.edit_message_text("Giveaway not found!", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Main Menu", callback_data="main_menu")]]))
+        return
+    
+    # Show giveaway details
+    end_date = date.fromisoformat(giveaway[5])
+    days_left = (end_date - date.today()).days
+    message = f"🎁 **{giveaway[1]}**\n\n{giveaway[2]}\n\n🏆 **Prize:** {giveaway[3]}\n⏰ **Ends in:** {days_left} days\n📅 **End Date:** {giveaway[5]}"
+    
+    keyboard = [
+        [InlineKeyboardButton("🎯 Enter Giveaway", callback_data=f"enter_giveaway_{giveaway_id}")],
+        [InlineKeyboardButton("Back to Giveaways", callback_data="menu_giveaways"), InlineKeyboardButton("Main Menu", callback_data="main_menu")]
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    await query.edit_message_text(message, reply_markup=reply_markup, parse_mode='Markdown')
+
+async def enter_giveaway_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    giveaway_id = context.args[0]
+    user_id = query.from_user.id
+    username = query.from_user.username or query.from_user.first_name or "Unknown"
+    
+    success, message = await storage.run_write(enter_giveaway, giveaway_id, user_id, username)
+    keyboard = [
+        [InlineKeyboardButton("Back to Giveaways", callback_data="menu_giveaways")],
+        [InlineKeyboardButton("Main Menu", callback_data="main_menu")]
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    await query.edit_message_text(message, reply_markup=reply_markup)
+
+async def check_payment_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    invoice_id = context.args[0]
+    user_data = context.user_data
+    if (user_data.get("pending_invoice_id") == invoice_id
+            and await storage.run_read(settlement.get_pending_invoice, invoice_id) is None):
+        # Invoice created before settlement tracking existed; register it from the cart.
+        discount_percent = user_data.get("cart_discount_percent", 0)
+        lines, _, price = basket.price_lines(basket.get(user_data), product_catalog.catalog, discount_percent)
+        product = user_data.get("cart_product")
+        if product:
+            # A single-product cart from before baskets: only that product was invoiced, at cart_price.
+            lines = [(product_id, name, qty, user_data.get("cart_price", line_price))
+                     for product_id, name, qty, line_price in lines if product_id == product.get("id")]
+        if not lines:
+            await query.edit_message_text(
+                f"We could not find the order for this invoice. If you have already paid, please contact "
+                f"{config.SUPPORT_HANDLE} with invoice ID {invoice_id}.",
+                reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Main Menu", callback_data="main_menu")]]))
             return
-        
-        # Show giveaway details
-        end_date = date.fromisoformat(giveaway[4])
-        days_left = (end_date - date.today()).days
-        message = f"🎁 **{giveaway[1]}**\n\n{giveaway[2]}\n\n🏆 **Prize:** {giveaway[3]}\n⏰ **Ends in:** {days_left} days\n📅 **End Date:** {giveaway[4]}"
-        
-        keyboard = [
-            [InlineKeyboardButton("🎯 Enter Giveaway", callback_data=f"enter_giveaway_{giveaway_id}")],
-            [InlineKeyboardButton("Back to Giveaways", callback_data="menu_giveaways"), InlineKeyboardButton("Main Menu", callback_data="main_menu")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text(message, reply_markup=reply_markup, parse_mode='Markdown')
-    elif data.startswith("enter_giveaway_"):
-        giveaway_id = int(data.split("_")[2])
-        user_id = query.from_user.id
-        username = query.from_user.username or query.from_user.first_name or "Unknown"
-        
-        success, message = enter_giveaway(giveaway_id, user_id, username)
-        keyboard = [
-            [InlineKeyboardButton("Back to Giveaways", callback_data="menu_giveaways")],
-            [InlineKeyboardButton("Main Menu", callback_data="main_menu")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text(message, reply_markup=reply_markup)
-    elif data == "back_to_cart":
-        await show_cart(update, context)
-    elif data in ["enter_address", "apply_discount", "checkout", "menu_shop", "main_menu"]:
-        if data == "main_menu":
-            await start(update, context)
-        else:
-            await cart_handler(update, context)
-    elif data.startswith("check_"):
-        _, invoice_id, product_id = data.split("_")
-        user_data = context.user_data
-        status = check_crypto_payment_invoice(invoice_id)
-        if status and status.get("status") == "paid":
-            product = user_data.get("cart_product")
-            qty = user_data.get("cart_quantity")
-            price = user_data.get("cart_price")
-            discount_code = user_data.get("cart_discount_code")
-            discount_percent = user_data.get("cart_discount_percent", 0)
-            referred_by = user_data.get("cart_referred_by")
-            address = user_data.get("cart_address")
-            save_order(update.effective_user.id, product, qty, price, invoice_id, discount_code, discount_percent, referred_by, address)
-            await query.edit_message_text(f"Payment received! Here is your product: {product['name']}\n{product['description']}\n\nYour order will be shipped to:\n{address}")
-            for key in ["cart_product", "cart_quantity", "cart_price", "cart_discount_code", "cart_discount_percent", "cart_referred_by", "cart_address", "pending_invoice_id", "pending_product_id", "pending_quantity", "pending_price"]:
-                context.user_data.pop(key, None)
+        await storage.run_write(settlement.add_pending_invoice, invoice_id, update.effective_user.id,
+                                update.effective_chat.id, lines[0][0], basket.item_count(lines),
+                                user_data.get("cart_price", price), user_data.get("cart_discount_code"),
+                                discount_percent, user_data.get("cart_referred_by"), user_data.get("cart_address"), lines)
+    status, invoice = await settlement_engine.check(invoice_id)
+    if status in ("paid", "settled"):
+        if status == "paid":
+            items = []
+            for product_id, name, qty, _ in invoice_lines(invoice):
+                product = get_product(product_id)
+                items.append(f"{name} x{qty}\n{product['description']}" if product else f"{name} x{qty}")
+            await query.edit_message_text("Payment received! Here is your order:\n" + "\n".join(items)
+                                          + f"\n\nYour order will be shipped to:\n{invoice['address']}")
         else:
-            await query.edit_message_text("Payment not detected yet. Please wait a minute and try again.")
-    elif data.startswith("menu_"):
-        await menu_handler(update, context)
-    elif data == "admin_panel":
-        await admin_panel_handler(update, context)
-    elif data == "admin_orders":
-        await admin_orders_handler(update, context)
-    elif data == "admin_giveaways":
-        await admin_giveaways_handler(update, context)
-    elif data == "admin_discount":
-        await admin_discount_handler(update, context)
-    elif data == "admin_stats":
-        await admin_stats_handler(update, context)
-    elif data == "admin_broadcast":
-        await admin_broadcast_handler(update, context)
-    elif data == "admin_giveaway_entries":
-        await admin_giveaway_entries_handler(update, context)
-    elif data.startswith("view_entries_"):
-        await view_entries_handler(update, context)
-    elif data.startswith("copy_entries_"):
-        giveaway_id = int(data.split("_")[2])
-        entries = get_giveaway_entries(giveaway_id)
-        giveaway = next((g for g in get_active_giveaways() if g[0] == giveaway_id), None)
-        if not giveaway:
-            await update.callback_query.edit_message_text("Giveaway not found.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Back", callback_data="admin_giveaway_entries")]]))
-            return
-        
-        numbered_list = ""
-        for i, entry in enumerate(entries, 1):
-            username = entry[1] if entry[1] else f"User{entry[0]}"
-            numbered_list += f"{i}. @{username}\n"
-        
-        await update.callback_query.edit_message_text(numbered_list, parse_mode='Markdown')
+            await query.edit_message_text("This payment has already been confirmed. Thank you for your order!",
+                                          reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Main Menu", callback_data="main_menu")]]))
+        # An older invoice being confirmed must not empty the cart the user is building now.
+        clear_paid_cart(context.user_data, invoice)
+    elif status == "expired":
+        await query.edit_message_text(f"This invoice has expired. If you have already paid, please contact {config.SUPPORT_HANDLE} with invoice ID {invoice_id}.",
+                                      reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Main Menu", callback_data="main_menu")]]))
+    else:
+        await query.edit_message_text("Payment not detected yet. Please wait a minute and try again.")
+
+async def copy_entries_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    if query.from_user.id != ADMIN_USER_ID:
+        await query.answer("You are not authorized to view entries.")
+        return
+    await query.answer()
+    giveaway_id = context.args[0]
+    giveaway = await storage.run_read(get_giveaway, giveaway_id)
+    if not giveaway:
+        await query.edit_message_text("Giveaway not found.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Back", callback_data="admin_giveaway_entries")]]))
+        return
+    # One message while the list fits, a .txt document after that; streamed either way.
+    await render.reply_lines(query.message, iter_giveaway_entry_lines(giveaway_id),
+                             filename=f"giveaway_{giveaway_id}_entries.txt",
+                             caption=f"Entries for {giveaway[1]} ({giveaway[7]})",
+                             empty_text=f"No entries found for giveaway {giveaway_id}.")
+
+async def admin_export_orders_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.callback_query.answer()
+    context.args = []
+    await export_orders(update, context)
 
 async def orders(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     if user_id != ADMIN_USER_ID:
         await update.message.reply_text("You are not authorized to view orders.")
         return
-    orders = get_recent_orders(10)
-    if not orders:
-        await update.message.reply_text("No orders found.")
+    try:
+        context.user_data["order_filters"] = order_browser.parse_filters(context.args)
+    except ValueError as e:
+        await update.message.reply_text(
+            f"Invalid filter: {e}\nUsage: /orders [user=ID] [product=ID] [code=CODE] [from=YYYY-MM-DD] [to=YYYY-MM-DD]")
         return
-    msg = "Recent Orders:\n"
-    for o in orders:
-        msg += f"\nTime: {o[0]}\nUser ID: {o[1]}\nProduct: {o[3]} (ID: {o[2]})\nQuantity: {o[4]}\nPrice: £{o[5]} {config.CURRENCY}\nInvoice ID: {o[6]}\nDiscount: {o[7]} ({o[8]}%)\nReferred by: {o[9]}\nAddress: {o[10]}\n---"
-    await update.message.reply_text(msg)
+    msg, reply_markup = await order_page(context.user_data["order_filters"])
+    await update.message.reply_text(msg, reply_markup=reply_markup)
+
+async def order_page(order_filters, older_than=None, newer_than=None):
+    rows, has_older, has_newer = await storage.run_read(order_browser.fetch_page, order_filters, older_than, newer_than)
+    msg = "Orders"
+    if order_filters:
+        msg += f" ({order_browser.describe(order_filters)})"
+    msg += "\n"
+    if not rows:
+        msg += "\nNo orders found."
+    for o in rows:
+        msg += f"\n#{o[0]} {o[1][:19]}\nUser: {o[2]}\nProduct: {o[4]} (ID: {o[3]}, Qty: {o[5]})\nPrice: £{o[6]} {config.CURRENCY}\nInvoice: {o[7]}\n"
+        if o[8]:
+            msg += f"Discount: {o[8]} ({o[9]}%)\n"
+        if o[10]:
+            msg += f"Referred by: {o[10]}\n"
+        if o[11]:
+            address = o[11].replace("\n", ", ")
+            msg += f"Address: {address[:80]}{'…' if len(address) > 80 else ''}\n"
+        msg += "---\n"
+    nav = []
+    if has_newer:
+        nav.append(InlineKeyboardButton("◀ Newer", callback_data=f"orders_newer_{rows[0][0]}"))
+    if has_older:
+        nav.append(InlineKeyboardButton("Older ▶", callback_data=f"orders_older_{rows[-1][0]}"))
+    keyboard = [nav] if nav else []
+    if order_filters:
+        keyboard.append([InlineKeyboardButton("Clear Filters", callback_data="orders_clear")])
+    keyboard.append([InlineKeyboardButton("Export Orders", callback_data="admin_export_orders")])
+    keyboard.append([InlineKeyboardButton("Back to Admin Panel", callback_data="admin_panel")])
+    return msg, InlineKeyboardMarkup(keyboard)
 
 async def addcode(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
@@ -581,18 +697,20 @@ async def addcode(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     args = context.args
     if len(args) < 3:
-        await update.message.reply_text("Usage: /addcode CODE PERCENT YYYY-MM-DD (expiry)")
+        await update.message.reply_text("Usage: /addcode CODE PERCENT YYYY-MM-DD (expiry) [MAX_USES]")
         return
     code = args[0]
     try:
         percent = int(args[1])
         expires = args[2]
         date.fromisoformat(expires)
+        max_uses = int(args[3]) if len(args) > 3 else None
     except Exception:
-        await update.message.reply_text("Invalid percent or date format.")
+        await update.message.reply_text("Invalid percent, date or max uses format.")
         return
-    add_discount_code(code, percent, expires)
-    await update.message.reply_text(f"Discount code {code} for {percent}% off until {expires} added.")
+    await storage.run_write(add_discount_code, code, percent, expires, max_uses)
+    limit = f", limited to {max_uses} uses" if max_uses else ""
+    await update.message.reply_text(f"Discount code {code} for {percent}% off until {expires}{limit} added.")
 
 async def create_giveaway_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
@@ -633,7 +751,7 @@ async def create_giveaway_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE
         await update.message.reply_text("Invalid date format. Use YYYY-MM-DD")
         return
     
-    giveaway_id = create_giveaway(title, description, end_date_str, max_entries)
+    giveaway_id = await storage.run_write(create_giveaway, title, description, end_date_str, max_entries)
     await update.message.reply_text(f"✅ Giveaway '{title}' created successfully with ID: {giveaway_id}")
 
 async def list_giveaways(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -642,17 +760,17 @@ async def list_giveaways(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("You are not authorized to view giveaways.")
         return
     
-    giveaways = get_active_giveaways()
+    giveaways = await storage.run_read(get_active_giveaways)
     if not giveaways:
         await update.message.reply_text("No active giveaways.")
         return
     
-    msg = "Active Giveaways:\n\n"
+    lines = ["Active Giveaways:", ""]
     for g in giveaways:
-        entries = get_giveaway_entries(g[0])
-        msg += f"ID: {g[0]}\nTitle: {g[1]}\nPrize: {g[3]}\nEntries: {len(entries)}/{g[6]}\nEnd Date: {g[4]}\n---\n"
+        lines += [f"ID: {g[0]}", f"Title: {g[1]}", f"Prize: {g[3]}", f"Entries: {g[7]}/{g[6]}", f"End Date: {g[5]}", "---"]
     
-    await update.message.reply_text(msg)
+    for text in render.chunks(lines):
+        await update.message.reply_text(text)
 
 async def view_giveaway_entries(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
@@ -671,41 +789,138 @@ async def view_giveaway_entries(update: Update, context: ContextTypes.DEFAULT_TY
         await update.message.reply_text("Invalid giveaway ID.")
         return
     
-    entries = get_giveaway_entries(giveaway_id)
-    if not entries:
-        await update.message.reply_text(f"No entries found for giveaway {giveaway_id}.")
+    msg, reply_markup = await entries_page(giveaway_id)
+    await update.message.reply_text(msg, reply_markup=reply_markup)
+
+async def reply_draw(message, giveaway_id, draw):
+    seed, weighted, entry_count, drawn_at, winners = draw
+    caption = (f"🏆 Winners for Giveaway {giveaway_id}\n"
+               f"Drawn {datetime.fromtimestamp(drawn_at).strftime('%Y-%m-%d %H:%M')} from {entry_count} entries"
+               f"{' (weighted by referrals)' if weighted else ''}\nSeed: {seed}")
+    lines = [f"{i}. @{username} ({winner_id})" if username else f"{i}. User {winner_id}"
+             for i, (winner_id, username) in enumerate(winners, 1)]
+    await render.reply_lines(message, lines, filename=f"giveaway_{giveaway_id}_winners.txt", caption=caption,
+                             empty_text=f"{caption}\n\nNo entries, so no winners.")
+
+async def draw_winners(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    if user_id != ADMIN_USER_ID:
+        await update.message.reply_text("You are not authorized to draw winners.")
         return
-    
-    msg = f"Entries for Giveaway {giveaway_id}:\n\n"
-    for i, entry in enumerate(entries, 1):
-        msg += f"{i}. User: {entry[0]} (@{entry[1]})\n"
-        msg += f"   Date: {entry[2][:19]}\n"
-        msg += "---\n"
-    
-    await update.message.reply_text(msg)
+
+    usage = "Usage: /draw_winners GIVEAWAY_ID COUNT [weighted] [seed=SEED]"
+    args = context.args
+    try:
+        giveaway_id, count = int(args[0]), int(args[1])
+        options = [arg.lower() for arg in args[2:]]
+        weighted = "weighted" in options
+        seeds = [int(arg[5:]) for arg in options if arg.startswith("seed=")]
+        if count < 1 or len(options) != int(weighted) + len(seeds) or len(seeds) > 1:
+            raise ValueError
+    except (IndexError, ValueError):
+        await update.message.reply_text(usage)
+        return
+
+    draw = await storage.run_read(draws.get_draw, giveaway_id)
+    if draw is None:
+        seed = seeds[0] if seeds else draws.new_seed()
+        try:
+            # Close entries first so the sample is taken over a fixed set.
+            await storage.run_write(draws.close, giveaway_id)
+            winners = await storage.run_read(draws.sample, giveaway_id, count, seed, weighted)
+            await storage.run_write(draws.record, giveaway_id, seed, weighted, winners)
+        except draws.DrawError as e:
+            await update.message.reply_text(str(e))
+            return
+        draw = await storage.run_read(draws.get_draw, giveaway_id)
+    else:
+        await update.message.reply_text("This giveaway was already drawn; showing the recorded result.")
+    await reply_draw(update.message, giveaway_id, draw)
+
+async def referral_leaderboard(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    if user_id != ADMIN_USER_ID:
+        await update.message.reply_text("You are not authorized to view referrals.")
+        return
+
+    usage = f"Usage: /referrals [{'|'.join(referrals.RANKINGS)}] [LIMIT]"
+    by, limit = "revenue", 10
+    try:
+        for arg in context.args:
+            if arg.lower() in referrals.RANKINGS:
+                by = arg.lower()
+            else:
+                limit = int(arg)
+        if not 1 <= limit <= 100:
+            raise ValueError
+    except ValueError:
+        await update.message.reply_text(usage)
+        return
+
+    leaders = await storage.run_read(referrals.leaderboard, by, limit)
+    if not leaders:
+        await update.message.reply_text("No orders have been placed with a referral code yet.")
+        return
+    lines = [f"Top referrers by {by}:", ""]
+    for rank, (referrer, orders_count, customers, revenue) in enumerate(leaders, 1):
+        lines.append(f"{rank}. User {referrer} ({generate_referral_code(referrer)}): "
+                     f"{orders_count} orders, {customers} customers, £{revenue:.2f} {config.CURRENCY}")
+    for text in render.chunks(lines):
+        await update.message.reply_text(text)
 
 async def export_orders(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
+    message = update.effective_message
     if user_id != ADMIN_USER_ID:
-        await update.message.reply_text("You are not authorized to export orders.")
+        await message.reply_text("You are not authorized to export orders.")
         return
     
-    orders = get_recent_orders(1000)
-    if not orders:
-        await update.message.reply_text("No orders to export.")
+    try:
+        export_filters = export.parse_filters(context.args)
+    except ValueError:
+        await message.reply_text("Usage: /export_orders [FROM YYYY-MM-DD] [TO YYYY-MM-DD] [product=ID] [gzip]")
         return
     
-    # Create CSV-like format
-    csv_data = "Order ID,User ID,Product,Quantity,Price,Invoice ID,Discount Code,Discount %,Referred By,Address,Date\n"
-    for order in orders:
-        csv_data += f"{order[0]},{order[1]},{order[3]},{order[4]},{order[5]},{order[6]},{order[7] or ''},{order[8] or 0},{order[9] or ''},{order[10] or ''},{order[0]}\n"
-    
-    # Save to file
-    filename = f"orders_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-    with open(filename, 'w', encoding='utf-8') as f:
-        f.write(csv_data)
-    
-    await update.message.reply_text(f"Orders exported to {filename}")
+    suffix = ".csv.gz" if export_filters["compress"] else ".csv"
+    filename = f"orders_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}{suffix}"
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    os.close(fd)
+    try:
+        # Streams the orders table in chunks on a worker thread so the bot stays responsive
+        count = await asyncio.to_thread(export.write_orders_csv, path, **export_filters)
+        if not count:
+            await message.reply_text("No orders to export.")
+            return
+        if os.path.getsize(path) > MAX_DOCUMENT_SIZE:
+            await message.reply_text("Export is larger than Telegram's 50 MB limit. Narrow the date range or add gzip.")
+            return
+        with open(path, "rb") as f:
+            await message.reply_document(document=f, filename=filename, caption=f"{count} orders exported")
+    finally:
+        os.remove(path)
+
+async def reload_catalog(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    if user_id != ADMIN_USER_ID:
+        await update.message.reply_text("You are not authorized to reload the catalog.")
+        return
+    try:
+        products = await asyncio.to_thread(product_catalog.reload)
+    except Exception as e:
+        await update.message.reply_text(f"Catalog reload failed: {e}")
+        return
+    await update.message.reply_text(f"Catalog reloaded: {len(products)} products.")
+
+LATENCY_SECTIONS = (
+    ("Slowest Buttons", "bot_callback_seconds", "route"),
+    ("Slowest Commands", "bot_command_seconds", "command"),
+    ("Database", "storage_query_seconds", "op"),
+    ("Payment Provider", "payment_request_seconds", "op"),
+    ("Telegram API", "telegram_api_seconds", "method"),
+)
+
+def format_ms(seconds):
+    return "∞" if seconds == float("inf") else f"{seconds * 1000:.1f} ms"
 
 async def bot_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
@@ -713,21 +928,24 @@ async def bot_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("You are not authorized to view bot status.")
         return
     
-    orders = get_recent_orders(1000)
-    giveaways = get_active_giveaways()
-    
-    total_orders = len(orders)
-    total_revenue = sum(order[5] for order in orders)
-    active_giveaways = len(giveaways)
-    total_entries = sum(len(get_giveaway_entries(g[0])) for g in giveaways)
+    counters = await storage.run_read(stats.get_counters)
+    active_giveaways, total_entries = await storage.run_read(stats.get_active_giveaway_totals)
     
     msg = "🤖 **Bot Status Report**\n\n"
-    msg += f"📦 **Total Orders:** {total_orders}\n"
-    msg += f"💰 **Total Revenue:** £{total_revenue} {config.CURRENCY}\n"
+    msg += f"📦 **Total Orders:** {counters['orders']}\n"
+    msg += f"💰 **Total Revenue:** £{counters['revenue']:.2f} {config.CURRENCY}\n"
     msg += f"🎁 **Active Giveaways:** {active_giveaways}\n"
     msg += f"👥 **Total Giveaway Entries:** {total_entries}\n"
     msg += f"📅 **Report Generated:** {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
     msg += f"🟢 **Bot Status:** Online and Running\n"
+    if workers.WORKER_COUNT > 1:
+        msg += f"⚙️ **Worker:** {workers.WORKER_INDEX + 1} of {workers.WORKER_COUNT} (latency below is this worker's)\n"
+    for title, name, label in LATENCY_SECTIONS:
+        slowest = metrics.REGISTRY.slowest(name)
+        if slowest:
+            msg += f"\n⏱ **{title}:**\n"
+            for labels, hist in slowest:
+                msg += f"`{labels[label]}`: {hist.count} calls, avg {format_ms(hist.average)}, p50 ≤ {format_ms(hist.percentile(0.5))}, p99 ≤ {format_ms(hist.percentile(0.99))}\n"
     
     await update.message.reply_text(msg, parse_mode='Markdown')
 
@@ -761,34 +979,16 @@ async def admin_orders_handler(update: Update, context: ContextTypes.DEFAULT_TYP
     
     await query.answer()
     
-    orders = get_recent_orders(20)
-    if not orders:
-        await query.edit_message_text("No orders found.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Back to Admin Panel", callback_data="admin_panel")]]))
-        return
-    
-    msg = "Recent Orders\n\n"
-    total_revenue = 0
-    
-    for i, order in enumerate(orders[:10], 1):  # Show first 10 orders
-        msg += f"{i}. Order #{order[0]}\n"
-        msg += f"User: {order[1]}\n"
-        msg += f"Product: {order[3]} (Qty: {order[4]})\n"
-        msg += f"Price: £{order[5]} {config.CURRENCY}\n"
-        msg += f"Date: {order[0][:19]}\n"
-        if order[7]:  # Discount code
-            msg += f"Discount: {order[7]} ({order[8]}%)\n"
-        msg += f"Invoice: {order[6]}\n"
-        msg += "---\n"
-        total_revenue += order[5]
-    
-    msg += f"\nTotal Revenue (last 10): £{total_revenue} {config.CURRENCY}"
-    
-    keyboard = [
-        [InlineKeyboardButton("Export Orders", callback_data="admin_export_orders")],
-        [InlineKeyboardButton("Back to Admin Panel", callback_data="admin_panel")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await query.edit_message_text(msg, reply_markup=reply_markup, parse_mode='Markdown')
+    order_filters = context.user_data.get("order_filters", {})
+    if query.data == "orders_clear":
+        order_filters = context.user_data["order_filters"] = {}
+    older_than = newer_than = None
+    if query.data.startswith("orders_older_"):
+        older_than = context.args[0]
+    elif query.data.startswith("orders_newer_"):
+        newer_than = context.args[0]
+    msg, reply_markup = await order_page(order_filters, older_than, newer_than)
+    await query.edit_message_text(msg, reply_markup=reply_markup)
 
 async def admin_giveaways_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
@@ -800,20 +1000,19 @@ async def admin_giveaways_handler(update: Update, context: ContextTypes.DEFAULT_
     
     await query.answer()
     
-    giveaways = get_active_giveaways()
+    giveaways = await storage.run_read(get_active_giveaways)
     if not giveaways:
         msg = "No Active Giveaways\n\nUse /create_giveaway to create a new giveaway."
     else:
-        msg = "Active Giveaways\n\n"
+        lines = ["Active Giveaways", ""]
         for g in giveaways:
-            entries = get_giveaway_entries(g[0])
-            end_date = date.fromisoformat(g[4])
+            end_date = date.fromisoformat(g[5])
             days_left = (end_date - date.today()).days
-            msg += f"{g[1]} (ID: {g[0]})\n"
-            msg += f"Prize: {g[3]}\n"
-            msg += f"Entries: {len(entries)}/{g[6]}\n"
-            msg += f"Days Left: {days_left}\n"
-            msg += "---\n"
+            lines += [f"{g[1]} (ID: {g[0]})", f"Prize: {g[3]}", f"Entries: {g[7]}/{g[6]}", f"Days Left: {days_left}", "---"]
+        pages = list(render.chunks(lines, render.MESSAGE_LIMIT - 100))
+        msg = pages[0]
+        if len(pages) > 1:
+            msg += "\n… more giveaways not shown; use /list_giveaways for all of them."
     
     keyboard = [
         [InlineKeyboardButton("View Entries", callback_data="admin_giveaway_entries")],
@@ -833,7 +1032,7 @@ async def admin_discount_handler(update: Update, context: ContextTypes.DEFAULT_T
     
     await query.answer()
     
-    msg = "💰 Add Discount Code\n\nUse the command:\n/addcode CODE PERCENT YYYY-MM-DD\n\nExample:\n/addcode SUMMER20 20 2024-08-31"
+    msg = "💰 Add Discount Code\n\nUse the command:\n/addcode CODE PERCENT YYYY-MM-DD [MAX_USES]\n\nExample:\n/addcode SUMMER20 20 2024-08-31 100"
     
     keyboard = [
         [InlineKeyboardButton("Back to Admin Panel", callback_data="admin_panel")]
@@ -851,20 +1050,20 @@ async def admin_stats_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
     
     await query.answer()
     
-    # Get basic stats
-    orders = get_recent_orders(1000)  # Get all orders for stats
-    giveaways = get_active_giveaways()
-    
-    total_orders = len(orders)
-    total_revenue = sum(order[5] for order in orders)
-    active_giveaways = len(giveaways)
-    total_entries = sum(len(get_giveaway_entries(g[0])) for g in giveaways)
+    # Counters are maintained on write, so this is constant-time
+    counters = await storage.run_read(stats.get_counters)
+    active_giveaways, total_entries = await storage.run_read(stats.get_active_giveaway_totals)
     
     msg = "📈 Bot Statistics\n\n"
-    msg += f"📦 Total Orders: {total_orders}\n"
-    msg += f"💰 Total Revenue: £{total_revenue} {config.CURRENCY}\n"
+    msg += f"📦 Total Orders: {counters['orders']}\n"
+    msg += f"💰 Total Revenue: £{counters['revenue']:.2f} {config.CURRENCY}\n"
     msg += f"🎁 Active Giveaways: {active_giveaways}\n"
     msg += f"👥 Total Giveaway Entries: {total_entries}\n"
+    top_products = await storage.run_read(stats.get_product_stats)
+    if top_products:
+        msg += "\n🏷 Top Products:\n"
+        for product_id, name, product_orders, quantity, revenue in top_products:
+            msg += f"{name}: {product_orders} orders, {quantity} units, £{revenue:.2f}\n"
     msg += f"📅 Last Updated: {datetime.now().strftime('%Y-%m-%d %H:%M')}\n"
     
     keyboard = [
@@ -906,40 +1105,22 @@ async def broadcast_message_handler(update: Update, context: ContextTypes.DEFAUL
         return
     
     message_text = update.message.text
-    users = get_all_users()
+    users = await storage.run_read(get_all_users)
     
     if not users:
         await update.message.reply_text("No users found to broadcast to.")
         user_data["awaiting_broadcast"] = False
         return
     
-    # Save broadcast message
-    save_broadcast_message(message_text, user_id)
-    
-    # Send to all users
-    success_count = 0
-    failed_count = 0
-    
-    for user_id_target in users:
-        try:
-            await context.bot.send_message(
-                chat_id=user_id_target,
-                text=message_text,
-                parse_mode='Markdown'
-            )
-            success_count += 1
-        except Exception as e:
-            failed_count += 1
-            print(f"Failed to send to {user_id_target}: {e}")
-    
+    broadcast_id = await storage.run_write(broadcast.create_job, message_text, user_id, users)
+    if workers.owns_background_jobs():
+        broadcast_engine.start_job(context.bot, broadcast_id)
+    user_data["awaiting_broadcast"] = False
+
     await update.message.reply_text(
-        f"📢 Broadcast Complete!\n\n"
-        f"✅ Sent successfully: {success_count}\n"
-        f"❌ Failed: {failed_count}\n"
-        f"📊 Total recipients: {len(users)}"
+        f"📢 Broadcast #{broadcast_id} queued for {len(users)} recipients.\n\n"
+        "Sending in the background; you will get a report when it completes."
     )
-    
-    user_data["awaiting_broadcast"] = False
 
 async def admin_giveaway_entries_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
@@ -951,15 +1132,14 @@ async def admin_giveaway_entries_handler(update: Update, context: ContextTypes.D
     
     await query.answer()
     
-    giveaways = get_active_giveaways()
+    giveaways = await storage.run_read(get_active_giveaways)
     if not giveaways:
         await query.edit_message_text("No active giveaways found.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Back to Admin Panel", callback_data="admin_panel")]]))
         return
     
     keyboard = []
     for g in giveaways:
-        entries = get_giveaway_entries(g[0])
-        keyboard.append([InlineKeyboardButton(f"🎁 {g[1]} ({len(entries)} entries)", callback_data=f"view_entries_{g[0]}")])
+        keyboard.append([InlineKeyboardButton(f"🎁 {g[1]} ({g[7]} entries)", callback_data=f"view_entries_{g[0]}")])
     
     keyboard.append([InlineKeyboardButton("Back to Admin Panel", callback_data="admin_panel")])
     reply_markup = InlineKeyboardMarkup(keyboard)
@@ -976,53 +1156,236 @@ async def view_entries_handler(update: Update, context: ContextTypes.DEFAULT_TYP
     
     await query.answer()
     
-    data = query.data
-    giveaway_id = int(data.split("_")[2])
-    
-    entries = get_giveaway_entries(giveaway_id)
-    giveaways = get_active_giveaways()
-    giveaway = next((g for g in giveaways if g[0] == giveaway_id), None)
-    
-    if not entries:
-        await query.edit_message_text(f"No entries found for giveaway: {giveaway[1] if giveaway else 'Unknown'}", 
-                                   reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Back", callback_data="admin_giveaway_entries")]]))
+    if query.data.startswith("entries_next_"):
+        giveaway_id, after, position = context.args
+        msg, reply_markup = await entries_page(giveaway_id, after=after, position=position)
+    elif query.data.startswith("entries_prev_"):
+        giveaway_id, before, position = context.args
+        msg, reply_markup = await entries_page(giveaway_id, before=before, position=position)
+    else:
+        msg, reply_markup = await entries_page(context.args[0])
+    await query.edit_message_text(msg, reply_markup=reply_markup)
+
+async def entries_page(giveaway_id, after=None, before=None, position=1):
+    """One page of a giveaway's entries with Prev/Next buttons.
+
+    ``position`` is the number of the first entry after ``after``, or of the
+    entry ``before``, carried in the button so pages are numbered without counting rows.
+    """
+    giveaway = await storage.run_read(get_giveaway, giveaway_id)
+    back = [InlineKeyboardButton("Back", callback_data="admin_giveaway_entries")]
+    if not giveaway:
+        return f"Giveaway {giveaway_id} not found.", InlineKeyboardMarkup([back])
+    rows, has_prev, has_next = await storage.run_read(get_giveaway_entries_page, giveaway_id, after, before)
+    if not rows:
+        return f"No entries found for giveaway: {giveaway[1]}", InlineKeyboardMarkup([back])
+    first = position - len(rows) if before is not None else position
+    lines = [f"🎁 Entries for: {giveaway[1]}", ""]
+    lines += [f"{i}. @{username} ({entry_user_id})" if username else f"{i}. User{entry_user_id}"
+              for i, (_, entry_user_id, username) in enumerate(rows, first)]
+    lines += ["", f"Showing {first}-{first + len(rows) - 1} of {giveaway[7]} entries"]
+    keyboard = []
+    nav = render.nav_row(
+        f"entries_prev_{giveaway_id}_{rows[0][0]}_{first}" if has_prev else None,
+        f"entries_next_{giveaway_id}_{rows[-1][0]}_{first + len(rows)}" if has_next else None,
+    )
+    if nav:
+        keyboard.append(nav)
+    keyboard.append([InlineKeyboardButton("📋 Full List", callback_data=f"copy_entries_{giveaway_id}")])
+    keyboard.append(back)
+    return next(render.chunks(lines)), InlineKeyboardMarkup(keyboard)
+
+callback_router = router.CallbackRouter()
+for pattern, handler in (
+    ("main_menu", start),
+    ("menu_shop", menu_handler),
+    ("menu_giveaways", menu_handler),
+    ("menu_support", menu_handler),
+    ("menu_refer", menu_handler),
+    ("shop_page_{page:int}", shop_page_handler),
+    ("select_{product_id:int}", select_product_handler),
+    ("qty_{quantity:int}", quantity_handler),
+    ("basket_remove_{product_id:int}", basket_remove_handler),
+    ("back_to_cart", show_cart),
+    ("enter_address", cart_handler),
+    ("apply_discount", cart_handler),
+    ("checkout", cart_handler),
+    ("check_{invoice_id}_{product_id:int}", check_payment_handler),
+    ("giveaway_{giveaway_id:int}", giveaway_detail_handler),
+    ("enter_giveaway_{giveaway_id:int}", enter_giveaway_handler),
+    ("admin_panel", admin_panel_handler),
+    ("admin_orders", admin_orders_handler),
+    ("orders_older_{order_id:int}", admin_orders_handler),
+    ("orders_newer_{order_id:int}", admin_orders_handler),
+    ("orders_clear", admin_orders_handler),
+    ("admin_export_orders", admin_export_orders_handler),
+    ("admin_giveaways", admin_giveaways_handler),
+    ("admin_discount", admin_discount_handler),
+    ("admin_stats", admin_stats_handler),
+    ("admin_broadcast", admin_broadcast_handler),
+    ("admin_giveaway_entries", admin_giveaway_entries_handler),
+    ("view_entries_{giveaway_id:int}", view_entries_handler),
+    ("entries_next_{giveaway_id:int}_{entry_id:int}_{position:int}", view_entries_handler),
+    ("entries_prev_{giveaway_id:int}_{entry_id:int}_{position:int}", view_entries_handler),
+    ("copy_entries_{giveaway_id:int}", copy_entries_handler),
+):
+    callback_router.add(pattern, handler)
+
+class InstrumentedRequest(HTTPXRequest):
+    """Records the latency of every Bot API call by method name."""
+
+    async def do_request(self, url, method, *args, **kwargs):
+        with metrics.REGISTRY.timer("telegram_api", method=url.rsplit("/", 1)[-1]):
+            return await super().do_request(url, method, *args, **kwargs)
+
+# Commands rate-limited as "admin" actions.
+ADMIN_COMMANDS = ("orders", "addcode", "create_giveaway", "list_giveaways", "view_entries", "draw_winners",
+                  "referrals", "export_orders", "bot_status", "reload_catalog")
+
+rate_limiter = ratelimit.RateLimiter(
+    {"admin": (ratelimit.LIMITS["admin"][0], getattr(config, "RATE_LIMIT_SECONDS", ratelimit.LIMITS["admin"][1])),
+     **getattr(config, "RATE_LIMITS", {})},
+    admin_commands=ADMIN_COMMANDS,
+)
+
+async def rate_limit_gate(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Runs before every handler; turns away users who exceed their action's rate."""
+    if not update.effective_user:
         return
-    
-    msg = f"🎁 Entries for: {giveaway[1] if giveaway else 'Unknown'}\n\n"
-    msg += "Numbered List for Random Picker:\n"
-    
-    # Create numbered list for random picker
-    numbered_list = ""
-    for i, entry in enumerate(entries, 1):
-        username = entry[1] if entry[1] else f"User{entry[0]}"
-        numbered_list += f"{i}. @{username}\n"
-    
-    msg += numbered_list
-    msg += f"\nTotal Entries: {len(entries)}"
-    
-    keyboard = [
-        [InlineKeyboardButton("📋 Copy List", callback_data=f"copy_entries_{giveaway_id}")],
-        [InlineKeyboardButton("Back", callback_data="admin_giveaway_entries")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    await query.edit_message_text(msg, reply_markup=reply_markup, parse_mode='Markdown')
+    action = rate_limiter.classify(update)
+    retry_after = rate_limiter.allow(update.effective_user.id, action)
+    if not retry_after:
+        return
+    metrics.REGISTRY.inc("rate_limited_total", action=action)
+    text = f"Too many requests, please wait {max(1, round(retry_after))}s and try again."
+    if update.callback_query:
+        # Always answer, or the button keeps spinning.
+        await update.callback_query.answer(text)
+    elif update.effective_message and rate_limiter.first_rejection(update.effective_user.id, action):
+        await update.effective_message.reply_text(text)
+    raise ApplicationHandlerStop
+
+def command(name, callback):
+    return CommandHandler(name, metrics.timed("bot_command", command=name)(callback))
+
+def text_message(callback):
+    return MessageHandler(filters.TEXT & ~filters.COMMAND, metrics.timed("bot_message", handler=callback.__name__)(callback))
+
+metrics_server = None
+application = None
+
+async def startup(app):
+    global metrics_server, application
+    application = app
+    # Every worker keeps its own catalog snapshot fresh.
+    await product_catalog.start()
+    port = getattr(config, "METRICS_PORT", None)
+    if port:
+        # One scrape target per worker process: METRICS_PORT, METRICS_PORT + 1, ...
+        port += workers.WORKER_INDEX
+        metrics_server = await metrics.start_server(getattr(config, "METRICS_HOST", "127.0.0.1"), port)
+        logging.info("Serving metrics on port %s%s", port, metrics.METRICS_PATH)
+    if not workers.owns_background_jobs():
+        return
+    await settlement_engine.start(
+        app.bot,
+        getattr(config, "SETTLEMENT_WEBHOOK_HOST", "127.0.0.1"),
+        getattr(config, "SETTLEMENT_WEBHOOK_PORT", None),
+    )
+    # With several workers, broadcasts queued by the others are picked up from the database.
+    await broadcast_engine.start(app.bot, broadcast.QUEUE_POLL_INTERVAL if workers.WORKER_COUNT > 1 else None)
+
+async def shutdown(app):
+    if metrics_server is not None:
+        metrics_server.close()
+        await metrics_server.wait_closed()
+    await product_catalog.stop()
+    await settlement_engine.stop()
+    await broadcast_engine.stop()
+    await payments.close()
+    storage.close()
+
+CONCURRENT_UPDATES = 64
+
+def build_application(request=None):
+    """Build the Application with every handler registered.
+
+    ``request`` replaces the Bot API transport (benchmarks pass a fake one).
+    """
+    app = (
+        ApplicationBuilder()
+        .token(config.TELEGRAM_BOT_TOKEN)
+        .request(request or InstrumentedRequest(connection_pool_size=256))
+        .persistence(persistence.SQLitePersistence(getattr(config, "USER_DATA_FLUSH_SECONDS", persistence.UPDATE_INTERVAL)))
+        .concurrent_updates(workers.PerUserUpdateProcessor(getattr(config, "CONCURRENT_UPDATES", CONCURRENT_UPDATES)))
+        .post_init(startup)
+        .post_shutdown(shutdown)
+        .build()
+    )
+    app.add_handler(TypeHandler(Update, rate_limit_gate), group=-1)
+    app.add_handler(command("start", start))
+    app.add_handler(CallbackQueryHandler(callback_router.dispatch))
+    app.add_handler(command("orders", orders))
+    app.add_handler(command("addcode", addcode))
+    app.add_handler(command("create_giveaway", create_giveaway_cmd))
+    app.add_handler(command("list_giveaways", list_giveaways))
+    app.add_handler(command("view_entries", view_giveaway_entries))
+    app.add_handler(command("draw_winners", draw_winners))
+    app.add_handler(command("referrals", referral_leaderboard))
+    app.add_handler(command("export_orders", export_orders))
+    app.add_handler(command("bot_status", bot_status))
+    app.add_handler(command("reload_catalog", reload_catalog))
+    app.add_handler(text_message(address_message_handler))
+    # Separate groups: each text handler checks its own awaiting_* flag, and only
+    # the first matching handler in a group would ever run.
+    app.add_handler(text_message(discount_message_handler), group=1)
+    app.add_handler(text_message(broadcast_message_handler), group=2)
+    return app
+
+def webhook_options():
+    webhook_url = config.WEBHOOK_URL
+    secret_token = getattr(config, "WEBHOOK_SECRET_TOKEN", None) or None
+    if secret_token is None:
+        logging.warning("WEBHOOK_SECRET_TOKEN is not set; anyone who finds the webhook URL can post updates")
+    return {
+        "listen": getattr(config, "WEBHOOK_LISTEN", "127.0.0.1"),
+        "port": getattr(config, "WEBHOOK_PORT", 8443),
+        "url_path": urlsplit(webhook_url).path.lstrip("/"),
+        "webhook_url": webhook_url,
+        "secret_token": secret_token,
+        "allowed_updates": Update.ALL_TYPES,
+    }
+
+async def start_intake(updater):
+    """Start polling or the webhook on the multi-process intake's Updater."""
+    if getattr(config, "RUN_MODE", "polling") == "webhook":
+        await updater.start_webhook(**webhook_options())
+    else:
+        await updater.start_polling(allowed_updates=Update.ALL_TYPES)
+
+def run():
+    """Serve updates by long polling or, with ``RUN_MODE = "webhook"``, on a local HTTP server.
+
+    With ``WORKERS`` above 1 the handlers run in that many processes (see workers.py).
+    """
+    mode = getattr(config, "RUN_MODE", "polling")
+    if mode not in ("polling", "webhook"):
+        raise ValueError(f"Unknown RUN_MODE {mode!r}; expected 'polling' or 'webhook'")
+    worker_count = getattr(config, "WORKERS", 1)
+    if worker_count > 1:
+        logging.info("Bot is running (%s, %d worker processes)...", mode, worker_count)
+        # Workers open their own connections; don't carry this process's into them.
+        storage.close()
+        workers.run(build_application, worker_count, config.TELEGRAM_BOT_TOKEN, start_intake)
+    elif mode == "webhook":
+        options = webhook_options()
+        logging.info("Bot is running (webhook on %s:%s for %s)...", options["listen"], options["port"],
+                     options["webhook_url"])
+        build_application().run_webhook(**options)
+    else:
+        logging.info("Bot is running (polling)...")
+        build_application().run_polling(allowed_updates=Update.ALL_TYPES)
 
 if __name__ == "__main__":
     init_db()
-    init_giveaway_db()
-    app = ApplicationBuilder().token(config.TELEGRAM_BOT_TOKEN).build()
-    app.add_handler(CommandHandler("start", start))
-    app.add_handler(CallbackQueryHandler(button))
-    app.add_handler(CommandHandler("orders", orders))
-    app.add_handler(CommandHandler("addcode", addcode))
-    app.add_handler(CommandHandler("create_giveaway", create_giveaway_cmd))
-    app.add_handler(CommandHandler("list_giveaways", list_giveaways))
-    app.add_handler(CommandHandler("view_entries", view_giveaway_entries))
-    app.add_handler(CommandHandler("export_orders", export_orders))
-    app.add_handler(CommandHandler("bot_status", bot_status))
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, address_message_handler))
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, discount_message_handler))
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, broadcast_message_handler))
-    print("Bot is running...")
-    app.run_polling() 
\ No newline at end of file
+    run()
@@ -0,0 +1,230 @@
+"""Resumable broadcast jobs.
+
+A broadcast is stored as a ``broadcast_messages`` row plus one
+``broadcast_recipients`` row per target chat.  Jobs are sent in the
+background by a pool of workers that share a global send rate and a
+per-chat spacing (Telegram allows roughly 30 messages/sec overall and one
+per second to the same chat), back off on ``RetryAfter`` and checkpoint each
+recipient's outcome, so a restarted bot resumes unfinished jobs where they
+stopped.
+"""
+import asyncio
+import collections
+import logging
+import time
+from datetime import datetime
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+import storage
+
+GLOBAL_RATE = 25
+PER_CHAT_INTERVAL = 1.0
+CONCURRENCY = 20
+MAX_ATTEMPTS = 3
+FLUSH_EVERY = 200
+FLUSH_INTERVAL = 2.0
+QUEUE_POLL_INTERVAL = 5.0
+
+logger = logging.getLogger(__name__)
+
+JOB_COLUMNS = (
+    ("status", "TEXT DEFAULT 'done'"),
+    ("delivered_count", "INTEGER DEFAULT 0"),
+    ("failed_count", "INTEGER DEFAULT 0"),
+    ("started_at", "REAL"),
+    ("finished_at", "REAL"),
+    ("messages_per_second", "REAL"),
+)
+
+
+def create_job(message_text, sent_by, recipients):
+    with storage.transaction() as c:
+        cur = c.execute("INSERT INTO broadcast_messages (message_text, sent_by, sent_date, recipients_count, status) "
+                        "VALUES (?, ?, ?, ?, 'queued')",
+                        (message_text, sent_by, datetime.now().isoformat(), len(recipients)))
+        broadcast_id = cur.lastrowid
+        c.executemany("INSERT OR IGNORE INTO broadcast_recipients (broadcast_id, user_id) VALUES (?, ?)",
+                      ((broadcast_id, user_id) for user_id in recipients))
+    return broadcast_id
+
+
+def get_job(broadcast_id):
+    row = storage.fetchone("SELECT id, message_text, sent_by, recipients_count, status, delivered_count, failed_count, "
+                           "messages_per_second FROM broadcast_messages WHERE id = ?", (broadcast_id,))
+    if not row:
+        return None
+    keys = ("id", "message_text", "sent_by", "recipients_count", "status", "delivered_count", "failed_count",
+            "messages_per_second")
+    return dict(zip(keys, row))
+
+
+def get_unfinished_jobs():
+    return [row[0] for row in storage.fetchall(
+        "SELECT id FROM broadcast_messages WHERE status IN ('queued', 'running') ORDER BY id")]
+
+
+class RateLimiter:
+    """Spaces acquisitions ``1 / rate`` seconds apart; ``pause`` delays everyone."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            now = time.monotonic()
+            wait = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds):
+        self._next = max(self._next, time.monotonic() + seconds)
+
+
+class BroadcastEngine:
+    def __init__(self, concurrency=CONCURRENCY, global_rate=GLOBAL_RATE, per_chat_interval=PER_CHAT_INTERVAL,
+                 parse_mode="Markdown"):
+        self.concurrency = concurrency
+        self.global_rate = global_rate
+        self.per_chat_interval = per_chat_interval
+        self.parse_mode = parse_mode
+        # Shared by every running job so concurrent broadcasts stay under the global limit.
+        self._limiter = RateLimiter(global_rate)
+        # chat_id -> last send time, oldest first; only chats inside the spacing window are kept.
+        self._last_sent = collections.OrderedDict()
+        self._tasks = {}
+        self._watcher = None
+
+    def start_job(self, bot, broadcast_id):
+        if broadcast_id not in self._tasks:
+            task = asyncio.get_running_loop().create_task(self.run_job(bot, broadcast_id))
+            self._tasks[broadcast_id] = task
+            task.add_done_callback(lambda _: self._tasks.pop(broadcast_id, None))
+        return self._tasks[broadcast_id]
+
+    async def resume_unfinished(self, bot):
+        for broadcast_id in await storage.run_read(get_unfinished_jobs):
+            if broadcast_id not in self._tasks:
+                logger.info("Starting unfinished broadcast %s", broadcast_id)
+                self.start_job(bot, broadcast_id)
+
+    async def start(self, bot, poll_interval=None):
+        """Resume unfinished jobs; with ``poll_interval``, keep picking up jobs queued by other processes."""
+        await self.resume_unfinished(bot)
+        if poll_interval:
+            self._watcher = asyncio.get_running_loop().create_task(self._watch(bot, poll_interval))
+
+    async def _watch(self, bot, poll_interval):
+        while True:
+            await asyncio.sleep(poll_interval)
+            try:
+                await self.resume_unfinished(bot)
+            except Exception:
+                logger.exception("Polling for queued broadcasts failed")
+
+    async def _send(self, bot, chat_id, text):
+        limiter, last_sent = self._limiter, self._last_sent
+        attempts = 0
+        while True:
+            gap = last_sent.get(chat_id, 0) + self.per_chat_interval - time.monotonic()
+            if gap > 0:
+                await asyncio.sleep(gap)
+            await limiter.acquire()
+            now = time.monotonic()
+            last_sent[chat_id] = now
+            last_sent.move_to_end(chat_id)
+            while last_sent and now - next(iter(last_sent.values())) >= self.per_chat_interval:
+                last_sent.popitem(last=False)
+            try:
+                await bot.send_message(chat_id=chat_id, text=text, parse_mode=self.parse_mode)
+                return "sent", None
+            except RetryAfter as e:
+                delay = e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds") else e.retry_after
+                limiter.pause(delay)
+            except (Forbidden, BadRequest) as e:
+                return "failed", str(e)
+            except NetworkError as e:
+                attempts += 1
+                if attempts >= MAX_ATTEMPTS:
+                    return "failed", str(e)
+                await asyncio.sleep(attempts)
+            except Exception as e:
+                return "failed", str(e)
+
+    async def run_job(self, bot, broadcast_id):
+        job = await storage.run_read(get_job, broadcast_id)
+        if not job or job["status"] == "done":
+            return job
+        pending = [row[0] for row in await storage.run_read(
+            storage.fetchall,
+            "SELECT user_id FROM broadcast_recipients WHERE broadcast_id = ? AND status = 'pending'", (broadcast_id,))]
+        started = time.time()
+        await storage.run_write(storage.execute,
+                                "UPDATE broadcast_messages SET status = 'running', started_at = COALESCE(started_at, ?) "
+                                "WHERE id = ?", (started, broadcast_id))
+
+        queue = asyncio.Queue()
+        for user_id in pending:
+            queue.put_nowait(user_id)
+        results = []
+        last_flush = time.monotonic()
+
+        def record(batch):
+            delivered = sum(1 for status, _, _ in batch if status == "sent")
+            with storage.transaction() as c:
+                c.executemany("UPDATE broadcast_recipients SET status = ?, error = ? WHERE broadcast_id = ? AND user_id = ?",
+                              ((status, error, broadcast_id, user_id) for status, error, user_id in batch))
+                c.execute("UPDATE broadcast_messages SET delivered_count = delivered_count + ?, "
+                          "failed_count = failed_count + ? WHERE id = ?",
+                          (delivered, len(batch) - delivered, broadcast_id))
+
+        async def flush():
+            nonlocal results, last_flush
+            batch, results = results, []
+            last_flush = time.monotonic()
+            if batch:
+                await storage.run_write(record, batch)
+
+        async def worker():
+            while True:
+                try:
+                    user_id = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                status, error = await self._send(bot, user_id, job["message_text"])
+                results.append((status, error, user_id))
+                if len(results) >= FLUSH_EVERY or time.monotonic() - last_flush >= FLUSH_INTERVAL:
+                    await flush()
+
+        try:
+            await asyncio.gather(*(worker() for _ in range(min(self.concurrency, len(pending)) or 1)))
+        finally:
+            await flush()
+        elapsed = max(time.time() - started, 1e-6)
+        await storage.run_write(storage.execute,
+                                "UPDATE broadcast_messages SET status = 'done', finished_at = ?, messages_per_second = ? "
+                                "WHERE id = ?", (time.time(), len(pending) / elapsed, broadcast_id))
+        job = await storage.run_read(get_job, broadcast_id)
+        try:
+            await bot.send_message(
+                chat_id=job["sent_by"],
+                text=(f"📢 Broadcast Complete!\n\n"
+                      f"✅ Sent successfully: {job['delivered_count']}\n"
+                      f"❌ Failed: {job['failed_count']}\n"
+                      f"📊 Total recipients: {job['recipients_count']}\n"
+                      f"⚡ Throughput: {job['messages_per_second']:.1f} msg/s")
+            )
+        except Exception:
+            logger.exception("Failed to report broadcast %s to %s", broadcast_id, job["sent_by"])
+        return job
+
+    async def stop(self):
+        if self._watcher:
+            self._watcher.cancel()
+            self._watcher = None
+        for task in list(self._tasks.values()):
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
@@ -0,0 +1,199 @@
+"""Product catalog with an id index, cached keyboards and hot reload.
+
+A :class:`Catalog` is an immutable snapshot of the product list: products
+are indexed by id and the paginated shop keyboards and per-product quantity
+keyboards are built once, on first use, then reused for every tap.  The
+:class:`CatalogManager` swaps in a fresh snapshot (dropping the cached
+keyboards with it) whenever its source changes, so products can be edited in
+a JSON file or the ``products`` table without restarting the bot.  The
+source is checked by a background task through ``storage.run_read``, never
+from a handler, so reading the catalog is always just an attribute lookup.
+"""
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+import storage
+
+PAGE_SIZE = 8
+CHECK_INTERVAL = 30
+
+logger = logging.getLogger(__name__)
+
+
+def _normalise(product):
+    # JSON object keys are strings; quantity tiers are looked up by int.
+    product = dict(product)
+    product["prices"] = {int(qty): float(price) for qty, price in product["prices"].items()}
+    product["id"] = int(product["id"])
+    return product
+
+
+class Catalog:
+    def __init__(self, products, currency="GBP", page_size=PAGE_SIZE):
+        self.products = [_normalise(p) for p in products]
+        self.currency = currency
+        self.page_size = page_size
+        self._by_id = {p["id"]: p for p in self.products}
+        self._position = {p["id"]: i for i, p in enumerate(self.products)}
+        self._shop_pages = {}
+        self._quantity_keyboards = {}
+
+    def __len__(self):
+        return len(self.products)
+
+    def get(self, product_id):
+        return self._by_id.get(product_id)
+
+    @property
+    def page_count(self):
+        return max(1, -(-len(self.products) // self.page_size))
+
+    def page_of(self, product_id):
+        return self._position.get(product_id, 0) // self.page_size
+
+    def shop_keyboard(self, page=0):
+        page = min(max(page, 0), self.page_count - 1)
+        markup = self._shop_pages.get(page)
+        if markup is None:
+            start = page * self.page_size
+            keyboard = [
+                [InlineKeyboardButton(f"{p['name']}", callback_data=f"select_{p['id']}")]
+                for p in self.products[start:start + self.page_size]
+            ]
+            nav = []
+            if page > 0:
+                nav.append(InlineKeyboardButton("◀ Prev", callback_data=f"shop_page_{page - 1}"))
+            if page < self.page_count - 1:
+                nav.append(InlineKeyboardButton("Next ▶", callback_data=f"shop_page_{page + 1}"))
+            if nav:
+                keyboard.append(nav)
+            keyboard.append([InlineKeyboardButton("Main Menu", callback_data="main_menu")])
+            markup = self._shop_pages[page] = InlineKeyboardMarkup(keyboard)
+        return markup
+
+    def quantity_keyboard(self, product_id):
+        markup = self._quantity_keyboards.get(product_id)
+        if markup is None:
+            product = self._by_id[product_id]
+            keyboard = [
+                [InlineKeyboardButton(f"{qty} for £{price} {self.currency}", callback_data=f"qty_{qty}")
+                 for qty, price in product["prices"].items()],
+                [InlineKeyboardButton("Back", callback_data=f"shop_page_{self.page_of(product_id)}"),
+                 InlineKeyboardButton("Main Menu", callback_data="main_menu")]
+            ]
+            markup = self._quantity_keyboards[product_id] = InlineKeyboardMarkup(keyboard)
+        return markup
+
+
+class ConfigSource:
+    def __init__(self, products):
+        self.products = products
+
+    def fingerprint(self):
+        return None
+
+    def load(self):
+        return self.products
+
+
+class FileSource:
+    """JSON file holding a list of products in the config.PRODUCTS format."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def fingerprint(self):
+        st = os.stat(self.path)
+        return st.st_mtime_ns, st.st_size
+
+    def load(self):
+        with open(self.path, encoding="utf-8") as f:
+            return json.load(f)
+
+
+class DatabaseSource:
+    def fingerprint(self):
+        return storage.fetchone("SELECT COUNT(*), MAX(updated_at) FROM products")
+
+    def load(self):
+        rows = storage.fetchall("SELECT id, name, description, prices, image FROM products "
+                                "WHERE is_active = 1 ORDER BY position, id")
+        return [{"id": r[0], "name": r[1], "description": r[2], "prices": json.loads(r[3]), "image": r[4]}
+                for r in rows]
+
+
+def upsert_products(products):
+    now = time.time()
+    storage.executemany(
+        "REPLACE INTO products (id, name, description, prices, image, position, is_active, updated_at) "
+        "VALUES (?, ?, ?, ?, ?, ?, 1, ?)",
+        [(p["id"], p["name"], p.get("description", ""), json.dumps(p["prices"]), p.get("image"), i, now)
+         for i, p in enumerate(products)])
+
+
+class CatalogManager:
+    """Holds the current :class:`Catalog` and reloads it when the source changes.
+
+    Between :meth:`start` and :meth:`stop`, a task checks the source's
+    fingerprint every ``check_interval`` seconds off the event loop;
+    :attr:`catalog` only ever returns the current snapshot.
+    """
+
+    def __init__(self, source, currency="GBP", page_size=PAGE_SIZE, check_interval=CHECK_INTERVAL):
+        self.source = source
+        self.currency = currency
+        self.page_size = page_size
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._fingerprint = None
+        self._catalog = None
+        self._watcher = None
+
+    def reload(self):
+        with self._lock:
+            fingerprint = self.source.fingerprint()
+            self._catalog = Catalog(self.source.load(), self.currency, self.page_size)
+            self._fingerprint = fingerprint
+        logger.info("Loaded catalog with %d products", len(self._catalog))
+        return self._catalog
+
+    def refresh(self):
+        """Reload if the source has changed since the last load; returns whether it did."""
+        if self._catalog is not None and self.source.fingerprint() == self._fingerprint:
+            return False
+        self.reload()
+        return True
+
+    @property
+    def catalog(self):
+        if self._catalog is None:
+            # Only before start(): the first load, e.g. in scripts that never run the bot.
+            return self.reload()
+        return self._catalog
+
+    async def start(self):
+        await storage.run_read(self.refresh)
+        if self.check_interval:
+            self._watcher = asyncio.get_running_loop().create_task(self._watch())
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            try:
+                await storage.run_read(self.refresh)
+            except Exception:
+                logger.exception("Catalog reload failed; keeping the current catalog")
+
+    async def stop(self):
+        if self._watcher:
+            self._watcher.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._watcher
+            self._watcher = None
@@ -4,6 +4,15 @@
 # Telegram Bot Configuration
 TELEGRAM_BOT_TOKEN = "YOUR_BOT_TOKEN_HERE"  # Get from @BotFather
 OXAPAY_API_KEY = ""  # Leave empty for testing without crypto payment provider
+PAYMENT_API_URL = "https://api.crypto-provider.com"  # Point at benchmarks/stub_provider.py for load tests
+PAYMENT_TIMEOUT_SECONDS = 10   # Per-request timeout for provider calls
+PAYMENT_MAX_CONCURRENCY = 50   # Maximum in-flight provider requests
+
+# Payment Settlement
+PAYMENT_CALLBACK_URL = ""  # Public URL that forwards to the webhook below, e.g. https://shop.example.com/payment/callback
+SETTLEMENT_WEBHOOK_HOST = "127.0.0.1"  # Local address for the payment callback endpoint
+SETTLEMENT_WEBHOOK_PORT = None  # e.g. 8082; None disables the webhook and relies on polling only
+SETTLEMENT_POLL_SECONDS = 30  # How often pending invoices are checked in one batch
 
 # Admin Configuration
 ADMIN_USER_ID = 123456789  # Replace with your Telegram user ID
@@ -32,9 +41,38 @@ PRODUCTS = [
     }
 ]
 
+# Broadcasts
+BROADCAST_CONCURRENCY = 20      # Parallel senders per broadcast
+BROADCAST_RATE_PER_SECOND = 25  # Global send rate; Telegram allows about 30 messages/sec
+
+# Discount Codes
+DISCOUNT_CACHE_SECONDS = 300  # How long validated codes are cached in memory (/addcode refreshes a code immediately)
+
+# Catalog Source
+CATALOG_SOURCE = "config"      # "config" (PRODUCTS above), "file" (CATALOG_FILE) or "db" (products table, seeded from PRODUCTS)
+CATALOG_FILE = "catalog.json"  # JSON list in the same format as PRODUCTS
+CATALOG_PAGE_SIZE = 8          # Products per shop page
+CATALOG_RELOAD_SECONDS = 30    # How often the file/table is checked for changes (/reload_catalog forces it)
+
 # Database Configuration
 DATABASE_FILE = "orders.db"
+USER_DATA_FLUSH_SECONDS = 10  # Carts/checkout state are written to the database in batches at this interval
+
+# Update Intake
+RUN_MODE = "polling"          # "polling", or "webhook" to have Telegram POST updates to a local HTTP server
+WEBHOOK_LISTEN = "127.0.0.1"  # Interface the webhook server binds to (put it behind a TLS reverse proxy)
+WEBHOOK_PORT = 8443
+WEBHOOK_URL = ""              # Public HTTPS URL registered with Telegram, e.g. "https://shop.example.com/telegram"
+WEBHOOK_SECRET_TOKEN = ""     # Random string; updates without it in X-Telegram-Bot-Api-Secret-Token are rejected
+CONCURRENT_UPDATES = 64       # Updates handled in parallel (1 processes them strictly one at a time)
+WORKERS = 1                   # Handler processes; above 1, updates are sharded across them by user ID (see workers.py)
+
+# Metrics
+METRICS_HOST = "127.0.0.1"  # Interface for the Prometheus /metrics endpoint
+METRICS_PORT = None         # e.g. 9100; None disables the endpoint (/bot_status still shows latency)
 
 # Security Settings
-MAX_ORDERS_PER_USER = 10  # Maximum orders per user per day
-RATE_LIMIT_SECONDS = 60   # Rate limiting for admin commands 
\ No newline at end of file
+MAX_ORDERS_PER_USER = 10  # Maximum paid orders per user per day (checkout is refused once reached; None disables)
+RATE_LIMIT_SECONDS = 60   # Window for the admin action limit (30 admin commands/buttons per window per user)
+# Per-user limits by action class as (burst, seconds); overrides the defaults in ratelimit.LIMITS, e.g.
+# RATE_LIMITS = {"browse": (20, 10), "checkout": (3, 60), "payment_check": (10, 60)} 
\ No newline at end of file
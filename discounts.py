@@ -0,0 +1,102 @@
+"""Discount code cache and redemption accounting.
+
+Codes are validated from an in-process cache holding the parsed expiry
+date, so typing a code during a promo is a dict lookup.  Entries expire
+after ``CACHE_TTL`` seconds and are invalidated whenever a code is added or
+changed through this process.
+
+Usage limits are enforced in the database, not the cache: ``redeem``
+reserves one use with a conditional update when the buyer checks out, and
+``release`` returns it if that invoice is never paid.  ``redeem`` also
+rejects a code past its expiry date, which a cart may still be holding.  ``max_uses`` NULL means
+unlimited; ``uses`` is counted either way.
+"""
+import threading
+import time
+from datetime import date
+
+import storage
+
+CACHE_TTL = 300
+MAX_CACHED_CODES = 10000
+
+
+class DiscountCache:
+    def __init__(self, ttl=CACHE_TTL):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def _load(self, code):
+        row = storage.fetchone("SELECT code, percent, expires, max_uses, uses FROM discount_codes WHERE code = ?", (code,))
+        if not row:
+            return None
+        return {
+            "code": row[0],
+            "percent": row[1],
+            "expires": date.fromisoformat(row[2]) if row[2] else None,
+            "max_uses": row[3],
+            "exhausted": row[3] is not None and row[4] >= row[3],
+        }
+
+    def get(self, code):
+        """Return the usable code as a dict, or None if unknown, expired or used up."""
+        code = code.upper()
+        now = time.monotonic()
+        hit = self._entries.get(code)
+        if hit is None or hit[0] <= now:
+            entry = self._load(code)
+            with self._lock:
+                if len(self._entries) >= MAX_CACHED_CODES:
+                    self._entries.clear()
+                self._entries[code] = (now + self.ttl, entry)
+        else:
+            entry = hit[1]
+        if entry is None or entry["exhausted"] or (entry["expires"] and entry["expires"] < date.today()):
+            return None
+        return entry
+
+    def invalidate(self, code=None):
+        with self._lock:
+            if code is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(code.upper(), None)
+
+
+cache = DiscountCache()
+
+
+def get(code):
+    return cache.get(code)
+
+
+def save(code, percent, expires, max_uses=None):
+    # Upsert keeps the redemption count when an existing code is edited.
+    storage.execute("INSERT INTO discount_codes (code, percent, expires, max_uses) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(code) DO UPDATE SET percent = excluded.percent, expires = excluded.expires, "
+                    "max_uses = excluded.max_uses", (code.upper(), percent, expires, max_uses))
+    cache.invalidate(code)
+
+
+def redeem(code):
+    """Atomically reserve one use of ``code``; False once ``max_uses`` is reached or the code has expired."""
+    # The cart may have held the code since before it expired, so the date is checked here too.
+    cur = storage.execute("UPDATE discount_codes SET uses = uses + 1 "
+                          "WHERE code = ? AND (max_uses IS NULL OR uses < max_uses) "
+                          "AND (COALESCE(expires, '') = '' OR expires >= ?)", (code.upper(), date.today().isoformat()))
+    if cur.rowcount != 1:
+        cache.invalidate(code)
+        return False
+    return True
+
+
+def release(code):
+    storage.execute("UPDATE discount_codes SET uses = MAX(uses - 1, 0) WHERE code = ?", (code.upper(),))
+    cache.invalidate(code)
+
+
+def reclaim(code):
+    """Count a use again after ``release``, even past ``max_uses``: the invoice was paid after all."""
+    storage.execute("UPDATE discount_codes SET uses = uses + 1 WHERE code = ?", (code.upper(),))
+    cache.invalidate(code)
@@ -0,0 +1,116 @@
+"""Server-side giveaway winner draws.
+
+Entries are streamed from ``giveaway_entries`` in entry order through a
+cursor (``storage.iter_rows``) and sampled with a reservoir, so a draw over
+millions of entries holds only the ``k`` current winners in memory:
+
+* uniform: Algorithm R.  Each entry ends up in the sample with probability
+  ``k / n``.
+* weighted: Efraimidis–Spirakis A-Res.  Each entry gets the key
+  ``u ** (1 / weight)`` and the ``k`` largest keys win.  An entrant's weight
+  is ``1 + REFERRAL_WEIGHT`` for each paid order placed with their referral
+  code.
+
+The giveaway is closed first, so the entry set cannot change while it is
+sampled.  The random generator is seeded from a stored ``seed``, so replaying
+``sample`` with the same seed over the same entries reproduces the winners.
+A giveaway can be drawn once; the draw and winners are kept in
+``giveaway_draws`` and ``giveaway_winners``.
+"""
+import heapq
+import random
+import secrets
+import time
+
+import storage
+
+REFERRAL_WEIGHT = 1
+
+# Both orders are served by the (giveaway_id, entry_date) index, which breaks ties by rowid,
+# so the stream is deterministic and SQLite never has to sort it.
+ENTRIES_SQL = "SELECT user_id, username FROM giveaway_entries WHERE giveaway_id = ? ORDER BY entry_date, id"
+# Referral counts come from referral_stats, one primary-key lookup per entry.
+WEIGHTED_ENTRIES_SQL = '''SELECT e.user_id, e.username, 1 + ? * COALESCE(r.orders, 0)
+    FROM giveaway_entries e
+    LEFT JOIN referral_stats r ON r.referrer_id = e.user_id
+    WHERE e.giveaway_id = ? ORDER BY e.entry_date, e.id'''
+
+
+class DrawError(Exception):
+    pass
+
+
+def reservoir(rows, k, rng):
+    """Uniform sample of ``k`` items from an iterable of unknown length (Algorithm R)."""
+    sample = []
+    for n, row in enumerate(rows):
+        if n < k:
+            sample.append(row)
+        else:
+            j = rng.randrange(n + 1)
+            if j < k:
+                sample[j] = row
+    return sample
+
+
+def weighted_reservoir(rows, k, rng):
+    """Weighted sample of ``k`` ``(..., weight)`` rows without replacement (A-Res), highest key first."""
+    heap = []
+    for n, row in enumerate(rows):
+        weight = row[-1]
+        if weight <= 0:
+            continue
+        key = rng.random() ** (1 / weight)
+        # n breaks ties so rows themselves are never compared.
+        if len(heap) < k:
+            heapq.heappush(heap, (key, n, row))
+        elif key > heap[0][0]:
+            heapq.heapreplace(heap, (key, n, row))
+    return [row for _, _, row in sorted(heap, reverse=True)]
+
+
+def sample(giveaway_id, k, seed, weighted=False):
+    """Winners as ``[(user_id, username), ...]`` for ``seed``; reads entries committed so far."""
+    rng = random.Random(seed)
+    if weighted:
+        rows = storage.iter_rows(WEIGHTED_ENTRIES_SQL, (REFERRAL_WEIGHT, giveaway_id))
+        return [row[:2] for row in weighted_reservoir(rows, k, rng)]
+    return reservoir(storage.iter_rows(ENTRIES_SQL, (giveaway_id,)), k, rng)
+
+
+def close(giveaway_id):
+    """Stop new entries before sampling; raises DrawError if the giveaway is unknown or already drawn."""
+    with storage.transaction() as c:
+        if not c.execute("SELECT 1 FROM giveaways WHERE id = ?", (giveaway_id,)).fetchone():
+            raise DrawError(f"Giveaway {giveaway_id} not found.")
+        if c.execute("SELECT 1 FROM giveaway_draws WHERE giveaway_id = ?", (giveaway_id,)).fetchone():
+            raise DrawError(f"Winners for giveaway {giveaway_id} have already been drawn.")
+        c.execute("UPDATE giveaways SET is_active = 0 WHERE id = ?", (giveaway_id,))
+
+
+def record(giveaway_id, seed, weighted, winners):
+    with storage.transaction() as c:
+        # Two admins drawing at once both get past close(); only the first to get here records.
+        if c.execute("SELECT 1 FROM giveaway_draws WHERE giveaway_id = ?", (giveaway_id,)).fetchone():
+            raise DrawError(f"Winners for giveaway {giveaway_id} have already been drawn.")
+        entries = c.execute("SELECT entry_count FROM giveaways WHERE id = ?", (giveaway_id,)).fetchone()[0]
+        c.execute("INSERT INTO giveaway_draws (giveaway_id, seed, weighted, winner_count, entry_count, drawn_at) "
+                  "VALUES (?, ?, ?, ?, ?, ?)", (giveaway_id, str(seed), int(weighted), len(winners), entries, time.time()))
+        c.executemany("INSERT INTO giveaway_winners (giveaway_id, position, user_id, username) VALUES (?, ?, ?, ?)",
+                      [(giveaway_id, position, user_id, username)
+                       for position, (user_id, username) in enumerate(winners, 1)])
+
+
+def new_seed():
+    return secrets.randbits(64)
+
+
+def get_draw(giveaway_id):
+    """``(seed, weighted, entry_count, drawn_at, winners)`` or None if not drawn yet."""
+    draw = storage.fetchone("SELECT seed, weighted, entry_count, drawn_at FROM giveaway_draws WHERE giveaway_id = ?",
+                            (giveaway_id,))
+    if not draw:
+        return None
+    winners = storage.fetchall("SELECT user_id, username FROM giveaway_winners WHERE giveaway_id = ? ORDER BY position",
+                               (giveaway_id,))
+    return int(draw[0]), bool(draw[1]), draw[2], draw[3], winners
@@ -0,0 +1,70 @@
+"""Streaming CSV export of the orders table.
+
+Rows are pulled from a server-side cursor in chunks and written straight to
+disk with the csv module, so memory use stays flat however many orders are
+exported.  Meant to be run off the event loop (``asyncio.to_thread``).
+"""
+import csv
+import gzip
+from datetime import date, timedelta
+
+import storage
+
+HEADER = ["Order ID", "User ID", "Product ID", "Product", "Quantity", "Price", "Invoice ID",
+          "Discount Code", "Discount %", "Referred By", "Address", "Date"]
+CHUNK_SIZE = 2000
+
+
+def parse_filters(args):
+    """Parse ``/export_orders [FROM] [TO] [product=ID] [gzip]`` arguments.
+
+    Raises ValueError on malformed dates or product ids.
+    """
+    filters = {"since": None, "until": None, "product_id": None, "compress": False}
+    dates = []
+    for arg in args or []:
+        if arg.lower() == "gzip":
+            filters["compress"] = True
+        elif arg.lower().startswith("product="):
+            filters["product_id"] = int(arg.split("=", 1)[1])
+        else:
+            dates.append(date.fromisoformat(arg))
+    if len(dates) > 2:
+        raise ValueError("too many dates")
+    if dates:
+        filters["since"] = dates[0]
+    if len(dates) == 2:
+        filters["until"] = dates[1]
+    return filters
+
+
+def _query(since=None, until=None, product_id=None):
+    clauses, params = [], []
+    if since:
+        clauses.append("timestamp >= ?")
+        params.append(since.isoformat())
+    if until:
+        # Inclusive end date: everything before the following midnight.
+        clauses.append("timestamp < ?")
+        params.append((until + timedelta(days=1)).isoformat())
+    if product_id is not None:
+        clauses.append("product_id = ?")
+        params.append(product_id)
+    where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+    sql = ("SELECT id, user_id, product_id, product_name, quantity, price, invoice_id, discount_code, "
+           f"discount_percent, referred_by, address, timestamp FROM orders{where} ORDER BY id")
+    return sql, params
+
+
+def write_orders_csv(path, since=None, until=None, product_id=None, compress=False):
+    """Write matching orders to ``path``; returns the number of rows written."""
+    sql, params = _query(since, until, product_id)
+    opener = gzip.open if compress else open
+    count = 0
+    with opener(path, "wt", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(HEADER)
+        for row in storage.iter_rows(sql, params, CHUNK_SIZE):
+            writer.writerow(row)
+            count += 1
+    return count
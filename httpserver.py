@@ -0,0 +1,86 @@
+"""Minimal asyncio HTTP/1.1 server for the bot's small local endpoints.
+
+Runs inside the bot's own event loop, so handlers can await bot coroutines
+directly.  A handler is ``async def handler(request) -> (status, content_type, body)``
+where ``request`` is a :class:`Request`.  Only what the endpoints need is
+supported: request bodies with Content-Length and keep-alive connections.
+"""
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+
+MAX_BODY_SIZE = 1 << 20
+READ_TIMEOUT = 30
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Request:
+    method: str
+    path: str
+    query: dict = field(default_factory=dict)
+    headers: dict = field(default_factory=dict)
+    body: bytes = b""
+
+
+async def _read_request(reader):
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    method, target, _ = request_line.decode("latin-1").split(" ", 2)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", 0))
+    if length > MAX_BODY_SIZE:
+        raise ValueError("request body too large")
+    body = await reader.readexactly(length) if length else b""
+    url = urlsplit(target)
+    return Request(method.upper(), url.path, parse_qs(url.query), headers, body)
+
+
+def _write_response(writer, status, content_type, body, keep_alive):
+    if isinstance(body, str):
+        body = body.encode()
+    reason = HTTPStatus(status).phrase
+    head = (f"HTTP/1.1 {status} {reason}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    writer.write(head.encode("latin-1") + body)
+
+
+async def start_server(handler, host="127.0.0.1", port=0):
+    async def on_connection(reader, writer):
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(_read_request(reader), READ_TIMEOUT)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except ValueError:
+                    _write_response(writer, 400, "text/plain", b"bad request", False)
+                    break
+                if request is None:
+                    break
+                try:
+                    status, content_type, body = await handler(request)
+                except Exception:
+                    logger.exception("Error handling %s %s", request.method, request.path)
+                    status, content_type, body = 500, "text/plain", b"internal error"
+                keep_alive = request.headers.get("connection", "").lower() != "close"
+                _write_response(writer, status, content_type, body, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(on_connection, host, port)
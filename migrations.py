@@ -0,0 +1,323 @@
+"""Versioned schema migrations.
+
+Every table, column and index the bot uses is created here, once, at
+startup (``migrate()`` from ``bot.init_db``); no request handler ever runs DDL.
+Applied versions are recorded in ``schema_version`` and each migration runs
+in its own transaction, so an interrupted upgrade resumes where it stopped.
+
+Changes are additive (``CREATE ... IF NOT EXISTS``, ``ALTER TABLE ADD
+COLUMN``, new indexes), so an existing orders.db is upgraded in place
+without rewriting any table.  Databases created before versioning existed
+may already have some of the early objects, which is why migrations 1-9
+check before they add.
+
+To change the schema, append a new ``@migration(N, ...)`` function; never
+edit one that has shipped.
+"""
+import logging
+import time
+from datetime import date
+
+import broadcast
+import referrals
+import settlement
+import stats
+import storage
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS = []
+
+
+def migration(version, description):
+    def register(func):
+        if MIGRATIONS and version <= MIGRATIONS[-1][0]:
+            raise ValueError(f"Migration {version} registered out of order")
+        MIGRATIONS.append((version, description, func))
+        return func
+    return register
+
+
+def _columns(c, table):
+    return {row[1] for row in c.execute(f"PRAGMA table_info({table})")}
+
+
+def _add_column(c, table, name, decl):
+    if name not in _columns(c, table):
+        c.execute(f"ALTER TABLE {table} ADD COLUMN {name} {decl}")
+        return True
+    return False
+
+
+@migration(1, "Base tables")
+def _base_tables(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS orders (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp TEXT,
+        user_id INTEGER,
+        product_id INTEGER,
+        product_name TEXT,
+        quantity INTEGER,
+        price REAL,
+        invoice_id TEXT,
+        discount_code TEXT,
+        discount_percent INTEGER,
+        referred_by TEXT,
+        address TEXT
+    )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS discount_codes (
+        code TEXT PRIMARY KEY,
+        percent INTEGER,
+        expires TEXT
+    )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS giveaways (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        title TEXT,
+        description TEXT,
+        prize TEXT,
+        start_date TEXT,
+        end_date TEXT,
+        max_entries INTEGER,
+        is_active INTEGER DEFAULT 1
+    )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS giveaway_entries (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        giveaway_id INTEGER,
+        user_id INTEGER,
+        username TEXT,
+        entry_date TEXT,
+        FOREIGN KEY (giveaway_id) REFERENCES giveaways (id)
+    )''')
+
+
+@migration(2, "Pending invoices for settlement")
+def _pending_invoices(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS pending_invoices (
+        invoice_id TEXT PRIMARY KEY,
+        user_id INTEGER,
+        chat_id INTEGER,
+        product_id INTEGER,
+        quantity INTEGER,
+        price REAL,
+        discount_code TEXT,
+        discount_percent INTEGER,
+        referred_by TEXT,
+        address TEXT,
+        status TEXT DEFAULT 'pending',
+        created_at REAL,
+        attempts INTEGER DEFAULT 0,
+        next_check_at REAL
+    )''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_pending_invoices_due ON pending_invoices (status, next_check_at)")
+
+
+@migration(3, "Broadcast jobs and recipients")
+def _broadcast_jobs(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS broadcast_messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        message_text TEXT,
+        sent_by INTEGER,
+        sent_date TEXT,
+        recipients_count INTEGER
+    )''')
+    for name, decl in broadcast.JOB_COLUMNS:
+        _add_column(c, "broadcast_messages", name, decl)
+    c.execute('''CREATE TABLE IF NOT EXISTS broadcast_recipients (
+        broadcast_id INTEGER,
+        user_id INTEGER,
+        status TEXT DEFAULT 'pending',
+        error TEXT,
+        PRIMARY KEY (broadcast_id, user_id)
+    ) WITHOUT ROWID''')
+
+
+@migration(4, "Running totals for stats")
+def _stats_counters(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS stats_counters (
+        name TEXT PRIMARY KEY,
+        value REAL NOT NULL DEFAULT 0
+    )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS product_stats (
+        product_id INTEGER PRIMARY KEY,
+        product_name TEXT,
+        orders INTEGER NOT NULL DEFAULT 0,
+        quantity INTEGER NOT NULL DEFAULT 0,
+        revenue REAL NOT NULL DEFAULT 0
+    )''')
+    if _add_column(c, "giveaways", "entry_count", "INTEGER NOT NULL DEFAULT 0"):
+        stats.recount_entries(c)
+    if not c.execute("SELECT 1 FROM stats_counters WHERE name = 'initialized'").fetchone():
+        stats.backfill(c)
+
+
+@migration(5, "One entry per user per giveaway")
+def _giveaway_entry_indexes(c):
+    c.execute("CREATE INDEX IF NOT EXISTS idx_giveaway_entries_giveaway ON giveaway_entries (giveaway_id, entry_date)")
+    if not c.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_giveaway_entries_user'").fetchone():
+        # Drop duplicates left by the old non-transactional entry path first
+        removed = c.execute("DELETE FROM giveaway_entries WHERE id NOT IN "
+                            "(SELECT MIN(id) FROM giveaway_entries GROUP BY giveaway_id, user_id)").rowcount
+        c.execute("CREATE UNIQUE INDEX idx_giveaway_entries_user ON giveaway_entries (giveaway_id, user_id)")
+        if removed:
+            stats.recount_entries(c)
+
+
+@migration(6, "Products table for the database catalog")
+def _products(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS products (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        description TEXT,
+        prices TEXT NOT NULL,
+        image TEXT,
+        position INTEGER DEFAULT 0,
+        is_active INTEGER DEFAULT 1,
+        updated_at REAL
+    )''')
+
+
+@migration(7, "Persisted user_data")
+def _user_data(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS user_data (
+        user_id INTEGER PRIMARY KEY,
+        data BLOB NOT NULL,
+        updated_at REAL
+    )''')
+
+
+@migration(8, "Discount code usage limits")
+def _discount_usage(c):
+    _add_column(c, "discount_codes", "max_uses", "INTEGER")
+    _add_column(c, "discount_codes", "uses", "INTEGER NOT NULL DEFAULT 0")
+
+
+@migration(9, "Order browser indexes")
+def _order_browser_indexes(c):
+    c.execute("CREATE INDEX IF NOT EXISTS idx_orders_user ON orders (user_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_orders_product ON orders (product_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_orders_discount_code ON orders (discount_code)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_orders_timestamp ON orders (timestamp)")
+
+
+@migration(10, "Invoice and active giveaway lookups")
+def _lookup_indexes(c):
+    c.execute("CREATE INDEX IF NOT EXISTS idx_orders_invoice ON orders (invoice_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_giveaways_active ON giveaways (is_active, end_date)")
+
+
+@migration(11, "One order per invoice")
+def _unique_invoice(c):
+    duplicates = ("invoice_id IS NOT NULL AND id NOT IN "
+                  "(SELECT MIN(id) FROM orders WHERE invoice_id IS NOT NULL GROUP BY invoice_id)")
+    if c.execute(f"SELECT 1 FROM orders WHERE {duplicates} LIMIT 1").fetchone():
+        # Double-booked payments from before settlement was atomic: keep the first
+        # order per invoice and set the rest aside rather than deleting them.
+        c.execute("CREATE TABLE IF NOT EXISTS duplicate_orders AS SELECT * FROM orders WHERE 0")
+        moved = c.execute(f"INSERT INTO duplicate_orders SELECT * FROM orders WHERE {duplicates}").rowcount
+        c.execute(f"DELETE FROM orders WHERE {duplicates}")
+        stats.backfill(c)
+        logger.warning("Moved %d double-booked orders to the duplicate_orders table", moved)
+    c.execute("DROP INDEX IF EXISTS idx_orders_invoice")
+    c.execute("CREATE UNIQUE INDEX idx_orders_invoice ON orders (invoice_id)")
+
+
+@migration(12, "Daily order counters for the per-user cap")
+def _daily_orders(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS daily_orders (
+        user_id INTEGER,
+        day TEXT,
+        orders INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, day)
+    ) WITHOUT ROWID''')
+    # Only today's count matters for the cap; earlier days fill in as orders arrive.
+    today = date.today().isoformat()
+    c.execute("INSERT OR REPLACE INTO daily_orders (user_id, day, orders) "
+              "SELECT user_id, ?, COUNT(*) FROM orders WHERE timestamp >= ? GROUP BY user_id", (today, today))
+
+
+@migration(13, "Giveaway draws and winners")
+def _giveaway_winners(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS giveaway_draws (
+        giveaway_id INTEGER PRIMARY KEY,
+        seed TEXT NOT NULL,
+        weighted INTEGER NOT NULL DEFAULT 0,
+        winner_count INTEGER,
+        entry_count INTEGER,
+        drawn_at REAL
+    )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS giveaway_winners (
+        giveaway_id INTEGER,
+        position INTEGER,
+        user_id INTEGER,
+        username TEXT,
+        PRIMARY KEY (giveaway_id, position)
+    ) WITHOUT ROWID''')
+
+
+@migration(14, "Referral attribution and per-referrer totals")
+def _referrals(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS referrals (
+        order_id INTEGER PRIMARY KEY,
+        referrer_id INTEGER NOT NULL,
+        user_id INTEGER,
+        revenue REAL
+    )''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_referrals_referrer ON referrals (referrer_id, user_id)")
+    c.execute('''CREATE TABLE IF NOT EXISTS referral_stats (
+        referrer_id INTEGER PRIMARY KEY,
+        orders INTEGER NOT NULL DEFAULT 0,
+        customers INTEGER NOT NULL DEFAULT 0,
+        revenue REAL NOT NULL DEFAULT 0
+    )''')
+    for column in referrals.RANKINGS.values():
+        c.execute(f"CREATE INDEX IF NOT EXISTS idx_referral_stats_{column} ON referral_stats ({column} DESC)")
+    referrals.backfill(c)
+
+
+@migration(15, "Several order lines per invoice")
+def _order_lines(c):
+    # A basket checkout is one invoice with a numbered orders row per product.
+    _add_column(c, "orders", "line", "INTEGER NOT NULL DEFAULT 0")
+    _add_column(c, "pending_invoices", "lines", "TEXT")
+    c.execute("DROP INDEX IF EXISTS idx_orders_invoice")
+    c.execute("CREATE UNIQUE INDEX idx_orders_invoice ON orders (invoice_id, line)")
+
+
+@migration(16, "Poll recently expired invoices for late payments")
+def _late_payment_grace(c):
+    # The sweep now rechecks expired invoices inside the grace window; older ones drop out of the due index.
+    c.execute("UPDATE pending_invoices SET next_check_at = NULL WHERE status = 'expired' AND created_at < ?",
+              (time.time() - settlement.INVOICE_MAX_AGE - settlement.LATE_PAYMENT_GRACE,))
+
+
+def current_version():
+    with storage.transaction() as c:
+        _ensure_version_table(c)
+        return c.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+
+
+def _ensure_version_table(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        description TEXT,
+        applied_at REAL
+    )''')
+
+
+def migrate():
+    """Apply every migration newer than the database; returns the versions applied."""
+    applied = []
+    current = current_version()
+    for version, description, func in MIGRATIONS:
+        if version <= current:
+            continue
+        with storage.transaction() as c:
+            # Re-check inside the write lock in case another process got here first.
+            if c.execute("SELECT 1 FROM schema_version WHERE version = ?", (version,)).fetchone():
+                continue
+            func(c)
+            c.execute("INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)",
+                      (version, description, time.time()))
+        logger.info("Applied migration %d: %s", version, description)
+        applied.append(version)
+    return applied
@@ -0,0 +1,106 @@
+"""Keyset-paginated, filterable view of the orders table for admins.
+
+Pages are addressed by order id, never by OFFSET: "older" asks for
+``id < first-id-of-next-page`` and "newer" for ``id > last-id-shown``, both
+``LIMIT page_size + 1`` so we also learn whether another page exists.  Each
+equality filter has an index on ``(column)``, which SQLite stores as
+``(column, rowid)``, so a filtered page is one index seek plus ``page_size``
+steps however deep into the table it is.
+
+Date filters are turned into an id range first.  Orders are inserted with
+``datetime.now()`` so ids and timestamps grow together, and the first id on
+or after a date is a single seek on the timestamp index.
+"""
+from datetime import date, timedelta
+
+import storage
+
+PAGE_SIZE = 10
+
+COLUMNS = ("id", "timestamp", "user_id", "product_id", "product_name", "quantity", "price", "invoice_id",
+           "discount_code", "discount_percent", "referred_by", "address")
+
+# filter name -> (orders column, converter)
+EQUALITY_FILTERS = {
+    "user": ("user_id", int),
+    "product": ("product_id", int),
+    "code": ("discount_code", str.upper),
+}
+
+
+def parse_filters(args):
+    """Parse ``user=ID product=ID code=CODE from=YYYY-MM-DD to=YYYY-MM-DD``.
+
+    Raises ValueError on unknown keys or malformed values.
+    """
+    filters = {}
+    for arg in args or []:
+        key, sep, value = arg.partition("=")
+        key = key.lower()
+        if not sep or not value:
+            raise ValueError(f"expected key=value, got {arg!r}")
+        if key in EQUALITY_FILTERS:
+            filters[key] = EQUALITY_FILTERS[key][1](value)
+        elif key in ("from", "to"):
+            filters[key] = date.fromisoformat(value).isoformat()
+        else:
+            raise ValueError(f"unknown filter {key!r}")
+    return filters
+
+
+def describe(filters):
+    return " ".join(f"{key}={value}" for key, value in filters.items())
+
+
+def _first_id_from(day):
+    row = storage.fetchone("SELECT id FROM orders WHERE timestamp >= ? ORDER BY timestamp LIMIT 1", (day,))
+    return row[0] if row else None
+
+
+def _where(filters):
+    clauses, params = [], []
+    for key, (column, _) in EQUALITY_FILTERS.items():
+        if key in filters:
+            clauses.append(f"{column} = ?")
+            params.append(filters[key])
+    if "from" in filters:
+        first = _first_id_from(filters["from"])
+        if first is None:
+            return None, None
+        clauses.append("id >= ?")
+        params.append(first)
+    if "to" in filters:
+        # Inclusive end date: everything before the first order of the following day.
+        end = _first_id_from((date.fromisoformat(filters["to"]) + timedelta(days=1)).isoformat())
+        if end is not None:
+            clauses.append("id < ?")
+            params.append(end)
+    return clauses, params
+
+
+def fetch_page(filters, older_than=None, newer_than=None, page_size=PAGE_SIZE):
+    """Return ``(rows, has_older, has_newer)``, rows newest first.
+
+    With neither cursor the newest page is returned.
+    """
+    clauses, params = _where(filters)
+    if clauses is None:
+        return [], False, False
+    if newer_than is not None:
+        clauses.append("id > ?")
+        params.append(newer_than)
+        order = "ASC"
+    else:
+        if older_than is not None:
+            clauses.append("id < ?")
+            params.append(older_than)
+        order = "DESC"
+    where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+    rows = storage.fetchall(f"SELECT {', '.join(COLUMNS)} FROM orders{where} ORDER BY id {order} LIMIT ?",
+                            params + [page_size + 1])
+    more = len(rows) > page_size
+    rows = rows[:page_size]
+    if newer_than is not None:
+        rows.reverse()
+        return rows, True, more
+    return rows, more, older_than is not None
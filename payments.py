@@ -0,0 +1,104 @@
+"""Async client for the crypto payment provider API.
+
+A single pooled ``httpx.AsyncClient`` is shared by every handler so
+invoice creation and status checks reuse keep-alive connections, never
+block the event loop, carry a timeout, and are capped at a fixed number of
+in-flight provider calls.  Call latency and failures are recorded in
+:mod:`metrics`.
+"""
+import asyncio
+import logging
+
+import httpx
+
+import metrics
+
+DEFAULT_API_URL = "https://api.crypto-provider.com"
+DEFAULT_TIMEOUT = 10.0
+DEFAULT_CONNECT_TIMEOUT = 5.0
+DEFAULT_MAX_CONCURRENCY = 50
+DEFAULT_MAX_CONNECTIONS = 20
+
+logger = logging.getLogger(__name__)
+
+
+class PaymentClient:
+    def __init__(self, api_key, base_url=DEFAULT_API_URL, timeout=DEFAULT_TIMEOUT,
+                 max_concurrency=DEFAULT_MAX_CONCURRENCY, max_connections=DEFAULT_MAX_CONNECTIONS):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.timeout = httpx.Timeout(timeout, connect=min(timeout, DEFAULT_CONNECT_TIMEOUT))
+        self.limits = httpx.Limits(max_connections=max_connections,
+                                   max_keepalive_connections=max_connections)
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._client = None
+
+    def _session(self):
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers={"Authorization": self.api_key},
+                timeout=self.timeout,
+                limits=self.limits,
+            )
+        return self._client
+
+    async def _request(self, method, path, timeout=None, **kwargs):
+        async with self._semaphore:
+            try:
+                response = await self._session().request(
+                    method, path, timeout=timeout if timeout is not None else self.timeout, **kwargs)
+            except httpx.HTTPError as e:
+                logger.warning("Payment provider %s %s failed: %r", method, path, e)
+                metrics.REGISTRY.inc("payment_request_failures_total", reason=type(e).__name__)
+                return None
+        if response.status_code != 200:
+            logger.warning("Payment provider %s %s returned %s", method, path, response.status_code)
+            metrics.REGISTRY.inc("payment_request_failures_total", reason=f"http_{response.status_code}")
+            return None
+        try:
+            return response.json().get("result", {})
+        except ValueError:
+            logger.warning("Payment provider %s %s returned invalid JSON", method, path)
+            metrics.REGISTRY.inc("payment_request_failures_total", reason="invalid_json")
+            return None
+
+    @metrics.timed("payment_request", op="create_invoice")
+    async def create_invoice(self, amount, currency, order_id, description, callback_url="", timeout=None):
+        data = {
+            "out": str(amount),
+            "out_currency": currency,
+            "callback_url": callback_url,
+            "order_id": order_id,
+            "description": description,
+        }
+        return await self._request("POST", "/merchant/invoice", json=data, timeout=timeout)
+
+    @metrics.timed("payment_request", op="check_invoice")
+    async def check_invoice(self, invoice_id, timeout=None):
+        return await self._request("GET", f"/merchant/invoice/{invoice_id}", timeout=timeout)
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+_client = None
+
+
+def configure(api_key, **kwargs):
+    global _client
+    _client = PaymentClient(api_key, **kwargs)
+    return _client
+
+
+def get_client():
+    if _client is None:
+        raise RuntimeError("payments.configure() has not been called")
+    return _client
+
+
+async def close():
+    if _client is not None:
+        await _client.aclose()
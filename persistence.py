@@ -0,0 +1,147 @@
+"""SQLite-backed persistence for ``context.user_data``.
+
+Carts, pending invoices and awaiting_* flags survive restarts without a
+database write per tap:
+
+* Nothing is loaded at startup.  A user's data is read from the
+  ``user_data`` table the first time an update from that user arrives
+  (``refresh_user_data`` runs before every handler).
+* The Application hands changed users to ``update_user_data`` every
+  ``update_interval`` seconds.  Those snapshots are buffered and written
+  together in one transaction shortly afterwards, so many mutations by many
+  users become one batched write.  A batch that fails to write goes back
+  into the buffer (behind any newer snapshot) and is retried.  ``flush``
+  (run on shutdown) writes anything still buffered.
+"""
+import asyncio
+import logging
+import pickle
+import time
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+import storage
+
+UPDATE_INTERVAL = 10
+FLUSH_DELAY = 0.5
+RETRY_DELAY = 5
+MAX_PENDING = 500
+
+logger = logging.getLogger(__name__)
+
+
+class SQLitePersistence(BasePersistence):
+    def __init__(self, update_interval=UPDATE_INTERVAL):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self._loaded = set()
+        self._loading = {}
+        self._pending = {}
+        self._flush_task = None
+
+    # --- user data -------------------------------------------------------
+
+    async def get_user_data(self):
+        # Loaded lazily per user in refresh_user_data.
+        return {}
+
+    async def refresh_user_data(self, user_id, user_data):
+        if user_id in self._loaded:
+            return
+        # Concurrent first updates from one user wait for the same load instead of running on empty data.
+        load = self._loading.get(user_id)
+        if load is None:
+            load = self._loading[user_id] = asyncio.ensure_future(self._load(user_id, user_data))
+            load.add_done_callback(lambda _: self._loading.pop(user_id, None))
+        await asyncio.shield(load)
+
+    async def _load(self, user_id, user_data):
+        row = await storage.run_read(storage.fetchone, "SELECT data FROM user_data WHERE user_id = ?", (user_id,))
+        if row:
+            for key, value in pickle.loads(row[0]).items():
+                user_data.setdefault(key, value)
+        self._loaded.add(user_id)
+
+    async def update_user_data(self, user_id, data):
+        self._loaded.add(user_id)
+        self._pending[user_id] = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(self._pending) >= MAX_PENDING:
+            await self._write_pending()
+        elif self._flush_task is None:
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_soon())
+
+    async def drop_user_data(self, user_id):
+        self._pending.pop(user_id, None)
+        self._loaded.discard(user_id)
+        await storage.run_write(storage.execute, "DELETE FROM user_data WHERE user_id = ?", (user_id,))
+
+    async def _flush_soon(self):
+        try:
+            await asyncio.sleep(FLUSH_DELAY)
+            while True:
+                try:
+                    await self._write_pending()
+                    return
+                except Exception:
+                    logger.exception("Persisting user_data failed; retrying in %ss", RETRY_DELAY)
+                    await asyncio.sleep(RETRY_DELAY)
+        finally:
+            self._flush_task = None
+
+    async def _write_pending(self):
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        now = time.time()
+        try:
+            await storage.run_write(storage.executemany, "REPLACE INTO user_data (user_id, data, updated_at) VALUES (?, ?, ?)",
+                                    [(user_id, blob, now) for user_id, blob in batch.items()])
+        except Exception:
+            # Keep the batch for the next attempt, unless a user has a newer snapshot buffered already.
+            for user_id, blob in batch.items():
+                self._pending.setdefault(user_id, blob)
+            raise
+        logger.debug("Persisted user_data for %d users", len(batch))
+
+    async def flush(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self._write_pending()
+
+    # --- unused stores ---------------------------------------------------
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        return {}
+
+    async def update_conversation(self, name, key, new_state):
+        pass
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
@@ -0,0 +1,103 @@
+"""Per-user flood control and the daily order cap.
+
+Every update passes through :meth:`RateLimiter.allow` before any handler
+runs (a TypeHandler in group -1).  Each user has a token bucket per action
+class.  The defaults are in :data:`LIMITS` as ``(burst, seconds)``: up to
+``burst`` actions at once, refilling at ``burst`` per ``seconds``.  Checking
+a bucket is a dict lookup and some arithmetic, so a flood is turned away
+before it reaches the database or the payment provider.
+
+The daily order cap is a counter row per ``(user_id, day)`` bumped in the
+same transaction as the order, so checking it at checkout is one
+primary-key lookup.
+"""
+import time
+from datetime import date
+
+import storage
+
+LIMITS = {
+    "browse": (20, 10),
+    "checkout": (3, 60),
+    "payment_check": (10, 60),
+    "admin": (30, 60),
+}
+MAX_TRACKED_USERS = 100000
+
+# Leading "_"-separated token of callback data -> action class (anything else is "browse").
+CALLBACK_ACTIONS = {
+    "checkout": "checkout",
+    "check": "payment_check",
+    "admin": "admin",
+    "orders": "admin",
+    "view": "admin",
+    "entries": "admin",
+    "copy": "admin",
+}
+
+
+class RateLimiter:
+    def __init__(self, limits=None, admin_commands=()):
+        self.limits = {**LIMITS, **(limits or {})}
+        self.admin_commands = set(admin_commands)
+        # (user_id, action) -> [tokens, last refill, warned]
+        self._buckets = {}
+
+    def classify(self, update):
+        if update.callback_query and update.callback_query.data:
+            return CALLBACK_ACTIONS.get(update.callback_query.data.split("_", 1)[0], "browse")
+        message = update.effective_message
+        if message and message.text and message.text.startswith("/"):
+            command = message.text[1:].split("@", 1)[0].split(None, 1)
+            if command and command[0].lower() in self.admin_commands:
+                return "admin"
+        return "browse"
+
+    def allow(self, user_id, action, now=None):
+        """Take one token; returns 0 if allowed, otherwise seconds until the next token."""
+        now = time.monotonic() if now is None else now
+        burst, seconds = self.limits[action]
+        rate = burst / seconds
+        key = (user_id, action)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= MAX_TRACKED_USERS:
+                self._prune(now)
+            bucket = self._buckets[key] = [float(burst), now, False]
+        else:
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            bucket[2] = False
+            return 0
+        return (1 - bucket[0]) / rate
+
+    def first_rejection(self, user_id, action):
+        """True the first time in a row a user is turned away, so they are told only once."""
+        bucket = self._buckets.get((user_id, action))
+        if bucket is None or bucket[2]:
+            return False
+        bucket[2] = True
+        return True
+
+    def _prune(self, now):
+        # Drop buckets that would be full again anyway; they hold no state worth keeping.
+        full = [key for key, (tokens, last, _) in self._buckets.items()
+                if tokens + (now - last) * self.limits[key[1]][0] / self.limits[key[1]][1] >= self.limits[key[1]][0]]
+        for key in full:
+            del self._buckets[key]
+        if len(self._buckets) >= MAX_TRACKED_USERS:
+            self._buckets.clear()
+
+
+def record_order(c, user_id, day=None):
+    c.execute("INSERT INTO daily_orders (user_id, day, orders) VALUES (?, ?, 1) "
+              "ON CONFLICT(user_id, day) DO UPDATE SET orders = orders + 1",
+              (user_id, day or date.today().isoformat()))
+
+
+def orders_today(user_id):
+    row = storage.fetchone("SELECT orders FROM daily_orders WHERE user_id = ? AND day = ?",
+                           (user_id, date.today().isoformat()))
+    return row[0] if row else 0
@@ -0,0 +1,58 @@
+"""Referral attribution and the referrer leaderboard.
+
+Every paid order placed with a referral code gets a ``referrals`` row,
+written by save_order in the order's own transaction, and its referrer's
+``referral_stats`` row is bumped at the same time: orders, distinct
+customers and revenue.  The leaderboard is the top of an index on
+``referral_stats``, and one referrer's totals are a primary-key lookup, so
+neither ever scans ``orders``.
+"""
+import storage
+
+# Leaderboard sort key -> referral_stats column (each has a descending index).
+RANKINGS = {"revenue": "revenue", "orders": "orders", "customers": "customers"}
+
+
+def referrer_id(referred_by):
+    """The referrer's user id from an ``orders.referred_by`` value (an id, or a REF code); None otherwise."""
+    if referred_by is None:
+        return None
+    value = str(referred_by).strip().upper()
+    if value.startswith("REF"):
+        value = value[3:]
+    return int(value) if value.isdigit() else None
+
+
+def record(c, order_id, referred_by, user_id, revenue):
+    referrer = referrer_id(referred_by)
+    if referrer is None:
+        return
+    new_customer = not c.execute("SELECT 1 FROM referrals WHERE referrer_id = ? AND user_id = ? LIMIT 1",
+                                 (referrer, user_id)).fetchone()
+    c.execute("INSERT INTO referrals (order_id, referrer_id, user_id, revenue) VALUES (?, ?, ?, ?)",
+              (order_id, referrer, user_id, revenue or 0))
+    c.execute('''INSERT INTO referral_stats (referrer_id, orders, customers, revenue) VALUES (?, 1, ?, ?)
+        ON CONFLICT(referrer_id) DO UPDATE SET orders = orders + 1, customers = customers + excluded.customers,
+        revenue = revenue + excluded.revenue''', (referrer, int(new_customer), revenue or 0))
+
+
+def backfill(c):
+    # One-off pass over historical orders; referred_by may hold an id or a REF code.
+    c.execute("DELETE FROM referrals")
+    c.execute("DELETE FROM referral_stats")
+    rows = c.execute("SELECT id, referred_by, user_id, price FROM orders WHERE referred_by IS NOT NULL ORDER BY id")
+    for order_id, referred_by, user_id, price in rows.fetchall():
+        record(c, order_id, referred_by, user_id, price)
+
+
+def get_stats(referrer):
+    """``(orders, customers, revenue)`` for one referrer."""
+    row = storage.fetchone("SELECT orders, customers, revenue FROM referral_stats WHERE referrer_id = ?", (referrer,))
+    return row or (0, 0, 0.0)
+
+
+def leaderboard(by="revenue", limit=10):
+    """Top referrers as ``(referrer_id, orders, customers, revenue)``."""
+    column = RANKINGS[by]
+    return storage.fetchall(f"SELECT referrer_id, orders, customers, revenue FROM referral_stats "
+                            f"ORDER BY {column} DESC LIMIT ?", (limit,))
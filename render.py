@@ -0,0 +1,87 @@
+"""Rendering long admin lists within Telegram's message limits.
+
+Messages are built by joining lists of lines, never by repeated ``+=``, and
+split at line boundaries into chunks of at most ``MESSAGE_LIMIT``
+characters.  Telegram counts UTF-16 code units, so :func:`text_size` does
+too.  Lists too long for a message or two are sent as a text document
+instead: :func:`reply_lines` streams the lines into a temporary file on a
+worker thread, so they can come straight from a database cursor.
+"""
+import asyncio
+import os
+import tempfile
+
+from telegram import InlineKeyboardButton
+
+MESSAGE_LIMIT = 4096
+ELLIPSIS = "…"
+
+
+def text_size(text):
+    return len(text.encode("utf-16-le")) // 2
+
+
+def chunks(lines, limit=MESSAGE_LIMIT):
+    """Yield texts of whole lines joined by newlines, each at most ``limit`` characters.
+
+    A single line longer than ``limit`` is cut short with an ellipsis.
+    """
+    page, size = [], 0
+    for line in lines:
+        line_size = text_size(line)
+        if line_size > limit:
+            line = line[:limit - 1] + ELLIPSIS
+            while text_size(line) > limit:
+                line = line[:-2] + ELLIPSIS
+            line_size = text_size(line)
+        if page and size + 1 + line_size > limit:
+            yield "\n".join(page)
+            page, size = [], 0
+        size += line_size + (1 if page else 0)
+        page.append(line)
+    if page:
+        yield "\n".join(page)
+
+
+def nav_row(prev_data=None, next_data=None):
+    """Prev/Next buttons for whichever directions have another page."""
+    row = []
+    if prev_data:
+        row.append(InlineKeyboardButton("◀ Prev", callback_data=prev_data))
+    if next_data:
+        row.append(InlineKeyboardButton("Next ▶", callback_data=next_data))
+    return row
+
+
+def write_lines(path, lines):
+    """Write ``lines`` to ``path``, one per line; returns how many were written."""
+    count = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for line in lines:
+            f.write(line)
+            f.write("\n")
+            count += 1
+    return count
+
+
+async def reply_lines(message, lines, filename, caption, empty_text="Nothing to show."):
+    """Reply with ``caption`` and ``lines`` as one message if they fit, otherwise as a ``filename`` document.
+
+    ``lines`` is consumed on a worker thread.  Returns the number of lines.
+    """
+    fd, path = tempfile.mkstemp(suffix=os.path.splitext(filename)[1])
+    os.close(fd)
+    try:
+        count = await asyncio.to_thread(write_lines, path, lines)
+        if not count:
+            await message.reply_text(empty_text)
+        # UTF-8 bytes are never fewer than UTF-16 code units, so the file size is a safe bound.
+        elif os.path.getsize(path) + text_size(caption) + 2 <= MESSAGE_LIMIT:
+            with open(path, encoding="utf-8") as f:
+                await message.reply_text(f"{caption}\n\n{f.read().rstrip()}")
+        else:
+            with open(path, "rb") as f:
+                await message.reply_document(document=f, filename=filename, caption=caption)
+    finally:
+        os.remove(path)
+    return count
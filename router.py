@@ -0,0 +1,106 @@
+"""Table-driven dispatch for inline-keyboard callbacks.
+
+Routes are registered as patterns such as ``"admin_stats"`` (exact) or
+``"check_{invoice_id}_{product_id:int}"`` (literal prefix plus ``_``-separated
+fields).  Exact routes are a dict lookup; prefixed routes are found by
+looking up the payload's leading ``_``-separated tokens, longest first, so
+resolving a payload costs a few dict probes however many routes exist.
+Parsed fields are handed to the handler as ``context.args`` (in pattern
+order, converted), the same place CommandHandler puts command arguments.
+
+Every route records its latency in the ``bot_callback_seconds`` histogram
+and its failures in ``bot_callback_errors_total`` (see :mod:`metrics`).
+"""
+import logging
+import re
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+CONVERTERS = {"str": str, "int": int}
+
+
+class Route:
+    def __init__(self, name, prefix, fields, handler):
+        self.name = name
+        self.prefix = prefix
+        self.fields = fields
+        self.handler = handler
+        self.histogram = metrics.REGISTRY.histogram("bot_callback_seconds", route=name)
+
+    def parse(self, payload):
+        if not self.fields:
+            return [] if not payload else None
+        parts = payload.split("_", len(self.fields) - 1)
+        if len(parts) != len(self.fields):
+            return None
+        try:
+            return [convert(part) for (_, convert), part in zip(self.fields, parts)]
+        except ValueError:
+            return None
+
+
+FIELD = re.compile(r"\{(\w+)(?::(\w+))?\}")
+
+
+def _parse_pattern(pattern):
+    if "{" not in pattern:
+        return pattern, []
+    prefix, brace, rest = pattern.partition("{")
+    fields = list(FIELD.finditer(brace + rest))
+    if not prefix.endswith("_") or "_".join(m.group(0) for m in fields) != brace + rest:
+        raise ValueError(f"Invalid callback pattern {pattern!r}")
+    return prefix, [(m.group(1), CONVERTERS[m.group(2) or "str"]) for m in fields]
+
+
+class CallbackRouter:
+    def __init__(self):
+        self._exact = {}
+        self._prefixed = {}
+        self._max_prefix_tokens = 0
+
+    def add(self, pattern, handler, name=None):
+        prefix, fields = _parse_pattern(pattern)
+        route = Route(name or pattern, prefix, fields, handler)
+        if fields:
+            if prefix in self._prefixed:
+                raise ValueError(f"Duplicate callback prefix {prefix!r}")
+            self._prefixed[prefix] = route
+            self._max_prefix_tokens = max(self._max_prefix_tokens, prefix.count("_"))
+        else:
+            self._exact[prefix] = route
+        return route
+
+    def resolve(self, data):
+        """Return ``(route, args)`` for a callback payload, or ``(None, None)``."""
+        route = self._exact.get(data)
+        if route is not None:
+            return route, []
+        tokens = data.split("_", self._max_prefix_tokens)
+        for n in range(min(self._max_prefix_tokens, len(tokens) - 1), 0, -1):
+            prefix = "_".join(tokens[:n]) + "_"
+            route = self._prefixed.get(prefix)
+            if route is not None:
+                args = route.parse(data[len(prefix):])
+                if args is not None:
+                    return route, args
+        return None, None
+
+    async def dispatch(self, update, context):
+        query = update.callback_query
+        route, args = self.resolve(query.data or "")
+        if route is None:
+            logger.warning("No route for callback data %r", query.data)
+            await query.answer()
+            return
+        context.args = args
+        started = time.perf_counter()
+        try:
+            await route.handler(update, context)
+        except Exception:
+            metrics.REGISTRY.inc("bot_callback_errors_total", route=route.name)
+            raise
+        finally:
+            route.histogram.observe(time.perf_counter() - started)
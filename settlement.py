@@ -0,0 +1,353 @@
+"""Background settlement of payment invoices.
+
+Every invoice created at checkout is recorded in ``pending_invoices`` along
+with the basket lines it pays for.  It is then settled by whichever arrives first:
+
+* the provider's callback, POSTed to the local webhook endpoint that
+  ``callback_url`` points at,
+* the periodic sweep, which checks every due invoice in one batch and backs
+  off exponentially on invoices that are still unpaid,
+* the buyer tapping "I've paid".
+
+Settling flips the row from ``pending`` to ``paid`` and records the order in
+the same transaction, so the three paths can race without double-booking
+(``orders`` is also UNIQUE on ``(invoice_id, line)`` as a backstop).
+
+A payment confirmed after its invoice expired is still settled, with a
+warning, since the buyer has paid.  So that polling alone notices it, the
+sweep asks the provider once more before expiring an invoice, and keeps
+checking expired (and superseded) invoices, with the same backoff, until
+``LATE_PAYMENT_GRACE`` after they would have expired.
+
+Manual checks are cheap to repeat: settled invoices are answered from
+memory, a "pending" answer from the provider is reused for
+``PENDING_CACHE_SECONDS``, and concurrent checks of one invoice (double taps)
+share a single provider call.
+"""
+import asyncio
+import collections
+import contextlib
+import hashlib
+import hmac
+import json
+import logging
+import time
+
+import httpserver
+import metrics
+import storage
+
+POLL_INTERVAL = 30
+BACKOFF_MAX = 15 * 60
+BATCH_SIZE = 100
+INVOICE_MAX_AGE = 24 * 60 * 60
+WEBHOOK_PATH = "/payment/callback"
+PENDING_CACHE_SECONDS = 15
+TERMINAL_CACHE_SIZE = 10000
+LATE_PAYMENT_GRACE = 24 * 60 * 60
+
+logger = logging.getLogger(__name__)
+
+INVOICE_COLUMNS = ("invoice_id", "user_id", "chat_id", "product_id", "quantity", "price",
+                   "discount_code", "discount_percent", "referred_by", "address",
+                   "status", "created_at", "attempts", "next_check_at", "lines")
+
+
+def _as_invoice(row):
+    if not row:
+        return None
+    invoice = dict(zip(INVOICE_COLUMNS, row))
+    # Invoices from before baskets have no lines; their single product is in product_id/quantity/price.
+    invoice["lines"] = json.loads(invoice["lines"]) if invoice["lines"] else None
+    return invoice
+
+
+def _reported(invoice):
+    # What a manual check reports for an invoice that is no longer pending.
+    return "settled" if invoice["status"] == "paid" else invoice["status"]
+
+
+def add_pending_invoice(invoice_id, user_id, chat_id, product_id, quantity, price,
+                        discount_code=None, discount_percent=0, referred_by=None, address=None, lines=None):
+    now = time.time()
+    storage.execute(
+        f"INSERT OR IGNORE INTO pending_invoices ({', '.join(INVOICE_COLUMNS)}) VALUES ({', '.join('?' * len(INVOICE_COLUMNS))})",
+        (str(invoice_id), user_id, chat_id, product_id, quantity, price, discount_code, discount_percent,
+         referred_by, address, "pending", now, 0, now + POLL_INTERVAL, json.dumps(lines) if lines else None))
+
+
+def get_pending_invoice(invoice_id):
+    return _as_invoice(storage.fetchone(
+        f"SELECT {', '.join(INVOICE_COLUMNS)} FROM pending_invoices WHERE invoice_id = ?", (str(invoice_id),)))
+
+
+def get_due_invoices(now, limit=BATCH_SIZE):
+    # Expired invoices stay due until the sweep clears their next_check_at at the end of the grace window.
+    rows = storage.fetchall(
+        f"SELECT {', '.join(INVOICE_COLUMNS)} FROM pending_invoices WHERE status IN ('pending', 'expired') "
+        "AND next_check_at <= ? ORDER BY next_check_at LIMIT ?", (now, limit))
+    return [_as_invoice(row) for row in rows]
+
+
+def get_stale_invoices(created_before, limit=BATCH_SIZE):
+    rows = storage.fetchall(
+        f"SELECT {', '.join(INVOICE_COLUMNS)} FROM pending_invoices WHERE status = 'pending' AND created_at < ? "
+        "LIMIT ?", (created_before, limit))
+    return [_as_invoice(row) for row in rows]
+
+
+def backoff_delay(attempts):
+    return min(BACKOFF_MAX, POLL_INTERVAL * 2 ** attempts)
+
+
+def verify_signature(secret, body, signature):
+    if not secret or not signature:
+        return False
+    expected = hmac.new(secret.encode(), body, hashlib.sha512).hexdigest()
+    return hmac.compare_digest(expected, signature)
+
+
+class SettlementEngine:
+    """Settles pending invoices from webhooks, periodic sweeps and manual checks.
+
+    ``check_invoice`` is an ``async (invoice_id) -> dict | None`` provider
+    status call, ``fulfil`` records the order for a claimed invoice inside the
+    settlement transaction and ``async notify(bot, invoice)`` tells the buyer
+    about a payment they did not confirm themselves.  The optional ``release``
+    is called, inside the expiry transaction, for each invoice that expires
+    unpaid so anything it reserved can be given back; ``reclaim`` undoes that,
+    inside the settlement transaction, when an expired invoice is paid after all.
+    """
+
+    def __init__(self, check_invoice, fulfil, notify, webhook_secret="", release=None, reclaim=None,
+                 poll_interval=POLL_INTERVAL, batch_size=BATCH_SIZE, max_age=INVOICE_MAX_AGE):
+        self.check_invoice = check_invoice
+        self.fulfil = fulfil
+        self.notify = notify
+        self.release = release
+        self.reclaim = reclaim
+        self.webhook_secret = webhook_secret
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.max_age = max_age
+        self.bot = None
+        self._poller = None
+        self._server = None
+        self._terminal = collections.OrderedDict()
+        self._pending_until = {}
+        self._inflight = {}
+
+    def _remember(self, invoice):
+        invoice_id = invoice["invoice_id"]
+        self._pending_until.pop(invoice_id, None)
+        if invoice["status"] != "paid":
+            # An expired invoice can still be paid late, so only settled ones are final.
+            return
+        self._terminal[invoice_id] = invoice
+        self._terminal.move_to_end(invoice_id)
+        if len(self._terminal) > TERMINAL_CACHE_SIZE:
+            self._terminal.popitem(last=False)
+
+    async def _settle(self, invoice_id):
+        """Claim an unpaid invoice and record its order; ``None`` if already settled."""
+        invoice = await storage.run_write(self._claim, invoice_id)
+        if invoice:
+            self._remember(invoice)
+        return invoice
+
+    def _claim(self, invoice_id):
+        with storage.transaction() as c:
+            invoice = _as_invoice(c.execute(
+                f"SELECT {', '.join(INVOICE_COLUMNS)} FROM pending_invoices WHERE invoice_id = ?",
+                (str(invoice_id),)).fetchone())
+            if invoice is None or invoice["status"] not in ("pending", "expired"):
+                return None
+            c.execute("UPDATE pending_invoices SET status = 'paid' WHERE invoice_id = ?", (str(invoice_id),))
+            if invoice["status"] == "expired":
+                logger.warning("Invoice %s was paid after it expired; settling it anyway", invoice_id)
+                metrics.REGISTRY.inc("late_payments_total")
+                if self.reclaim:
+                    self.reclaim(invoice)
+            invoice["status"] = "paid"
+            self.fulfil(invoice)
+        return invoice
+
+    async def _settle_and_notify(self, invoice_id):
+        invoice = await self._settle(invoice_id)
+        if invoice:
+            try:
+                await self.notify(self.bot, invoice)
+            except Exception:
+                logger.exception("Failed to notify user %s about invoice %s", invoice["user_id"], invoice_id)
+        return invoice
+
+    async def check(self, invoice_id):
+        """Manual check from the buyer; returns ``(status, invoice)``.
+
+        ``status`` is ``"paid"`` when this call settled the invoice,
+        ``"settled"`` when it had already been settled, ``"expired"`` when it
+        expired unpaid, ``"unknown"`` for untracked invoices and otherwise
+        ``"pending"``.
+        """
+        invoice_id = str(invoice_id)
+        invoice = self._terminal.get(invoice_id)
+        if invoice is not None:
+            metrics.REGISTRY.inc("invoice_checks_total", source="cache")
+            return _reported(invoice), invoice
+        task = self._inflight.get(invoice_id)
+        if task is not None:
+            metrics.REGISTRY.inc("invoice_checks_total", source="inflight")
+            status, invoice = await asyncio.shield(task)
+            # Only the first caller reports "paid"; everyone else sees it as already settled.
+            return ("settled" if status == "paid" else status), invoice
+        task = asyncio.ensure_future(self._check(invoice_id))
+        self._inflight[invoice_id] = task
+        task.add_done_callback(lambda _: self._inflight.pop(invoice_id, None))
+        return await asyncio.shield(task)
+
+    async def _check(self, invoice_id):
+        invoice = await storage.run_read(get_pending_invoice, invoice_id)
+        if invoice is None:
+            return "unknown", None
+        if invoice["status"] == "paid":
+            self._remember(invoice)
+            metrics.REGISTRY.inc("invoice_checks_total", source="database")
+            return _reported(invoice), invoice
+        if self._pending_until.get(invoice_id, 0) > time.monotonic():
+            metrics.REGISTRY.inc("invoice_checks_total", source="pending_cache")
+            return _reported(invoice), invoice
+        metrics.REGISTRY.inc("invoice_checks_total", source="provider")
+        result = await self.check_invoice(invoice_id)
+        if result and str(result.get("status", "")).lower() == "paid":
+            settled = await self._settle(invoice_id)
+            if settled:
+                return "paid", settled
+            invoice = await storage.run_read(get_pending_invoice, invoice_id)
+            return _reported(invoice), invoice
+        now = time.monotonic()
+        if len(self._pending_until) >= TERMINAL_CACHE_SIZE:
+            self._pending_until = {key: until for key, until in self._pending_until.items() if until > now}
+        self._pending_until[invoice_id] = now + PENDING_CACHE_SECONDS
+        return _reported(invoice), invoice
+
+    async def supersede(self, invoice_id):
+        """Retire a pending invoice the buyer is replacing with a new checkout; returns it as it now stands.
+
+        The provider is asked first: if the invoice has been paid it is
+        settled (and the buyer notified) rather than expired, and comes back
+        with status ``paid``.  Otherwise it is expired, giving back what it
+        reserved; a payment that still arrives later is settled as a late one.
+        """
+        result = await self.check_invoice(invoice_id)
+        if result and str(result.get("status", "")).lower() == "paid":
+            await self._settle_and_notify(invoice_id)
+        else:
+            for invoice in await storage.run_write(self._expire, [invoice_id], time.time()):
+                self._remember(invoice)
+        return await storage.run_read(get_pending_invoice, invoice_id)
+
+    def _expire(self, invoice_ids, recheck_at):
+        """Expire those of ``invoice_ids`` still pending and release them; late payments are polled from ``recheck_at``."""
+        expired = []
+        with storage.transaction() as c:
+            for invoice_id in invoice_ids:
+                invoice = _as_invoice(c.execute(
+                    f"SELECT {', '.join(INVOICE_COLUMNS)} FROM pending_invoices WHERE invoice_id = ?",
+                    (str(invoice_id),)).fetchone())
+                if invoice is None or invoice["status"] != "pending":
+                    continue
+                c.execute("UPDATE pending_invoices SET status = 'expired', next_check_at = MAX(next_check_at, ?) "
+                          "WHERE invoice_id = ?", (recheck_at, str(invoice_id)))
+                if self.release:
+                    self.release(invoice)
+                invoice["status"] = "expired"
+                expired.append(invoice)
+        return expired
+
+    async def _poll(self, invoices):
+        """Ask the provider about ``invoices`` at once; settles the paid ones and returns ``(settled, unpaid)``."""
+        results = await asyncio.gather(*(self.check_invoice(inv["invoice_id"]) for inv in invoices),
+                                       return_exceptions=True)
+        settled = 0
+        unpaid = []
+        for invoice, result in zip(invoices, results):
+            if isinstance(result, dict) and str(result.get("status", "")).lower() == "paid":
+                if await self._settle_and_notify(invoice["invoice_id"]):
+                    settled += 1
+                continue
+            if isinstance(result, Exception):
+                logger.warning("Checking invoice %s failed: %r", invoice["invoice_id"], result)
+            unpaid.append(invoice)
+        return settled, unpaid
+
+    async def sweep(self, now=None):
+        """Check every due invoice in one batch; returns the number settled."""
+        now = time.time() if now is None else now
+        settled = 0
+        stale = await storage.run_read(get_stale_invoices, now - self.max_age, self.batch_size)
+        if stale:
+            # One last look before expiring, so a payment the webhook never reported isn't released.
+            settled, unpaid = await self._poll(stale)
+            for invoice in await storage.run_write(self._expire, [inv["invoice_id"] for inv in unpaid],
+                                                   now + self.poll_interval):
+                self._remember(invoice)
+        due = await storage.run_read(get_due_invoices, now, self.batch_size)
+        if not due:
+            return settled
+        count, unpaid = await self._poll(due)
+        settled += count
+        retry = []
+        for invoice in unpaid:
+            attempts = invoice["attempts"] + 1
+            next_check_at = now + backoff_delay(attempts)
+            grace_ends = invoice["created_at"] + self.max_age + LATE_PAYMENT_GRACE
+            if invoice["status"] == "expired" and next_check_at > grace_ends:
+                next_check_at = None
+            retry.append((attempts, next_check_at, invoice["invoice_id"]))
+        if retry:
+            await storage.run_write(storage.executemany,
+                                    "UPDATE pending_invoices SET attempts = ?, next_check_at = ? "
+                                    "WHERE invoice_id = ? AND status IN ('pending', 'expired')", retry)
+        return settled
+
+    async def _poll_forever(self):
+        while True:
+            try:
+                await self.sweep()
+            except Exception:
+                logger.exception("Invoice settlement sweep failed")
+            await asyncio.sleep(self.poll_interval)
+
+    async def handle_webhook(self, request):
+        if request.method != "POST" or request.path != WEBHOOK_PATH:
+            return 404, "text/plain", "not found"
+        if not verify_signature(self.webhook_secret, request.body, request.headers.get("hmac")):
+            return 403, "text/plain", "invalid signature"
+        try:
+            payload = json.loads(request.body)
+        except ValueError:
+            return 400, "text/plain", "invalid json"
+        if not isinstance(payload, dict):
+            return 400, "text/plain", "invalid payload"
+        invoice_id = payload.get("invoice_id") or payload.get("trackId")
+        if invoice_id and str(payload.get("status", "")).lower() == "paid":
+            await self._settle_and_notify(invoice_id)
+        return 200, "text/plain", "ok"
+
+    async def start(self, bot, webhook_host=None, webhook_port=None):
+        self.bot = bot
+        if webhook_port:
+            self._server = await httpserver.start_server(self.handle_webhook, webhook_host or "127.0.0.1", webhook_port)
+            logger.info("Payment webhook listening on %s:%s%s", webhook_host, webhook_port, WEBHOOK_PATH)
+        self._poller = asyncio.get_running_loop().create_task(self._poll_forever())
+
+    async def stop(self):
+        if self._poller:
+            self._poller.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._poller
+            self._poller = None
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
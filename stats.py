@@ -0,0 +1,70 @@
+"""Incrementally maintained statistics for the admin screens.
+
+Order and giveaway-entry totals are bumped inside the same transaction that
+writes the order or entry, so reading them is a handful of primary-key
+lookups however much history the database holds.  ``giveaways.entry_count``
+carries the per-giveaway entry total; enter_giveaway increments it with the
+conditional update that enforces ``max_entries``.
+"""
+from datetime import date
+
+import storage
+
+
+def backfill(c):
+    # One-off scan so counters start from existing history.
+    # An order is a checkout: the rows sharing an invoice are one order.
+    orders, revenue = c.execute("SELECT COUNT(DISTINCT COALESCE(invoice_id, 'order ' || id)), COALESCE(SUM(price), 0) "
+                                "FROM orders").fetchone()
+    entries = c.execute("SELECT COUNT(*) FROM giveaway_entries").fetchone()[0]
+    c.executemany("REPLACE INTO stats_counters (name, value) VALUES (?, ?)",
+                  [("orders", orders), ("revenue", revenue), ("giveaway_entries", entries), ("initialized", 1)])
+    c.execute("DELETE FROM product_stats")
+    c.execute('''INSERT INTO product_stats (product_id, product_name, orders, quantity, revenue)
+        SELECT product_id, MAX(product_name), COUNT(*), COALESCE(SUM(quantity), 0), COALESCE(SUM(price), 0)
+        FROM orders GROUP BY product_id''')
+
+
+def _bump(c, name, amount):
+    c.execute("INSERT INTO stats_counters (name, value) VALUES (?, ?) "
+              "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value", (name, amount))
+
+
+def record_order(c, lines):
+    """Count one checkout of ``(product_id, product_name, quantity, price)`` lines as one order."""
+    _bump(c, "orders", 1)
+    _bump(c, "revenue", sum(price or 0 for _, _, _, price in lines))
+    c.executemany('''INSERT INTO product_stats (product_id, product_name, orders, quantity, revenue) VALUES (?, ?, 1, ?, ?)
+        ON CONFLICT(product_id) DO UPDATE SET product_name = excluded.product_name, orders = orders + 1,
+        quantity = quantity + excluded.quantity, revenue = revenue + excluded.revenue''',
+                  [(product_id, product_name, quantity or 0, price or 0)
+                   for product_id, product_name, quantity, price in lines])
+
+
+def record_entry(c):
+    _bump(c, "giveaway_entries", 1)
+
+
+def recount_entries(c):
+    c.execute("UPDATE giveaways SET entry_count = (SELECT COUNT(*) FROM giveaway_entries e WHERE e.giveaway_id = giveaways.id)")
+    c.execute("REPLACE INTO stats_counters (name, value) SELECT 'giveaway_entries', COUNT(*) FROM giveaway_entries")
+
+
+def get_counters():
+    values = dict(storage.fetchall("SELECT name, value FROM stats_counters"))
+    return {
+        "orders": int(values.get("orders", 0)),
+        "revenue": round(values.get("revenue", 0), 2),
+        "giveaway_entries": int(values.get("giveaway_entries", 0)),
+    }
+
+
+def get_product_stats(limit=5):
+    return storage.fetchall("SELECT product_id, product_name, orders, quantity, revenue FROM product_stats "
+                            "ORDER BY revenue DESC LIMIT ?", (limit,))
+
+
+def get_active_giveaway_totals():
+    """``(active_giveaways, entries_in_active_giveaways)`` from maintained counts."""
+    return storage.fetchone("SELECT COUNT(*), COALESCE(SUM(entry_count), 0) FROM giveaways "
+                            "WHERE is_active = 1 AND end_date > ?", (date.today().isoformat(),))
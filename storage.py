@@ -0,0 +1,302 @@
+"""Shared SQLite storage layer used by every data function in bot.py.
+
+One long-lived writer connection (serialised by a lock) and a small pool of
+reader connections are opened per database file.  WAL journal mode lets the
+readers keep serving menu taps while a write is committing, and each
+connection keeps its compiled statements cached so repeated queries skip the
+parse/prepare step.
+
+Time spent waiting for a connection and holding the write lock is recorded
+in :mod:`metrics` along with the latency of each module-level call.
+
+Async handlers should not call these functions directly, since a slow disk
+would stall the event loop.  Use ``await run_read(fn, ...)``, which runs
+``fn`` on a small thread pool, or ``await run_write(fn, ...)``, which queues
+``fn`` for the :class:`GroupCommitWriter` thread.
+"""
+import asyncio
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import metrics
+
+DEFAULT_DB_PATH = "orders.db"
+READER_COUNT = 4
+STATEMENT_CACHE_SIZE = 256
+MAX_WRITE_BATCH = 256
+
+logger = logging.getLogger(__name__)
+
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA mmap_size=134217728",
+    "PRAGMA busy_timeout=5000",
+)
+
+
+def _connect(path):
+    # isolation_level=None: transactions are opened explicitly by the pool,
+    # so readers never hold a snapshot open between queries.
+    conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None,
+                           cached_statements=STATEMENT_CACHE_SIZE)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+class ConnectionPool:
+    def __init__(self, path=DEFAULT_DB_PATH, readers=READER_COUNT):
+        self.path = path
+        self._writer = _connect(path)
+        self._write_lock = threading.RLock()
+        self._readers = queue.Queue()
+        self._all_readers = []
+        for _ in range(readers):
+            conn = _connect(path)
+            conn.execute("PRAGMA query_only=ON")
+            self._readers.put(conn)
+            self._all_readers.append(conn)
+        self._reader_wait = metrics.REGISTRY.histogram("storage_lock_wait_seconds", conn="reader")
+        self._writer_wait = metrics.REGISTRY.histogram("storage_lock_wait_seconds", conn="writer")
+        self._write_held = metrics.REGISTRY.histogram("storage_transaction_seconds")
+
+    @contextmanager
+    def reader(self):
+        started = time.perf_counter()
+        conn = self._readers.get()
+        self._reader_wait.observe(time.perf_counter() - started)
+        try:
+            yield conn
+        finally:
+            self._readers.put(conn)
+
+    @contextmanager
+    def writer(self):
+        started = time.perf_counter()
+        with self._write_lock:
+            conn = self._writer
+            if conn.in_transaction:
+                # Nested use on the same thread joins the outer transaction.
+                yield conn
+                return
+            acquired = time.perf_counter()
+            self._writer_wait.observe(acquired - started)
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            else:
+                conn.execute("COMMIT")
+            finally:
+                self._write_held.observe(time.perf_counter() - acquired)
+
+    def close(self):
+        with self._write_lock:
+            self._writer.close()
+        for conn in self._all_readers:
+            conn.close()
+
+
+_pool = None
+_pool_path = DEFAULT_DB_PATH
+_pool_lock = threading.Lock()
+
+
+def configure(path=DEFAULT_DB_PATH, readers=READER_COUNT):
+    """Point the shared pool at ``path``, closing any previously opened pool."""
+    global _pool, _pool_path
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+        _pool_path = path
+        _pool = ConnectionPool(path, readers)
+    return _pool
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(_pool_path)
+    return _pool
+
+
+def close():
+    global _pool, _writer, _read_executor
+    with _pool_lock:
+        writer, executor, _writer, _read_executor = _writer, _read_executor, None, None
+    # Outside the lock: the writer may still need get_pool() to finish its last batch.
+    if writer is not None:
+        writer.stop()
+    if executor is not None:
+        executor.shutdown()
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+
+def transaction():
+    return get_pool().writer()
+
+
+@metrics.timed("storage_query", op="fetchall")
+def fetchall(sql, params=()):
+    with get_pool().reader() as conn:
+        return conn.execute(sql, params).fetchall()
+
+
+@metrics.timed("storage_query", op="fetchone")
+def fetchone(sql, params=()):
+    with get_pool().reader() as conn:
+        return conn.execute(sql, params).fetchone()
+
+
+def iter_rows(sql, params=(), chunk_size=1000):
+    """Stream a large result set in ``chunk_size`` batches without materialising it.
+
+    Holds one reader connection until the generator is exhausted or closed.
+    """
+    with get_pool().reader() as conn:
+        cursor = conn.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield from rows
+
+
+@metrics.timed("storage_query", op="execute")
+def execute(sql, params=()):
+    """Run a single write statement in its own transaction, returning the cursor."""
+    with transaction() as conn:
+        return conn.execute(sql, params)
+
+
+@metrics.timed("storage_query", op="executemany")
+def executemany(sql, seq_of_params):
+    with transaction() as conn:
+        return conn.executemany(sql, seq_of_params)
+
+
+class GroupCommitWriter:
+    """Dedicated thread that commits queued write functions in batches.
+
+    Whatever is queued while a commit is in progress goes into the next
+    transaction together, up to ``MAX_WRITE_BATCH`` functions.  Each function
+    runs inside its own SAVEPOINT, so one that raises is rolled back alone and
+    only its caller gets the exception.  Results are delivered after the
+    batch commits.
+
+    Functions run with the write transaction already open, so the module
+    functions and ``transaction()`` join it.  A function that writes and then
+    reads its own changes must read through the transaction connection, not
+    ``fetchone``/``fetchall``, because readers only see committed data.
+    """
+
+    def __init__(self, max_batch=MAX_WRITE_BATCH):
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._queue_wait = metrics.REGISTRY.histogram("storage_write_queue_seconds")
+        self._thread = threading.Thread(target=self._run, name="sqlite-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, loop, future, fn, args, kwargs):
+        self._queue.put((loop, future, fn, args, kwargs, time.perf_counter()))
+
+    def stop(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._commit(batch)
+                    return
+                batch.append(item)
+            self._commit(batch)
+
+    def _commit(self, batch):
+        started = time.perf_counter()
+        outcomes = []
+        try:
+            with transaction() as conn:
+                for _, _, fn, args, kwargs, queued_at in batch:
+                    self._queue_wait.observe(started - queued_at)
+                    conn.execute("SAVEPOINT queued_write")
+                    try:
+                        result = fn(*args, **kwargs)
+                    except Exception as e:
+                        conn.execute("ROLLBACK TO queued_write")
+                        outcomes.append((None, e))
+                    else:
+                        outcomes.append((result, None))
+                    finally:
+                        conn.execute("RELEASE queued_write")
+        except Exception as e:
+            logger.exception("Group commit of %d writes failed", len(batch))
+            outcomes = [(None, e)] * len(batch)
+        metrics.REGISTRY.inc("storage_write_batches_total")
+        metrics.REGISTRY.inc("storage_writes_total", len(batch))
+        for (loop, future, *_), (result, error) in zip(batch, outcomes):
+            try:
+                loop.call_soon_threadsafe(_resolve, future, result, error)
+            except RuntimeError:
+                # The caller's event loop has already closed (shutdown); the write itself is committed.
+                pass
+
+
+def _resolve(future, result, error):
+    if future.cancelled():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+_writer = None
+_read_executor = None
+
+
+async def run_write(fn, *args, **kwargs):
+    """Run ``fn(*args, **kwargs)`` on the writer thread; resolves once its batch has committed."""
+    global _writer
+    if _writer is None:
+        with _pool_lock:
+            if _writer is None:
+                _writer = GroupCommitWriter()
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    _writer.submit(loop, future, fn, args, kwargs)
+    return await future
+
+
+async def run_read(fn, *args, **kwargs):
+    """Run a read-only ``fn(*args, **kwargs)`` on the reader thread pool."""
+    global _read_executor
+    if _read_executor is None:
+        with _pool_lock:
+            if _read_executor is None:
+                _read_executor = ThreadPoolExecutor(READER_COUNT, thread_name_prefix="sqlite-reader")
+    return await asyncio.get_running_loop().run_in_executor(_read_executor, lambda: fn(*args, **kwargs))
@@ -0,0 +1,187 @@
+"""Multi-process mode: one intake process feeding ``WORKERS`` bot processes.
+
+The intake process only receives updates, by polling or webhook exactly as
+the single-process bot would, and forwards each one to the worker that owns
+its user, ``user_id % WORKERS`` (chat id when there is no user).  A user's
+updates always land on the same worker, so process-local state
+(``user_data``, carts, the persistence cache) never has to be shared.
+
+Within a process, updates run ``CONCURRENT_UPDATES`` at a time, but
+:class:`PerUserUpdateProcessor` runs each user's one after another in the
+order they arrived, so a double-tapped button cannot interleave two
+handlers over the same cart.  This holds in single-process mode too.
+
+Each worker is a full Application with every handler, its own event loop
+and its own SQLite connections.  Anything shared lives in the database:
+orders, stats counters, discount usage, broadcast jobs and pending
+invoices.  Background jobs (the settlement sweep and webhook, and sending
+broadcasts) run only on worker 0.  A broadcast started on any other worker
+is stored as a queued job, and worker 0 picks it up on its next poll.
+
+Caches are per process.  A code added with /addcode on one worker reaches
+the others after ``DISCOUNT_CACHE_SECONDS``, and /reload_catalog reloads
+only the worker that handled it (file and db catalogs are re-checked every
+``CATALOG_RELOAD_SECONDS`` anyway).
+"""
+import asyncio
+import json
+import logging
+import multiprocessing
+import queue
+import signal
+
+from telegram import Bot, Update
+from telegram.ext import BaseUpdateProcessor, Updater
+
+INBOX_SIZE = 10000
+SHUTDOWN_TIMEOUT = 30
+
+# Set in each worker process before the Application is built.
+WORKER_INDEX = 0
+WORKER_COUNT = 1
+
+logger = logging.getLogger(__name__)
+
+
+def owns_background_jobs():
+    return WORKER_INDEX == 0
+
+
+def user_key(update):
+    if not isinstance(update, Update):
+        return None
+    if update.effective_user:
+        return update.effective_user.id
+    if update.effective_chat:
+        return update.effective_chat.id
+    return None
+
+
+def shard_of(update, count):
+    return (user_key(update) or 0) % count
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Up to ``max_concurrent_updates`` updates at once, but only one per user at a time.
+
+    A user's queued updates wait on that user's lock (asyncio locks are
+    first come, first served) while holding a concurrency slot; the rate
+    limit gate turns a flood away quickly, so this costs other users little.
+    """
+
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        self._locks = {}
+        self._waiting = {}
+
+    async def do_process_update(self, update, coroutine):
+        key = user_key(update)
+        if key is None:
+            await coroutine
+            return
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        self._waiting[key] = self._waiting.get(key, 0) + 1
+        try:
+            async with lock:
+                await coroutine
+        finally:
+            self._waiting[key] -= 1
+            if not self._waiting[key]:
+                del self._waiting[key]
+                del self._locks[key]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+
+def run(build_application, count, token, start_intake):
+    """Start ``count`` workers and feed them updates until interrupted.
+
+    ``build_application`` must be a module-level function (it is pickled into
+    each worker).  ``start_intake(updater)`` starts polling or the webhook on
+    the intake process's Updater.
+    """
+    context = multiprocessing.get_context("spawn")
+    inboxes = [context.Queue(INBOX_SIZE) for _ in range(count)]
+    processes = [context.Process(target=_worker_main, args=(build_application, index, count, inbox),
+                                 name=f"bot-worker-{index}")
+                 for index, inbox in enumerate(inboxes)]
+    for process in processes:
+        process.start()
+    try:
+        asyncio.run(_intake(token, start_intake, inboxes, processes))
+    finally:
+        for inbox in inboxes:
+            inbox.put(None)
+        for process in processes:
+            process.join(SHUTDOWN_TIMEOUT)
+            if process.is_alive():
+                logger.warning("%s did not stop in %ss; terminating", process.name, SHUTDOWN_TIMEOUT)
+                process.terminate()
+
+
+async def _intake(token, start_intake, inboxes, processes):
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    updates = asyncio.Queue()
+    async with Updater(Bot(token), updates) as updater:
+        await start_intake(updater)
+        logger.info("Intake forwarding updates to %d workers", len(inboxes))
+        while not stop.is_set():
+            try:
+                update = await asyncio.wait_for(updates.get(), timeout=1)
+            except asyncio.TimeoutError:
+                dead = [process.name for process in processes if not process.is_alive()]
+                if dead:
+                    logger.error("Worker process exited (%s); shutting down", ", ".join(dead))
+                    break
+                continue
+            await _forward(loop, inboxes, update)
+        await updater.stop()
+        while not updates.empty():
+            await _forward(loop, inboxes, updates.get_nowait())
+
+
+async def _forward(loop, inboxes, update):
+    inbox = inboxes[shard_of(update, len(inboxes))]
+    data = update.to_json()
+    try:
+        inbox.put_nowait(data)
+    except queue.Full:
+        # The worker is behind; wait for room without blocking the other shards.
+        await loop.run_in_executor(None, inbox.put, data)
+
+
+def _worker_main(build_application, index, count, inbox):
+    global WORKER_INDEX, WORKER_COUNT
+    WORKER_INDEX, WORKER_COUNT = index, count
+    # Ctrl-C reaches the whole process group; the intake process decides when workers stop.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_serve(build_application(), inbox))
+
+
+async def _serve(app, inbox):
+    loop = asyncio.get_running_loop()
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    await app.start()
+    logger.info("Worker %d of %d started", WORKER_INDEX, WORKER_COUNT)
+    try:
+        while True:
+            data = await loop.run_in_executor(None, inbox.get)
+            if data is None:
+                break
+            await app.update_queue.put(Update.de_json(json.loads(data), app.bot))
+    finally:
+        await app.stop()
+        await app.shutdown()
+        if app.post_shutdown:
+            await app.post_shutdown(app)